@@ -25,13 +25,26 @@ import io
 from torch_geometric.data.data import Data
 from torch_geometric.loader import DataLoader
 
-from .gnn_training_utils import check_if_graph_is_connected, pass_data_iteratively
+from .gnn_training_utils import check_if_graph_is_connected, pass_data_iteratively, pass_data_chebconv, chebconv_forward, stack_node_features, FixedTopologyLoader
 from .dataset import generate, load_OMICS_dataset, convert_to_s2vgraph
 from .gnn_explainer import GNNExplainer
 from .graphcnn  import GraphCNN
-from .graphcheb import GraphCheb, ChebConvNet, test_model_acc, test_model
-
-from .community_detection import find_communities
+from .graphcheb import GraphCheb, ChebConvNet, test_model_acc, test_model, test_model_basis, chebyshev_basis_cohort
+from .ensemble import ModelEnsemble
+from .parallel_explainer import iter_node_masks
+from .streaming import stream_runs
+from .mask_stats import RunningStats
+from .inference import feature_tensor, predict_logits
+from .model_bundle import save_model_bundle, load_model_bundle
+from .attribution import node_attributions, cohort_node_mask
+from .occlusion import occlusion_importance
+from .shapley import module_shapley
+from .module_significance import module_permutation_test
+from .PGExplainer import PGExplainer, map_edge_weights
+from .explain_cache import ExplanationCache, fingerprint
+from .results_bundle import save_bundle, write_text, BUNDLE_NAME
+
+from .community_detection import find_communities, community_sweep, consensus_communities
 from .edge_importance import calc_edge_importance
 
 from torch_geometric.nn.conv.cheb_conv import ChebConv
@@ -384,6 +397,15 @@ class GATLayer(torch.nn.Module):
 
 
 
+# GNNExplainer method used to explain each classifier
+EXPLAIN_FN = {
+    "graphcnn":  "explain_graph_modified_s2v",
+    "chebconv":  "explain_graph_modified_cheb",
+    "graphcheb": "explain_graph_modified_cheb2",
+    "chebnet":   "explain_graph_modified_cheb2",
+}
+
+
 class GNNSubNet(object):
     """
     The class GNNSubSet represents the main user API for the
@@ -398,10 +420,19 @@ class GNNSubNet(object):
         self.dataset = None
         self.model_status = None
         self.model = None
+        self.model_config = None
         self.gene_names = None
         self.accuracy = None
         self.confusion_matrix = None
         self.test_loss = None
+        self.random_seed = random_seed
+        self.normalize = normalize
+        self.save_format = "bundle"  # "bundle": <location>/results.gnnsubnet, "text": legacy csv/txt files
+        self.detection_alg = "louvain"  # community detection: "louvain", "leiden" or "opt_modularity"
+        self.resolution = 1.0
+        self.consensus_threshold = None  # e.g. 0.5: consensus modules of the single explainer runs
+        self.keep_runs = False  # keep the masks of every explainer run (node_mask_matrix, run_edge_masks) on disk
+        self.mask_quantiles = None  # e.g. (0.05, 0.5, 0.95): quantiles of the masks across explainer runs
         
         
         self.use_attention = False  
@@ -416,6 +447,37 @@ class GNNSubNet(object):
 
         # Flags for internal use (hidden from user)
         self._explainer_run = False
+        self._explainer_pred = None
+        self._inference_template = None
+        self._explain_cache_key = None
+        self.explainer_epochs = None
+
+        # Set without data as well, e.g. for models restored by load_bundle()
+        self.classifier = None
+        self.true_class = None
+        self.predictions = None
+        self.s2v_test_dataset = None
+        self.edges = None
+
+        self.edge_mask = None
+        self.node_mask = None
+        self.node_mask_matrix = None
+        self.patient_node_masks = None
+        self.node_attributions = None
+        self.occlusion_importances = None
+        self.module_shapley_values = None
+        self.module_significance = None
+        self.patient_edge_masks = None
+        self.modules = None
+        self.module_hierarchy = None
+        self.module_stability = None
+        self.run_edge_masks = None
+        self.node_mask_std = None
+        self.edge_mask_std = None
+        self.node_mask_quantiles = None
+        self.edge_mask_quantiles = None
+        self.provisional_modules = None
+        self.module_importances = None
 
         if ppi == None:
             return None
@@ -441,17 +503,9 @@ class GNNSubNet(object):
         #print('\n')
 
         self.dataset = dataset
-        self.true_class = None
         self.gene_names = gene_names
-        self.s2v_test_dataset = None
         self.edges =  np.transpose(np.array(dataset[0].edge_index))
 
-        self.edge_mask = None
-        self.node_mask = None
-        self.node_mask_matrix = None
-        self.modules = None
-        self.module_importances = None
-
     def summary(self):
         """
         Print a summary for the GNNSubSet object's current state.
@@ -470,7 +524,8 @@ class GNNSubNet(object):
 ##########################################################################
 
 
-    def train(self, epoch_nr = 20, method="graphcnn", learning_rate=0.01, use_attention=False):
+    def train(self, epoch_nr = 20, method="graphcnn", learning_rate=0.01, use_attention=False, n_models=1,
+              precompute_basis=False):
 
         
         #if use_attention:
@@ -483,7 +538,13 @@ class GNNSubNet(object):
             self.add_graph_attention_layer(self.attention_units)  # adding a GAT layer
             
 #####################################################################################
-        
+
+        if n_models > 1:
+            print(f"{method} ensemble of {n_models} models for training ...")
+            self.train_ensemble(n_models=n_models, method=method, epoch_nr=epoch_nr, learning_rate=learning_rate)
+            self.classifier=method
+            return
+
         if method=="chebconv":
             print("chebconv for training ...")
             self.train_chebconv(epoch_nr = epoch_nr)
@@ -501,7 +562,7 @@ class GNNSubNet(object):
 
         if method=="chebnet":
             print("chebnet for training ...")
-            self.train_chebnet(epoch_nr = epoch_nr)
+            self.train_chebnet(epoch_nr = epoch_nr, precompute_basis=precompute_basis)
             self.classifier="chebnet"
             
 ##################################################################################### 
@@ -533,24 +594,112 @@ class GNNSubNet(object):
 #####################################################################################      
 
 
-    def explain(self, n_runs=1, classifier="graphcnn", communities=True):
+    def explain(self, n_runs=1, classifier="graphcnn", communities=True, n_jobs=1,
+                max_epochs=300, min_epochs=None, tol=1e-2, method="explainer", cache=False, save_format=None):
+        """
+        method: "explainer" (modified GNNExplainer), "pgexplainer" (graphcnn and graphcheb)
+                or one of the gradient based attributions "saliency", "gradxinput",
+                "smoothgrad", "ig"
+        n_jobs: with n_jobs > 1 the n_runs explainer runs are distributed over
+                worker processes instead of being optimized together
+        max_epochs, min_epochs, tol: every run optimizes max_epochs epochs. With min_epochs
+                (e.g. 100) a run stops early after min_epochs once the relative change of
+                its node mask and loss within a resample window is below tol.
+                The epochs used per run are stored in self.explainer_epochs
+        cache:  if True, results are cached in <location>/.explain_cache, keyed by model weights,
+                test set, method and hyperparameters. A hit restores the masks and modules;
+                for a larger n_runs only the missing explainer runs are computed
+        save_format: "bundle" writes all results at full precision to <location>/results.gnnsubnet
+                (see results_bundle.to_text for the text files), "text" writes the legacy
+                csv/txt files. Default: self.save_format
+        """
+        if save_format is not None:
+            self.save_format = save_format
+
+        epochs = dict(max_epochs=max_epochs, min_epochs=min_epochs, tol=tol)
+
+        key = None
+        if cache:
+            params = dict(classifier=self.classifier, detection_alg=self.detection_alg, resolution=self.resolution,
+                          consensus_threshold=self.consensus_threshold, mask_quantiles=self.mask_quantiles,
+                          keep_runs=self.keep_runs,
+                          **(epochs if method == "explainer" else {}))
+            key = fingerprint(self.model, self.s2v_test_dataset, method, params)
+            if self._restore_explanation(key, n_runs if method == "explainer" else 1, communities):
+                return
+
+        # run level cache, used by _explainer_runs
+        self._explain_cache_key = key if method == "explainer" else None
+        # set again by the explain_* method once it has results, masks of earlier calls are never cached
+        self._explainer_run = False
+        try:
+            if method == "pgexplainer":
+                self.explain_pgexplainer(communities=communities)
 
-        if self.classifier=="chebconv":
-            self.explain_chebconv(n_runs=n_runs, communities=communities)
+            elif method != "explainer":
+                self.explain_attribution(method=method, communities=communities)
 
-        if self.classifier=="graphcnn":
-            self.explain_graphcnn(n_runs=n_runs, communities=communities)      
-    
-        if self.classifier=="graphcheb":
-            self.explain_graphcheb(n_runs=n_runs, communities=communities)
+            elif self.classifier=="chebconv":
+                self.explain_chebconv(n_runs=n_runs, communities=communities, n_jobs=n_jobs, **epochs)
 
-        if self.classifier=="chebnet":
-            self.explain_graphcheb(n_runs=n_runs, communities=communities)
+            elif self.classifier=="graphcnn":
+                self.explain_graphcnn(n_runs=n_runs, communities=communities, n_jobs=n_jobs, **epochs)      
+        
+            elif self.classifier=="graphcheb":
+                self.explain_graphcheb(n_runs=n_runs, communities=communities, n_jobs=n_jobs, **epochs)
+
+            elif self.classifier=="chebnet":
+                self.explain_graphcheb(n_runs=n_runs, communities=communities, n_jobs=n_jobs, **epochs)
+        finally:
+            self._explain_cache_key = None
+
+        if key is not None and self._explainer_run:
+            ExplanationCache(self.location).save_result(key, n_runs if method == "explainer" else 1,
+                                                        self.edge_mask, self.node_mask, self.node_mask_matrix,
+                                                        self.modules if communities else None,
+                                                        self.module_importances if communities else None,
+                                                        node_mask_std=self.node_mask_std,
+                                                        edge_mask_std=self.edge_mask_std,
+                                                        node_mask_quantiles=self.node_mask_quantiles,
+                                                        edge_mask_quantiles=self.edge_mask_quantiles)
+
+    def _restore_explanation(self, key, n_runs, communities):
+        """
+        Restores a cached explain() result, returns False on a cache miss.
+        """
+        result = ExplanationCache(self.location).load_result(key, n_runs)
+        if result is None or (communities and result["modules"] is None):
+            return False
+
+        print("Explainer::restored from cache")
+        self.edge_mask = result["edge_mask"]
+        self.node_mask = result["node_mask"]
+        self.node_mask_matrix = result["node_mask_matrix"]
+        self.run_edge_masks = None
+        self.node_mask_std = result["node_mask_std"]
+        self.edge_mask_std = result["edge_mask_std"]
+        self.node_mask_quantiles = result["node_mask_quantiles"]
+        self.edge_mask_quantiles = result["edge_mask_quantiles"]
+        self.module_stability = None
 
+        if communities:
+            self.modules = result["modules"]
+            self.module_importances = result["module_importances"]
+
+        self._explainer_run = True
+        self._save_explanation("cache", communities=communities, n_runs=n_runs)
+        return True
 
 
-    def predict(self, gnnsubnet_test, classifier="graphcnn"):
-    
+
+    def predict(self, gnnsubnet_test, classifier="graphcnn", genes=None, fill=0.0, batch_size=256):
+        """
+        gnnsubnet_test: a GNNSubNet object with the test data, or raw features
+                        (see predict_proba), which are classified without labels
+        """
+        if not isinstance(gnnsubnet_test, GNNSubNet):
+            return self.predict_proba(gnnsubnet_test, genes=genes, fill=fill, batch_size=batch_size).argmax(1)
+
         if self.classifier=="chebconv":
             pred = self.predict_chebconv(gnnsubnet_test=gnnsubnet_test)
 
@@ -568,13 +717,94 @@ class GNNSubNet(object):
 
         return pred
 
+    def predict_proba(self, features, genes=None, fill=0.0, batch_size=256):
+        """
+        Class probabilities of new patients, reusing the topology, gene order and
+        normalization of the training data. No labels are needed.
+        features: DataFrame patients x genes (a list of DataFrames for several
+                  feature files) or an array [patients, genes(, features)]
+        genes:    gene names of the array columns (default: the training gene order)
+        fill:     value for genes missing in features
+        :return: [patients, classes] array
+        """
+        x = feature_tensor(features, self.gene_names, genes=genes, fill=fill, normalize=self.normalize)
+        kind = GNNExplainer.kinds[EXPLAIN_FN[self.classifier]]
+        logits = predict_logits(self.model, kind, self._topology_template(kind), x, batch_size=batch_size)
+        return F.softmax(logits, dim=1).numpy()
+
+    def _topology_template(self, kind):
+        """
+        One graph of the training topology for batched forwards.
+        """
+        if self._inference_template is None or self._inference_template[0] != kind:
+            if self.dataset is not None:
+                template = self.dataset[0]
+            else:
+                # loaded from a model bundle: only the topology, no patients
+                template = Data(x=torch.zeros(len(self.gene_names), self.n_node_features),
+                                edge_index=torch.from_numpy(np.asarray(self.edges.T, dtype=np.int64)),
+                                y=torch.tensor(0))
+            if kind == "s2v":
+                template = convert_to_s2vgraph([template])[0]
+            self._inference_template = (kind, template)
+        return self._inference_template[1]
+
+    def save_bundle(self, path):
+        """
+        Saves the trained model with its architecture, topology, gene order and
+        normalization to one file, which load_bundle() restores without the
+        PPI and feature files.
+        """
+        if self.model is None or self.model_config is None:
+            print("No trained model, run train() first")
+            return
+
+        if self.dataset is not None:
+            edge_index = self.dataset[0].edge_index
+            n_node_features = self.dataset[0].x.shape[1]
+        else:
+            # model loaded from a bundle
+            edge_index = self.edges.T
+            n_node_features = self.n_node_features
+
+        metadata = dict(classifier=self.classifier, normalize=bool(self.normalize),
+                        n_node_features=int(n_node_features), random_seed=self.random_seed,
+                        accuracy=None if self.accuracy is None else float(self.accuracy))
+        save_model_bundle(path, self.model, self.model_config, edge_index, self.gene_names, metadata=metadata)
+
+    @staticmethod
+    def load_bundle(path):
+        """
+        GNNSubNet object with the model of a bundle written by save_bundle(),
+        ready for predict_proba() / predict() and explanations of new patients.
+        """
+        model, edge_index, gene_names, metadata = load_model_bundle(path)
+
+        g = GNNSubNet(location=os.path.dirname(os.path.abspath(path)), random_seed=metadata["random_seed"])
+        g.model = model
+        g.model_config = metadata["model_config"]
+        g.model_status = 'Trained'
+        g.classifier = metadata["classifier"]
+        g.normalize = metadata["normalize"]
+        g.accuracy = metadata["accuracy"]
+        g.n_node_features = metadata["n_node_features"]
+        g.gene_names = gene_names
+        g.edges = np.transpose(edge_index)
+        return g
+
     def train_chebnet(self, epoch_nr=25, shuffle=True, weights=False,
                         hidden_channels=10,
                         K=10,
                         layers_nr=1,
-                        num_classes=2):
+                        num_classes=2,
+                        precompute_basis=False,
+                        basis_path=None):
         """
-        ---
+        precompute_basis: The single ChebConv layer applies the fixed basis T_k(L~)x to every patient.
+                          If True, the [patients, nodes, K, features] basis is computed once and the
+                          epochs only train the weights on it (dense products, no graph propagation).
+        basis_path: directory for memory-mapped basis files. Defaults to the dataset location
+                    when the basis would exceed 1GB, otherwise the basis is kept in memory.
         """
         use_weights = False
 
@@ -670,27 +900,51 @@ class GNNSubNet(object):
         epochs_no_improve = 0
         batch_size = 100
 
-        train_loader = DataLoader(s2v_train_dataset, batch_size=batch_size, shuffle=True)
-        test_loader = DataLoader(s2v_test_dataset, batch_size=batch_size, shuffle=False)
+        # all patients share the PPI topology: batches are gathered from one cohort tensor
+        train_loader = FixedTopologyLoader(s2v_train_dataset, batch_size=batch_size, shuffle=True)
+        test_loader = FixedTopologyLoader(s2v_test_dataset, batch_size=batch_size, shuffle=False)
+
+        if precompute_basis:
+            train_basis = self._chebyshev_basis(s2v_train_dataset, model.K, basis_path, "train")
+            test_basis  = self._chebyshev_basis(s2v_test_dataset, model.K, basis_path, "test")
+            train_y = torch.LongTensor([graph.y for graph in s2v_train_dataset])
+            test_y  = torch.LongTensor([graph.y for graph in s2v_test_dataset])
 
         for epoch in range(epoch_nr):
             running_loss = 0.0
             steps = 0
             model.train()
             # data_pbar_loader = tqdm(train_loader, unit='batch')
-            for data in train_loader:
-                out = model(x=data.x, edge_index=data.edge_index, batch=data.batch)
-                loss = criterion(out, data.y)  # Compute the loss.
-                loss.backward()  # Derive gradients.
-                optimizer.step()  # Update parameters based on gradients.
-                optimizer.zero_grad()  # Clear gradients.
-                running_loss += loss.item()
-                steps += 1
+            if precompute_basis:
+                perm = np.random.permutation(len(train_y))
+                for start in range(0, len(perm), batch_size):
+                    # sorted indices keep reads from a memory-mapped basis sequential
+                    idx = np.sort(perm[start:start+batch_size])
+                    out = model.forward_basis(torch.from_numpy(train_basis[idx]))
+                    loss = criterion(out, train_y[idx])
+                    loss.backward()
+                    optimizer.step()
+                    optimizer.zero_grad()
+                    running_loss += loss.item()
+                    steps += 1
+            else:
+                for data in train_loader:
+                    out = model(x=data.x, edge_index=data.edge_index, batch=data.batch)
+                    loss = criterion(out, data.y)  # Compute the loss.
+                    loss.backward()  # Derive gradients.
+                    optimizer.step()  # Update parameters based on gradients.
+                    optimizer.zero_grad()  # Clear gradients.
+                    running_loss += loss.item()
+                    steps += 1
 
             epoch_loss = running_loss / steps
             model.eval()
-            acc_train = test_model_acc(train_loader, model)
-            val_loss, val_acc, _ , _ = test_model(test_loader, model, criterion)
+            if precompute_basis:
+                acc_train = test_model_basis(train_basis, train_y, model)[1]
+                val_loss, val_acc, _ , _ = test_model_basis(test_basis, test_y, model, criterion)
+            else:
+                acc_train = test_model_acc(train_loader, model)
+                val_loss, val_acc, _ , _ = test_model(test_loader, model, criterion)
 
             print()
             print(f'Epoch: {epoch:03d}, Train Loss: {epoch_loss:.4f}, Train Acc: {acc_train:.4f}, Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.4f}', end='\t')
@@ -741,7 +995,10 @@ class GNNSubNet(object):
         # loading the parameters of the best model
         model.load_state_dict(best_model.state_dict())
 
-        _, _, true_labels, predicted_labels = test_model(test_loader, model, criterion)
+        if precompute_basis:
+            _, _, true_labels, predicted_labels = test_model_basis(test_basis, test_y, model, criterion)
+        else:
+            _, _, true_labels, predicted_labels = test_model(test_loader, model, criterion)
 
 
         # test_loss = 0
@@ -777,6 +1034,9 @@ class GNNSubNet(object):
 
         self.model_status = 'Trained'
         self.model = copy.deepcopy(model)
+        self.model_config = dict(model="ChebConvNet", n_models=1,
+                                 kwargs=dict(input_channels=1, n_features=nodes_per_graph_nr, n_channels=2,
+                                             n_classes=2, K=8, n_layers=1))
         self.accuracy = acc_bal
         self.confusion_matrix = confusion_matrix_gnn
         # self.test_loss = test_loss
@@ -785,6 +1045,26 @@ class GNNSubNet(object):
         self.true_class = true_labels
     
     
+    def _chebyshev_basis(self, graphs, K, basis_path=None, name="train"):
+        """
+        Precompute the Chebyshev basis signals of graphs, memory-mapped for large cohorts.
+        """
+        n_nodes, n_features = graphs[0].x.shape
+        shape = (len(graphs), n_nodes, K, n_features)
+        nbytes = 4 * np.prod(shape)
+
+        if basis_path is None and nbytes > 2**30:
+            basis_path = self.location if self.location is not None else "."
+
+        out = None
+        if basis_path is not None:
+            Path(basis_path).mkdir(parents=True, exist_ok=True)
+            out = np.lib.format.open_memmap(f'{basis_path}/chebyshev_basis_{name}.npy', mode='w+',
+                                            dtype=np.float32, shape=shape)
+            print(f"Chebyshev basis ({name}, {nbytes/2**20:.0f}MB) memory-mapped to {basis_path}/chebyshev_basis_{name}.npy")
+
+        return chebyshev_basis_cohort(graphs, K, lambda_max=2.0, out=out)
+
     def train_graphcheb(self, epoch_nr = 20, shuffle=True, weights=False,
                     hidden_channels=7,
                     K=5,
@@ -895,6 +1175,10 @@ class GNNSubNet(object):
         epochs_no_improve = 0
         steps_per_epoch = 35
 
+        # collation is cached: the batch structure is tiled once, features are gathered by index
+        train_loader = FixedTopologyLoader(s2v_train_dataset, batch_size=len(s2v_train_dataset), shuffle=False)
+        test_loader  = FixedTopologyLoader(s2v_test_dataset, batch_size=len(s2v_test_dataset), shuffle=False)
+
         for epoch in range(epoch_nr):
             model.train()
             pbar = tqdm(range(steps_per_epoch), unit='batch')
@@ -902,13 +1186,10 @@ class GNNSubNet(object):
             for pos in pbar:
                 
                 selected_idx = np.random.permutation(len(s2v_train_dataset))[:32]
-                batch_graph_x = [s2v_train_dataset[idx] for idx in selected_idx]
-                batch_graph = DataLoader(batch_graph_x, batch_size=32, shuffle=False)
-                
-                for batch_graph_y in batch_graph:
-                    logits = model(batch_graph_y.x, batch_graph_y.edge_index, batch_graph_y.batch)
+                batch_graph_y = train_loader.collate(selected_idx)
+                logits = model(batch_graph_y.x, batch_graph_y.edge_index, batch_graph_y.batch)
 
-                labels = torch.LongTensor([graph.y for graph in batch_graph_x])
+                labels = batch_graph_y.y
                 if use_weights:
                     loss = nn.CrossEntropyLoss(weight=weight)(logits,labels)
                 else:
@@ -923,8 +1204,7 @@ class GNNSubNet(object):
             epoch_loss /= steps_per_epoch
             model.eval()
             
-            tr = DataLoader(s2v_train_dataset, batch_size=len(s2v_train_dataset), shuffle=False)
-            for vv in tr:
+            for vv in train_loader:
                 output = model(vv.x, vv.edge_index, vv.batch)
             
             #output = pass_data_iteratively(model, s2v_train_dataset)
@@ -940,8 +1220,7 @@ class GNNSubNet(object):
             pbar.set_description('epoch: %d' % (epoch))
             val_loss = 0
             
-            tr = DataLoader(s2v_test_dataset, batch_size=len(s2v_test_dataset), shuffle=False)
-            for vv in tr:
+            for vv in test_loader:
                 output = model(vv.x, vv.edge_index, vv.batch)
 
             #output = pass_data_iteratively(model, s2v_test_dataset)
@@ -986,8 +1265,7 @@ class GNNSubNet(object):
 
         model.load_state_dict(best_model.state_dict())
 
-        tr = DataLoader(s2v_test_dataset, batch_size=len(s2v_test_dataset), shuffle=False)
-        for vv in tr:
+        for vv in test_loader:
             output = model(vv.x, vv.edge_index, vv.batch)
 
         #output = pass_data_iteratively(model, s2v_test_dataset)
@@ -1012,6 +1290,9 @@ class GNNSubNet(object):
 
         self.model_status = 'Trained'
         self.model = copy.deepcopy(model)
+        self.model_config = dict(model="GraphCheb", n_models=1,
+                                 kwargs=dict(num_node_features=input_dim, hidden_channels=hidden_channels, K=K,
+                                             layers_nr=layers_nr, num_classes=2))
         self.accuracy = acc_bal
         self.confusion_matrix = confusion_matrix_gnn
         #self.test_loss = test_loss
@@ -1116,26 +1397,24 @@ class GNNSubNet(object):
         n_epochs_stop = 7
         epochs_no_improve = 0
         steps_per_epoch = 35
-        
+
+        # all patients share the PPI topology: keep the cohort as one [patients, nodes, features] tensor
+        train_x = stack_node_features(s2v_train_dataset)
+        train_y = torch.LongTensor([graph.y for graph in s2v_train_dataset])
+        edge_index = s2v_train_dataset[0].edge_index
+
         for epoch in range(epoch_nr):
             model.train()
             pbar = tqdm(range(steps_per_epoch), unit='batch')
             epoch_loss = 0
             for pos in pbar:
 
-                selected_idx = np.random.permutation(len(s2v_train_dataset))[:30]
-                batch_graph = [s2v_train_dataset[idx] for idx in selected_idx]
-                
-                
-                logits=[]
-                for g in batch_graph:
-                    logits.append(model(x=g.x, edge_index=g.edge_index).max(0)[0])
-                    #logits.append(model(x=g.x, edge_index=g.edge_index).mean(0))
+                selected_idx = torch.from_numpy(np.random.permutation(len(s2v_train_dataset))[:30])
+
+                logits = chebconv_forward(model, train_x[selected_idx], edge_index)
+
+                labels = train_y[selected_idx]
 
-                logits = torch.reshape(torch.cat(logits,0),(30,2))  
-                
-                labels = torch.LongTensor([graph.y for graph in batch_graph])
-                
 
                 if use_weights:
                     loss = nn.CrossEntropyLoss(weight=weight)(logits,labels)
@@ -1151,13 +1430,8 @@ class GNNSubNet(object):
             epoch_loss /= steps_per_epoch
             model.eval()
             
-            output = []
-            for graphs in s2v_train_dataset: 
-                output.append(model(x=graphs.x, edge_index=graphs.edge_index).max(0)[0])
-                #output.append(model(x=graphs.x, edge_index=graphs.edge_index).mean(0))
-                     
-            output = torch.reshape(torch.cat(output,0),(len(output),2))
-            
+            output = pass_data_chebconv(model, s2v_train_dataset)
+
             output = np.array(output.detach())
             
             predicted_class = output.argmax(1, keepdims=True)          
@@ -1176,12 +1450,7 @@ class GNNSubNet(object):
             pbar.set_description('epoch: %d' % (epoch))
             val_loss = 0
 
-            output = []
-            for graphs in s2v_test_dataset: 
-                output.append(model(x=graphs.x, edge_index=graphs.edge_index).max(0)[0])
-                #output.append(model(x=graphs.x, edge_index=graphs.edge_index).mean(0))
-
-            output = torch.reshape(torch.cat(output,0),(len(output),2))
+            output = pass_data_chebconv(model, s2v_test_dataset)
 
             labels = torch.LongTensor([graph.y for graph in s2v_test_dataset])
             
@@ -1218,13 +1487,7 @@ class GNNSubNet(object):
 
         model.load_state_dict(best_model.state_dict())
 
-        output = []
-        for graphs in s2v_test_dataset: 
-            output.append(model(x=graphs.x, edge_index=graphs.edge_index).max(0)[0])
-            #output.append(model(x=graphs.x, edge_index=graphs.edge_index).mean(0))
-            
-          
-        output = torch.reshape(torch.cat(output,0),(len(output),2))
+        output = pass_data_chebconv(model, s2v_test_dataset)
         output = np.array(output.detach())
         predicted_class = output.argmax(1, keepdims=True)
 
@@ -1247,6 +1510,8 @@ class GNNSubNet(object):
 
         self.model_status = 'Trained'
         self.model = copy.deepcopy(model)
+        self.model_config = dict(model="ChebConv", n_models=1,
+                                 kwargs=dict(in_channels=input_dim, out_channels=n_classes, K=10))
         self.accuracy = acc_bal
         self.confusion_matrix = confusion_matrix_gnn
         #self.test_loss = test_loss
@@ -1476,6 +1741,11 @@ class GNNSubNet(object):
 
         self.model_status = 'Trained'
         self.model = copy.deepcopy(model)
+        self.model_config = dict(model="GraphCNN", n_models=1,
+                                 kwargs=dict(num_layers=num_layers, num_mlp_layers=num_mlp_layers, input_dim=input_dim,
+                                             hidden_dim=32, output_dim=n_classes, final_dropout=0.5, learn_eps=True,
+                                             graph_pooling_type=graph_pooling_type,
+                                             neighbor_pooling_type=neighbor_pooling_type, device=0))
         self.accuracy = accuracy
         self.confusion_matrix = confusion_matrix_gnn
         self.test_loss = test_loss
@@ -1483,7 +1753,674 @@ class GNNSubNet(object):
         self.predictions = predicted_class_array
         self.true_class  = true_class_array
 
-    def explain_graphcheb(self, n_runs=10, explainer_lambda=0.8, communities=True, save_to_disk=False):
+    def _balanced_split(self):
+        """
+        Downsample the larger class and split the balanced dataset 4:1 into
+        a training and a validation list of graphs.
+        """
+        graphs_class_0_list = []
+        graphs_class_1_list = []
+        for graph in self.dataset:
+            if graph.y.numpy() == 0:
+                graphs_class_0_list.append(graph)
+            else:
+                graphs_class_1_list.append(graph)
+
+        graphs_class_0_len = len(graphs_class_0_list)
+        graphs_class_1_len = len(graphs_class_1_list)
+
+        print(f"Graphs class 0: {graphs_class_0_len}, Graphs class 1: {graphs_class_1_len}")
+
+        if graphs_class_0_len >= graphs_class_1_len:
+            random_graphs_class_0_list = random.sample(graphs_class_0_list, graphs_class_1_len)
+            balanced_dataset_list = graphs_class_1_list + random_graphs_class_0_list
+        else:
+            random_graphs_class_1_list = random.sample(graphs_class_1_list, graphs_class_0_len)
+            balanced_dataset_list = graphs_class_0_list + random_graphs_class_1_list
+
+        random.shuffle(balanced_dataset_list)
+        print(f"Length of balanced dataset list: {len(balanced_dataset_list)}")
+
+        train_set_len = int(len(balanced_dataset_list) * 4 / 5)
+        train_dataset_list = balanced_dataset_list[:train_set_len]
+        test_dataset_list  = balanced_dataset_list[train_set_len:]
+
+        train_graph_class_1_nr = int(sum(graph.y.item() for graph in train_dataset_list))
+        test_graph_class_1_nr  = int(sum(graph.y.item() for graph in test_dataset_list))
+        print(f"Train graph class 0: {len(train_dataset_list) - train_graph_class_1_nr}, train graph class 1: {train_graph_class_1_nr}")
+        print(f"Validation graph class 0: {len(test_dataset_list) - test_graph_class_1_nr}, validation graph class 1: {test_graph_class_1_nr}")
+
+        return train_dataset_list, test_dataset_list
+
+    def _fit_minibatches(self, model, opt, batch_loss, evaluate, epoch_nr, n_epochs_stop=10, steps_per_epoch=35):
+        """
+        Train on random minibatches with early stopping on the validation loss.
+        batch_loss: returns the loss of one random training minibatch and its
+                    share of the reported epoch loss
+        evaluate:   returns the training accuracy and the validation loss
+                    (called with the model in eval mode)
+        :return: copy of the model with the lowest validation loss
+        """
+        best_model = copy.deepcopy(model)
+        min_val_loss = 1000000
+        epochs_no_improve = 0
+
+        for epoch in range(epoch_nr):
+            model.train()
+            pbar = tqdm(range(steps_per_epoch), unit='batch')
+            epoch_loss = 0
+            for pos in pbar:
+                loss, reported_loss = batch_loss()
+
+                opt.zero_grad()
+                loss.backward()
+                opt.step()
+
+                epoch_loss += reported_loss
+
+            epoch_loss /= steps_per_epoch
+            model.eval()
+            acc_train, val_loss = evaluate()
+            print('Epoch {}, loss {:.4f}'.format(epoch, epoch_loss))
+            print(f"Train Acc {acc_train:.4f}")
+
+            pbar.set_description('epoch: %d' % (epoch))
+            print('Epoch {}, val_loss {:.4f}'.format(epoch, val_loss))
+            if val_loss < min_val_loss:
+                print(f"Saving best model with validation loss {val_loss}")
+                best_model = copy.deepcopy(model)
+                epochs_no_improve = 0
+                min_val_loss = val_loss
+            else:
+                epochs_no_improve += 1
+                # Check early stopping condition
+                if epochs_no_improve == n_epochs_stop:
+                    print('Early stopping!')
+                    break
+
+        return best_model
+
+    def train_ensemble(self, n_models=5, method="graphcnn", epoch_nr=20, learning_rate=0.01, random_seed=None):
+        """
+        Train an ensemble of n_models graphcnn or graphcheb models with different seeds at once.
+        The parameters of all members are stacked and evaluated with torch.func.vmap on the
+        same batches (see ModelEnsemble). Predictions and explanations use the member average.
+        n_models: number of ensemble members
+        method: "graphcnn" or "graphcheb"
+        random_seed: if given, member i is initialised with seed random_seed + i
+        """
+        if method not in ["graphcnn", "graphcheb"]:
+            raise ValueError(f"Ensemble training supports 'graphcnn' and 'graphcheb', not '{method}'")
+
+        train_dataset_list, test_dataset_list = self._balanced_split()
+
+        input_dim = self.dataset[0].x.shape[1]
+        n_classes = 2
+
+        if method == "graphcnn":
+            s2v_train_dataset = convert_to_s2vgraph(train_dataset_list)
+            s2v_test_dataset  = convert_to_s2vgraph(test_dataset_list)
+            model_class, model_kwargs = "GraphCNN", dict(num_layers=2, num_mlp_layers=2, input_dim=input_dim, hidden_dim=32,
+                                                         output_dim=n_classes, final_dropout=0.5, learn_eps=True,
+                                                         graph_pooling_type='sum1', neighbor_pooling_type='sum', device=0)
+            build_model = lambda: GraphCNN(**model_kwargs)
+            get_label = lambda graph: graph.label
+        else:
+            s2v_train_dataset = train_dataset_list
+            s2v_test_dataset  = test_dataset_list
+            model_class, model_kwargs = "GraphCheb", dict(num_node_features=input_dim, hidden_channels=7, K=5,
+                                                          layers_nr=2, num_classes=n_classes)
+            build_model = lambda: GraphCheb(**model_kwargs)
+            get_label = lambda graph: graph.y
+
+        def example_input(graphs):
+            if method == "graphcnn":
+                return (graphs,)
+            batch = Batch.from_data_list(graphs)
+            return (batch.x, batch.edge_index, batch.batch)
+
+        def forward_all(ensemble, graphs):
+            # [n_models, len(graphs), n_classes]
+            return ensemble.forward_all(*example_input(graphs))
+
+        def forward_eval(ensemble, graphs, minibatch_size=128):
+            output = []
+            for i in range(0, len(graphs), minibatch_size):
+                output.append(forward_all(ensemble, graphs[i:i+minibatch_size]).mean(0).detach())
+            return torch.cat(output, 0)
+
+        members = []
+        for idx in range(n_models):
+            if random_seed is not None:
+                torch.manual_seed(random_seed + idx)
+            members.append(build_model())
+
+        model = ModelEnsemble(members)
+        # warns and loops over the members if the model cannot be vectorized
+        vectorize = model.check_vmap(*example_input(s2v_train_dataset[:2]))
+        opt = torch.optim.Adam(model.parameters(), lr = learning_rate)
+
+        train_labels = torch.LongTensor([get_label(graph) for graph in s2v_train_dataset])
+        test_labels  = torch.LongTensor([get_label(graph) for graph in s2v_test_dataset])
+
+        def batch_loss():
+            selected_idx = np.random.permutation(len(s2v_train_dataset))[:32]
+            batch_graph = [s2v_train_dataset[idx] for idx in selected_idx]
+            logits = forward_all(model, batch_graph)
+            labels = train_labels[selected_idx]
+            # Summing the member losses gives every member its own, independent gradient
+            loss = sum(nn.CrossEntropyLoss()(logits[m], labels) for m in range(n_models))
+            return loss, loss.detach().item() / n_models
+
+        def evaluate():
+            output = forward_eval(model, s2v_train_dataset)
+            predicted_class = output.max(1, keepdim=True)[1]
+            acc_train = predicted_class.eq(train_labels.view_as(predicted_class)).sum().item() / float(len(s2v_train_dataset))
+            return acc_train, nn.CrossEntropyLoss()(forward_eval(model, s2v_test_dataset), test_labels)
+
+        best_model = self._fit_minibatches(model, opt, batch_loss, evaluate, epoch_nr, n_epochs_stop=10)
+        model.load_state_dict(best_model.state_dict())
+        model.eval()
+
+        output = forward_eval(model, s2v_test_dataset)
+        predicted_class = np.array(output.argmax(1))
+
+        confusion_matrix_gnn = confusion_matrix(test_labels, predicted_class)
+        print("\nConfusion matrix (Validation set):\n")
+        print(confusion_matrix_gnn)
+
+        from sklearn.metrics import balanced_accuracy_score
+        acc_bal = balanced_accuracy_score(test_labels, predicted_class)
+
+        print("Validation accuracy: {}".format(acc_bal))
+
+        model.train()
+
+        self.model_status = 'Trained'
+        self.model = copy.deepcopy(model)
+        self.model_config = dict(model=model_class, n_models=n_models, kwargs=model_kwargs,
+                                 vectorize=vectorize)
+        self.accuracy = acc_bal
+        self.confusion_matrix = confusion_matrix_gnn
+        self.s2v_test_dataset = s2v_test_dataset
+        self.predictions = predicted_class
+        self.true_class  = test_labels
+
+    def _explainer_runs(self, n_runs, explain_fn, n_jobs=1, max_epochs=300, min_epochs=None, tol=1e-2):
+        """
+        Runs n_runs explainer restarts, optimized together with one batched forward
+        per epoch, or with n_jobs > 1 in a pool of worker processes, and merges every
+        run into the mean, standard deviation and, with self.mask_quantiles, quantiles
+        of the node and edge masks as it arrives. Memory stays O(edges) for any number
+        of runs. With self.keep_runs (or consensus communities) the masks of every run
+        are kept as well, spilled to .npy memmaps in self.location
+        (self.node_mask_matrix [N, runs], self.run_edge_masks [runs, E]).
+        The epochs used per run are stored in self.explainer_epochs.
+        Runs cached under self._explain_cache_key are continued from their running
+        statistics, only the missing runs are computed.
+        """
+        edge_index = self.dataset[0].edge_index
+        n_nodes = self.dataset[0].x.shape[0]
+        keep = self.keep_runs or self.consensus_threshold is not None
+
+        key = self._explain_cache_key
+        cached = None
+        if key is not None:
+            cache = ExplanationCache(self.location)
+            cached = cache.load_runs(key)
+            # running statistics cannot drop runs, and kept runs need their masks
+            if cached is not None and (len(cached["epochs"]) > n_runs or (keep and cached["masks"] is None)):
+                cached = None
+
+        node_stats = RunningStats(self.mask_quantiles, random_seed=self.random_seed)
+        edge_stats = RunningStats(self.mask_quantiles, random_seed=self.random_seed)
+        epochs_used = np.zeros(n_runs, dtype=int)
+        new_masks = []
+
+        node_runs = edge_runs = None
+        if keep:
+            node_runs = np.lib.format.open_memmap(f'{self.location}/node_mask_matrix.npy', mode='w+',
+                                                  dtype=np.float32, shape=(n_nodes, n_runs))
+            edge_runs = np.lib.format.open_memmap(f'{self.location}/run_edge_masks.npy', mode='w+',
+                                                  dtype=np.float32, shape=(n_runs, edge_index.shape[1]))
+
+        def merge(idx, raw_mask, update_stats=True):
+            gnn_feature_masks = torch.as_tensor(raw_mask).reshape(-1, 1)
+            node_mask = gnn_feature_masks.sigmoid().numpy().reshape(-1)
+            edge_mask = calc_edge_importance(gnn_feature_masks, edge_index).sigmoid().numpy().reshape(-1)
+            if update_stats:
+                node_stats.update(node_mask)
+                edge_stats.update(edge_mask)
+            if node_runs is not None:
+                node_runs[:, idx] = node_mask
+                edge_runs[idx] = edge_mask
+
+        n_cached = 0
+        if cached is not None:
+            n_cached = len(cached["epochs"])
+            print(f'Explainer::{n_cached} runs found in cache')
+            node_stats.restore(cached["node_stats"])
+            edge_stats.restore(cached["edge_stats"])
+            epochs_used[:n_cached] = cached["epochs"]
+            if keep:
+                for idx in range(n_cached):
+                    merge(idx, cached["masks"][:, idx], update_stats=False)
+
+        n_new = n_runs - n_cached
+        if n_new > 0:
+            pred = self._explainer_predictions(explain_fn)
+            if n_jobs > 1:
+                print(f'Explainer::{n_new} runs on {n_jobs} processes')
+                runs = iter_node_masks(self.model, self.s2v_test_dataset, explain_fn, n_new, n_jobs,
+                                       epochs=max_epochs, min_epochs=min_epochs, tol=tol,
+                                       random_seed=self.random_seed, pred=pred, start=n_cached)
+            else:
+                print(f'Explainer::{n_new} runs')
+                runs = self._iter_explainer_runs(explain_fn, n_new, n_new, pred,
+                                                 max_epochs=max_epochs, min_epochs=min_epochs, tol=tol)
+
+            for done, (idx, mask, n_epochs) in enumerate(runs, 1):
+                merge(n_cached + idx, mask)
+                epochs_used[n_cached + idx] = n_epochs
+                if keep and key is not None:
+                    new_masks.append((idx, mask))
+                print(f'Explainer::run {n_cached + idx + 1} merged ({done} of {n_new})')
+
+            if key is not None:
+                masks = None
+                if keep:
+                    masks = np.zeros((n_nodes, n_runs), dtype=np.float32)
+                    if n_cached:
+                        masks[:, :n_cached] = cached["masks"]
+                    for idx, mask in new_masks:
+                        masks[:, n_cached + idx] = mask
+                cache.save_runs(key, node_stats, edge_stats, epochs_used, masks)
+
+        if node_runs is not None:
+            node_runs.flush()
+            edge_runs.flush()
+
+        self.node_mask = node_stats.mean
+        self.node_mask_std = node_stats.std
+        self.node_mask_quantiles = node_stats.quantiles
+        self.edge_mask = edge_stats.mean
+        self.edge_mask_std = edge_stats.std
+        self.edge_mask_quantiles = edge_stats.quantiles
+        self.node_mask_matrix = node_runs
+        self.run_edge_masks = edge_runs
+
+        self.explainer_epochs = [int(e) for e in epochs_used]
+        print(f'Explainer::epochs per run {self.explainer_epochs}')
+
+    def _iter_explainer_runs(self, explain_fn, n_runs, runs_per_batch, pred, max_epochs=300, min_epochs=None, tol=1e-2):
+        """
+        Explainer runs optimized in batches of runs_per_batch restarts.
+        :return: generator of (run index, [N] raw node mask, epochs used)
+        """
+        for start in range(0, n_runs, runs_per_batch):
+            size = min(runs_per_batch, n_runs - start)
+            exp = GNNExplainer(self.model, epochs=max_epochs, min_epochs=min_epochs, tol=tol)
+            masks = getattr(exp, explain_fn)(self.s2v_test_dataset, 0.8, n_restarts=size, pred=pred)
+            for col in range(size):
+                yield start + col, masks[:, col].numpy(), int(exp.epochs_used[col])
+
+    def explain_streaming(self, n_runs=50, communities=True, n_jobs=1, runs_per_batch=5, community_every=5,
+                          top_k=5, stop_jaccard=None, patience=3, min_runs=10,
+                          max_epochs=300, min_epochs=None, tol=1e-2, callback=None):
+        """
+        Pipelined explainer: runs are merged into running mean/variance of the node
+        and edge masks as they complete (runs_per_batch restarts at a time, or from
+        n_jobs worker processes). Every community_every runs the communities of the
+        current mean edge mask are recomputed in the background and stored in
+        self.provisional_modules (and passed to callback).
+        stop_jaccard: stop early once the genes of the top_k modules agree with a
+                      Jaccard index >= stop_jaccard for patience successive
+                      recomputations (after at least min_runs runs)
+        The mean and standard deviation of the masks go to self.node_mask, self.edge_mask,
+        self.node_mask_std and self.edge_mask_std, the quantiles of self.mask_quantiles to
+        self.node_mask_quantiles and self.edge_mask_quantiles. With self.keep_runs (or
+        consensus communities) the masks of every run are kept in merge order, spilled
+        to .npy memmaps in self.location (self.node_mask_matrix, self.run_edge_masks).
+        """
+        explain_fn = EXPLAIN_FN[self.classifier]
+
+        print("")
+        print("------- Run the Explainer (streaming) -------")
+        print("")
+
+        pred = self._explainer_predictions(explain_fn)
+        if n_jobs > 1:
+            runs = iter_node_masks(self.model, self.s2v_test_dataset, explain_fn, n_runs, n_jobs,
+                                   epochs=max_epochs, min_epochs=min_epochs, tol=tol,
+                                   random_seed=self.random_seed, pred=pred)
+        else:
+            runs = self._iter_explainer_runs(explain_fn, n_runs, runs_per_batch, pred,
+                                             max_epochs=max_epochs, min_epochs=min_epochs, tol=tol)
+
+        def provisional(result):
+            self.provisional_modules = result["modules"]
+            if callback is not None:
+                callback(result)
+
+        edge_index = np.asarray(self.dataset[0].edge_index)
+        node_runs = edge_runs = None
+        if self.keep_runs or self.consensus_threshold is not None:
+            node_runs = np.lib.format.open_memmap(f'{self.location}/node_mask_matrix.npy', mode='w+',
+                                                  dtype=np.float32, shape=(self.dataset[0].x.shape[0], n_runs))
+            edge_runs = np.lib.format.open_memmap(f'{self.location}/run_edge_masks.npy', mode='w+',
+                                                  dtype=np.float32, shape=(n_runs, edge_index.shape[1]))
+
+        result = stream_runs(runs, edge_index, n_runs,
+                             community_every=community_every, top_k=top_k, stop_jaccard=stop_jaccard,
+                             patience=patience, min_runs=min_runs, detection_alg=self.detection_alg,
+                             resolution=self.resolution, callback=provisional, quantiles=self.mask_quantiles,
+                             random_seed=self.random_seed, node_runs=node_runs, edge_runs=edge_runs)
+
+        node_stats, edge_stats = result["node_stats"], result["edge_stats"]
+        self.edge_mask = edge_stats.mean
+        self.edge_mask_std = edge_stats.std
+        self.edge_mask_quantiles = edge_stats.quantiles
+        self.node_mask = node_stats.mean
+        self.node_mask_std = node_stats.std
+        self.node_mask_quantiles = node_stats.quantiles
+        self.node_mask_matrix = self.run_edge_masks = None
+        if node_runs is not None:
+            node_runs.flush()
+            edge_runs.flush()
+            # runs skipped by an early stop are dropped
+            self.node_mask_matrix = node_runs[:, :node_stats.n]
+            self.run_edge_masks = edge_runs[:node_stats.n]
+        self.explainer_epochs = result["epochs"]
+        print(f'Explainer::{node_stats.n} runs, epochs per run {self.explainer_epochs}')
+
+        self._explainer_run = True
+
+        if communities:
+            self._detect_communities()
+
+        self._save_explanation("streaming", communities=communities, run_edge_masks=self.run_edge_masks,
+                               n_runs=node_stats.n)
+
+    def _explainer_predictions(self, explain_fn):
+        """
+        Predictions of the model for the test set, the explainers start from.
+        Computed in one batched pass and reused as long as model and test set
+        are the same objects.
+        """
+        if self._explainer_pred is not None:
+            model, dataset, pred = self._explainer_pred
+            if model is self.model and dataset is self.s2v_test_dataset:
+                return pred
+
+        exp  = GNNExplainer(self.model)
+        pred = exp.initial_prediction(self.s2v_test_dataset, GNNExplainer.kinds[explain_fn])
+        self._explainer_pred = (self.model, self.s2v_test_dataset, pred)
+        return pred
+
+    def explain_patients(self, epochs=300, batch_size=256, dataset=None):
+        """
+        Patient-specific explanations: one node mask per patient, optimized
+        jointly for batch_size patients at a time.
+        dataset: graphs to explain (default: the test set of the trained model)
+        :return: DataFrame patients x genes with the node importances
+        """
+        if dataset is None:
+            dataset = self.s2v_test_dataset
+        if dataset is None:
+            print("No test data (model loaded from a bundle?), pass dataset=")
+            return
+
+        explain_fn = EXPLAIN_FN[self.classifier]
+        pred = self._explainer_predictions(explain_fn) if dataset is self.s2v_test_dataset else None
+
+        exp = GNNExplainer(self.model, epochs=epochs)
+        masks = exp.explain_patients(dataset, GNNExplainer.kinds[explain_fn], pred=pred, batch_size=batch_size)
+
+        self.patient_node_masks = pd.DataFrame(masks.sigmoid().numpy(), columns=self.gene_names)
+        self.patient_node_masks.index.name = "patient"
+        return self.patient_node_masks
+
+    def explain_attribution(self, method="saliency", communities=True, batch_size=64):
+        """
+        Explain the model's results with gradient based node attributions.
+        method: saliency, gradxinput, smoothgrad or ig
+        """
+
+        LOC = self.location
+        explain_fn = EXPLAIN_FN[self.classifier]
+
+        print("")
+        print(f"------- Run {method} attribution -------")
+        print("")
+
+        pred = self._explainer_predictions(explain_fn)
+        attributions = node_attributions(self.model, self.s2v_test_dataset, GNNExplainer.kinds[explain_fn],
+                                         method=method, target=pred, batch_size=batch_size)
+        node_mask = cohort_node_mask(attributions)
+        edge_mask = calc_edge_importance(node_mask, self.dataset[0].edge_index).view(-1)
+
+        self.edge_mask = edge_mask.numpy()
+        self.run_edge_masks = None
+        self.node_mask_std = None
+        self.edge_mask_std = None
+        self.node_mask_quantiles = None
+        self.edge_mask_quantiles = None
+        self.node_mask_matrix = node_mask.numpy()
+        self.node_mask = node_mask.numpy().reshape(-1)
+        self.node_attributions = pd.DataFrame(attributions.numpy(), columns=self.gene_names)
+
+        self._explainer_run = True
+
+        if communities:
+            self._detect_communities()
+
+        self._save_explanation(method, communities=communities)
+
+    def occlusion(self, fill=0.0, chunk_size=None, batch_size=512):
+        """
+        Knock-out importance of every gene on the test set.
+        fill: value the features of a knocked out gene are set to
+        chunk_size: genes knocked out per chunk (default: fitted to the available memory)
+        :return: DataFrame genes x (accuracy_delta, logit_delta)
+        """
+        explain_fn = EXPLAIN_FN[self.classifier]
+        accuracy_delta, logit_delta = occlusion_importance(self.model, self.s2v_test_dataset,
+                                                           GNNExplainer.kinds[explain_fn], fill=fill,
+                                                           chunk_size=chunk_size, batch_size=batch_size)
+
+        self.occlusion_importances = pd.DataFrame({"accuracy_delta": accuracy_delta, "logit_delta": logit_delta},
+                                                  index=self.gene_names)
+        return self.occlusion_importances
+
+    def module_shapley(self, max_permutations=1000, rel_tol=0.01, n_jobs=1, fill=0.0):
+        """
+        Shapley values of the detected modules (run explain() with communities first).
+        Estimated from random permutations of the modules, stops once every standard
+        error is below rel_tol of the score difference between all and no modules.
+        :return: DataFrame modules x (shapley, se)
+        """
+        if self.modules is None:
+            print("No modules found, run explain() with communities=True first")
+            return None
+
+        explain_fn = EXPLAIN_FN[self.classifier]
+        pred = self._explainer_predictions(explain_fn)
+        shapley, se, n_perm = module_shapley(self.model, self.s2v_test_dataset, GNNExplainer.kinds[explain_fn],
+                                             self.modules, target=pred, fill=fill,
+                                             max_permutations=max_permutations, rel_tol=rel_tol,
+                                             n_jobs=n_jobs, random_seed=self.random_seed)
+        print(f"Shapley::{n_perm} permutations")
+
+        self.module_shapley_values = pd.DataFrame({"shapley": shapley, "se": se})
+        self.module_shapley_values.index.name = "module"
+        return self.module_shapley_values
+
+    def module_pvalues(self, n_permutations=1000, null="edges", n_jobs=1, chunk_size=None):
+        """
+        Permutation test of the module importances (run explain() with communities first).
+        null: "edges" shuffles the edge masks over all edges, "degree" shuffles the
+              module labels between genes of the same degree
+        :return: DataFrame modules x (importance, p_value, q_value), q_value being
+                 the Benjamini-Hochberg adjusted p-value
+        """
+        if self.modules is None:
+            print("No modules found, run explain() with communities=True first")
+            return None
+
+        importance, p_values, q_values = module_permutation_test(self.dataset[0].edge_index, self.edge_mask,
+                                                                 self.modules, n_permutations=n_permutations,
+                                                                 null=null, chunk_size=chunk_size, n_jobs=n_jobs,
+                                                                 random_seed=self.random_seed)
+
+        self.module_significance = pd.DataFrame({"importance": importance, "p_value": p_values,
+                                                 "q_value": q_values})
+        self.module_significance.index.name = "module"
+        return self.module_significance
+
+    def explain_pgexplainer(self, epochs=30, communities=True, batch_size=256):
+        """
+        Explain the model's results with PGExplainer: the edge mask MLP is trained
+        once on the test set, the edge masks of all patients then come from
+        batched forwards.
+        """
+        if self.classifier not in ["graphcnn", "graphcheb"]:
+            print(f"PGExplainer supports graphcnn and graphcheb, not {self.classifier}")
+            return
+
+        LOC = self.location
+
+        print("")
+        print("------- Run PGExplainer -------")
+        print("")
+
+        explainer = PGExplainer(self.model, self.s2v_test_dataset, epochs=epochs)
+        explainer.prepare()
+        edge_index, patient_edge_masks = explainer.explain(batch_size=batch_size)
+
+        # graphcnn explains the S2VGraph edge_mat (every edge once); downstream
+        # (communities, significance, bundle) pairs the masks with the PPI edge_index
+        edge_index = self.dataset[0].edge_index
+        if not torch.equal(torch.as_tensor(explainer.edge_index), edge_index):
+            patient_edge_masks = map_edge_weights(explainer.edge_index, patient_edge_masks, edge_index)
+
+        edge_mask = patient_edge_masks.mean(0).numpy()
+        # node importance: mean weight of the incident edges
+        rows, cols = np.asarray(edge_index)
+        n_nodes = len(self.gene_names)
+        degree = np.bincount(rows, minlength=n_nodes) + np.bincount(cols, minlength=n_nodes)
+        node_mask = (np.bincount(rows, edge_mask, n_nodes) + np.bincount(cols, edge_mask, n_nodes)) / np.maximum(degree, 1)
+
+        self.edge_mask = edge_mask
+        self.run_edge_masks = None
+        self.node_mask_std = None
+        self.edge_mask_std = None
+        self.node_mask_quantiles = None
+        self.edge_mask_quantiles = None
+        self.node_mask = node_mask
+        self.node_mask_matrix = node_mask.reshape(-1, 1)
+        self.patient_edge_masks = patient_edge_masks.numpy()
+
+        self._explainer_run = True
+
+        if communities:
+            self._detect_communities()
+
+        self._save_explanation("pgexplainer", communities=communities)
+
+    def _detect_communities(self):
+        """
+        Community detection on the edge masks, results go to self.modules
+        and self.module_importances.
+        """
+        if self.consensus_threshold is not None and self.run_edge_masks is not None and len(self.run_edge_masks) > 1:
+            self.consensus_communities(self.consensus_threshold)
+            return
+        if self.consensus_threshold is not None:
+            print("Consensus communities need the masks of several explainer runs, using the mean edge mask")
+
+        avg_mask, coms = find_communities(self.dataset[0].edge_index, self.edge_mask,
+                                          detection_alg=self.detection_alg, resolution=self.resolution)
+        self.modules = coms
+        self.module_importances = avg_mask
+        self.module_stability = None
+
+    def consensus_communities(self, threshold=0.5, n_jobs=1):
+        """
+        Consensus modules of the single explainer runs (run explain() with n_runs > 1 first):
+        communities are detected on the edge mask of every run, the modules are the
+        groups of genes kept together in at least a fraction threshold of the runs.
+        self.module_stability holds the mean co-assignment fraction within every module.
+        The masks of the single runs are only kept with keep_runs=True or a
+        consensus_threshold set before explain().
+        """
+        if self.run_edge_masks is None:
+            raise ValueError("No masks of single explainer runs: set keep_runs = True "
+                             "(or consensus_threshold) and run explain() first")
+
+        avg_mask, coms, stability, _ = consensus_communities(self.dataset[0].edge_index, self.run_edge_masks,
+                                                             detection_alg=self.detection_alg,
+                                                             resolution=self.resolution, threshold=threshold,
+                                                             n_jobs=n_jobs, random_seed=self.random_seed)
+        self.modules = coms
+        self.module_importances = avg_mask
+        self.module_stability = stability
+        return coms
+
+    def community_hierarchy(self, resolutions=(0.25, 0.5, 1.0, 2.0, 4.0), detection_alg="leiden"):
+        """
+        Communities of the explainer edge mask at several resolutions (run explain() first).
+        Pick a granularity with select_modules(level).
+        :return: list of levels, coarse to fine (see community_detection.community_sweep)
+        """
+        if not self._explainer_run:
+            print("No edge masks found, run explain() first")
+            return None
+
+        self.module_hierarchy = community_sweep(self.dataset[0].edge_index, self.edge_mask,
+                                                resolutions=resolutions, detection_alg=detection_alg)
+        for level in self.module_hierarchy:
+            print(f"Resolution {level['resolution']}: {len(level['modules'])} modules")
+        return self.module_hierarchy
+
+    def select_modules(self, level):
+        """
+        Sets self.modules and self.module_importances to the communities of
+        level `level` of community_hierarchy().
+        """
+        level = self.module_hierarchy[level]
+        self.modules = level["modules"]
+        self.module_importances = list(level["scores"][~np.isnan(level["scores"])])
+        self.resolution = level["resolution"]
+
+    def _save_explanation(self, method, communities=True, run_edge_masks=None, n_runs=None):
+        """
+        Writes the explanation to self.location, either as one results bundle
+        or as the legacy text files (see self.save_format).
+        run_edge_masks: [runs, edges] edge masks of the single explainer runs
+        n_runs: number of runs (default: columns of self.node_mask_matrix)
+        """
+        arrays = dict(edge_mask=self.edge_mask, node_mask=self.node_mask,
+                      node_mask_matrix=self.node_mask_matrix, run_edge_masks=run_edge_masks,
+                      node_mask_std=self.node_mask_std, edge_mask_std=self.edge_mask_std,
+                      node_mask_quantiles=self.node_mask_quantiles, edge_mask_quantiles=self.edge_mask_quantiles,
+                      gene_names=np.array(self.gene_names, dtype=str))
+        modules = None
+        if communities:
+            arrays["module_importances"] = np.asarray(self.module_importances, dtype=float)
+            arrays["module_stability"] = self.module_stability
+            modules = self.modules
+
+        if self.save_format == "text":
+            write_text(self.location, {name: a for name, a in arrays.items() if a is not None}, modules)
+            return
+
+        if n_runs is None:
+            n_runs = np.shape(self.node_mask_matrix)[1]
+        metadata = dict(classifier=self.classifier, method=method, n_runs=int(n_runs), random_seed=self.random_seed)
+        save_bundle(f'{self.location}/{BUNDLE_NAME}', arrays, metadata=metadata, modules=modules)
+
+    def explain_graphcheb(self, n_runs=10, explainer_lambda=0.8, communities=True, save_to_disk=False, n_jobs=1,
+                          max_epochs=300, min_epochs=None, tol=1e-2):
         """
         Explain the model's results.
         """
@@ -1504,31 +2441,10 @@ class GNNSubNet(object):
 
         no_of_runs = n_runs
         lamda = 0.8 # not used!
-        ems = []
-        NODE_MASK = list()
-
-        for idx in range(no_of_runs):
-            print(f'Explainer::Iteration {idx+1} of {no_of_runs}')
-            exp = GNNExplainer(model, epochs=300)
-            em = exp.explain_graph_modified_cheb2(s2v_test_dataset, lamda)
-            #Path(f"{path}/{sigma}/modified_gnn").mkdir(parents=True, exist_ok=True)
-            gnn_feature_masks = np.reshape(em, (len(em), -1))
-            NODE_MASK.append(np.array(gnn_feature_masks.sigmoid()))
-            np.savetxt(f'{LOC}/gnn_feature_masks{idx}.csv', gnn_feature_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            #np.savetxt(f'{path}/{sigma}/modified_gnn/gnn_feature_masks{idx}.csv', gnn_feature_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            gnn_edge_masks = calc_edge_importance(gnn_feature_masks, dataset[0].edge_index)
-            np.savetxt(f'{LOC}/gnn_edge_masks{idx}.csv', gnn_edge_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            #np.savetxt(f'{path}/{sigma}/modified_gnn/gnn_edge_masks{idx}.csv', gnn_edge_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            ems.append(gnn_edge_masks.sigmoid().numpy())
-
-        ems     = np.array(ems)
-        mean_em = ems.mean(0)
-
-        # OUTPUT -- Save Edge Masks
-        np.savetxt(f'{LOC}/edge_masks.txt', mean_em, delimiter=',', fmt='%.5f')
-        self.edge_mask = mean_em
-        self.node_mask_matrix = np.concatenate(NODE_MASK,1)
-        self.node_mask = np.concatenate(NODE_MASK,1).mean(1)
+
+        # mean / std (and optionally quantiles) of the runs, merged run by run
+        self._explainer_runs(no_of_runs, "explain_graph_modified_cheb2", n_jobs=n_jobs,
+                             max_epochs=max_epochs, min_epochs=min_epochs, tol=tol)
 
         self._explainer_run = True
         
@@ -1537,36 +2453,16 @@ class GNNSubNet(object):
         ###############################################
 
         if communities:
-            avg_mask, coms = find_communities(f'{LOC}/edge_index.txt', f'{LOC}/edge_masks.txt')
-            self.modules = coms
-            self.module_importances = avg_mask
-
-            np.savetxt(f'{LOC}/communities_scores.txt', avg_mask, delimiter=',', fmt='%.3f')
-
-            filePath = f'{LOC}/communities.txt'
-
-            if os.path.exists(filePath):
-                os.remove(filePath)
+            self._detect_communities()
 
-            f = open(f'{LOC}/communities.txt', "a")
-            for idx in range(len(avg_mask)):
-                s_com = ','.join(str(e) for e in coms[idx])
-                f.write(s_com + '\n')
-
-            f.close()
-
-            # Write gene_names to file
-            textfile = open(f'{LOC}/gene_names.txt', "w")
-            for element in gene_names:
-                listToStr = ''.join(map(str, element))
-                textfile.write(listToStr + "\n")
-
-            textfile.close()
+        self._save_explanation("explainer", communities=communities, run_edge_masks=self.run_edge_masks,
+                               n_runs=no_of_runs)
 
         self._explainer_run = True    
     
     
-    def explain_chebconv(self, n_runs=10, explainer_lambda=0.8, communities=True, save_to_disk=False):
+    def explain_chebconv(self, n_runs=10, explainer_lambda=0.8, communities=True, save_to_disk=False, n_jobs=1,
+                         max_epochs=300, min_epochs=None, tol=1e-2):
         """
         Explain the model's results.
         """
@@ -1587,31 +2483,10 @@ class GNNSubNet(object):
 
         no_of_runs = n_runs
         lamda = 0.8 # not used!
-        ems = []
-        NODE_MASK = list()
-
-        for idx in range(no_of_runs):
-            print(f'Explainer::Iteration {idx+1} of {no_of_runs}')
-            exp = GNNExplainer(model, epochs=300)
-            em = exp.explain_graph_modified_cheb(s2v_test_dataset, lamda)
-            #Path(f"{path}/{sigma}/modified_gnn").mkdir(parents=True, exist_ok=True)
-            gnn_feature_masks = np.reshape(em, (len(em), -1))
-            NODE_MASK.append(np.array(gnn_feature_masks.sigmoid()))
-            np.savetxt(f'{LOC}/gnn_feature_masks{idx}.csv', gnn_feature_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            #np.savetxt(f'{path}/{sigma}/modified_gnn/gnn_feature_masks{idx}.csv', gnn_feature_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            gnn_edge_masks = calc_edge_importance(gnn_feature_masks, dataset[0].edge_index)
-            np.savetxt(f'{LOC}/gnn_edge_masks{idx}.csv', gnn_edge_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            #np.savetxt(f'{path}/{sigma}/modified_gnn/gnn_edge_masks{idx}.csv', gnn_edge_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            ems.append(gnn_edge_masks.sigmoid().numpy())
-
-        ems     = np.array(ems)
-        mean_em = ems.mean(0)
-
-        # OUTPUT -- Save Edge Masks
-        np.savetxt(f'{LOC}/edge_masks.txt', mean_em, delimiter=',', fmt='%.5f')
-        self.edge_mask = mean_em
-        self.node_mask_matrix = np.concatenate(NODE_MASK,1)
-        self.node_mask = np.concatenate(NODE_MASK,1).mean(1)
+
+        # mean / std (and optionally quantiles) of the runs, merged run by run
+        self._explainer_runs(no_of_runs, "explain_graph_modified_cheb", n_jobs=n_jobs,
+                             max_epochs=max_epochs, min_epochs=min_epochs, tol=tol)
 
         self._explainer_run = True
         
@@ -1620,35 +2495,15 @@ class GNNSubNet(object):
         ###############################################
 
         if communities:
-            avg_mask, coms = find_communities(f'{LOC}/edge_index.txt', f'{LOC}/edge_masks.txt')
-            self.modules = coms
-            self.module_importances = avg_mask
-
-            np.savetxt(f'{LOC}/communities_scores.txt', avg_mask, delimiter=',', fmt='%.3f')
-
-            filePath = f'{LOC}/communities.txt'
-
-            if os.path.exists(filePath):
-                os.remove(filePath)
-
-            f = open(f'{LOC}/communities.txt', "a")
-            for idx in range(len(avg_mask)):
-                s_com = ','.join(str(e) for e in coms[idx])
-                f.write(s_com + '\n')
-
-            f.close()
+            self._detect_communities()
 
-            # Write gene_names to file
-            textfile = open(f'{LOC}/gene_names.txt', "w")
-            for element in gene_names:
-                listToStr = ''.join(map(str, element))
-                textfile.write(listToStr + "\n")
-
-            textfile.close()
+        self._save_explanation("explainer", communities=communities, run_edge_masks=self.run_edge_masks,
+                               n_runs=no_of_runs)
 
         self._explainer_run = True    
 
-    def explain_graphcnn(self, n_runs=10, explainer_lambda=0.8, communities=True, save_to_disk=False):
+    def explain_graphcnn(self, n_runs=10, explainer_lambda=0.8, communities=True, save_to_disk=False, n_jobs=1,
+                         max_epochs=300, min_epochs=None, tol=1e-2):
         """
         Explain the model's results.
         """
@@ -1669,31 +2524,10 @@ class GNNSubNet(object):
 
         no_of_runs = n_runs
         lamda = 0.8 # not used!
-        ems = []
-        NODE_MASK = list()
-
-        for idx in range(no_of_runs):
-            print(f'Explainer::Iteration {idx+1} of {no_of_runs}')
-            exp = GNNExplainer(model, epochs=300)
-            em = exp.explain_graph_modified_s2v(s2v_test_dataset, lamda)
-            #Path(f"{path}/{sigma}/modified_gnn").mkdir(parents=True, exist_ok=True)
-            gnn_feature_masks = np.reshape(em, (len(em), -1))
-            NODE_MASK.append(np.array(gnn_feature_masks.sigmoid()))
-            np.savetxt(f'{LOC}/gnn_feature_masks{idx}.csv', gnn_feature_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            #np.savetxt(f'{path}/{sigma}/modified_gnn/gnn_feature_masks{idx}.csv', gnn_feature_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            gnn_edge_masks = calc_edge_importance(gnn_feature_masks, dataset[0].edge_index)
-            np.savetxt(f'{LOC}/gnn_edge_masks{idx}.csv', gnn_edge_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            #np.savetxt(f'{path}/{sigma}/modified_gnn/gnn_edge_masks{idx}.csv', gnn_edge_masks.sigmoid(), delimiter=',', fmt='%.3f')
-            ems.append(gnn_edge_masks.sigmoid().numpy())
-
-        ems     = np.array(ems)
-        mean_em = ems.mean(0)
-
-        # OUTPUT -- Save Edge Masks
-        np.savetxt(f'{LOC}/edge_masks.txt', mean_em, delimiter=',', fmt='%.5f')
-        self.edge_mask = mean_em
-        self.node_mask_matrix = np.concatenate(NODE_MASK,1)
-        self.node_mask = np.concatenate(NODE_MASK,1).mean(1)
+
+        # mean / std (and optionally quantiles) of the runs, merged run by run
+        self._explainer_runs(no_of_runs, "explain_graph_modified_s2v", n_jobs=n_jobs,
+                             max_epochs=max_epochs, min_epochs=min_epochs, tol=tol)
 
         self._explainer_run = True
         
@@ -1702,31 +2536,10 @@ class GNNSubNet(object):
         ###############################################
 
         if communities:
-            avg_mask, coms = find_communities(f'{LOC}/edge_index.txt', f'{LOC}/edge_masks.txt')
-            self.modules = coms
-            self.module_importances = avg_mask
-
-            np.savetxt(f'{LOC}/communities_scores.txt', avg_mask, delimiter=',', fmt='%.3f')
-
-            filePath = f'{LOC}/communities.txt'
-
-            if os.path.exists(filePath):
-                os.remove(filePath)
+            self._detect_communities()
 
-            f = open(f'{LOC}/communities.txt', "a")
-            for idx in range(len(avg_mask)):
-                s_com = ','.join(str(e) for e in coms[idx])
-                f.write(s_com + '\n')
-
-            f.close()
-
-            # Write gene_names to file
-            textfile = open(f'{LOC}/gene_names.txt', "w")
-            for element in gene_names:
-                listToStr = ''.join(map(str, element))
-                textfile.write(listToStr + "\n")
-
-            textfile.close()
+        self._save_explanation("explainer", communities=communities, run_edge_masks=self.run_edge_masks,
+                               n_runs=no_of_runs)
 
         self._explainer_run = True
 
@@ -1740,7 +2553,7 @@ class GNNSubNet(object):
         model = self.model
         model.eval()
 
-        tr = DataLoader(s2v_test_dataset, batch_size=len(s2v_test_dataset), shuffle=False)
+        tr = FixedTopologyLoader(s2v_test_dataset, batch_size=len(s2v_test_dataset), shuffle=False)
         for vv in tr:
             output = model(vv.x, vv.edge_index, vv.batch)
 
@@ -1780,13 +2593,7 @@ class GNNSubNet(object):
         model = self.model
         model.eval()
 
-        output = []
-        for graphs in s2v_test_dataset: 
-            output.append(model(x=graphs.x, edge_index=graphs.edge_index).max(0)[0])
-            #output.append(model(x=graphs.x, edge_index=graphs.edge_index).mean(0))
-            
-          
-        output = torch.reshape(torch.cat(output,0),(len(output),2))
+        output = pass_data_chebconv(model, s2v_test_dataset)
         output = np.array(output.detach())
         predicted_class = output.argmax(1, keepdims=True)
 
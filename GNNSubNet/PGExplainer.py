@@ -1,70 +1,133 @@
-# import numpy as np
+import numpy as np
 import torch
-import torch_geometric as ptgeom
+from copy import copy
 from torch import nn
 from torch.optim import Adam
-from torch_geometric.data import Data
 from tqdm import tqdm
 
-from ExplanationEvaluation.explainers.BaseExplainer import BaseExplainer
-from ExplanationEvaluation.utils.graph import index_edge
 
+def map_edge_weights(edge_index, weights, target_edge_index):
+    """
+    Edge weights of an undirected graph carried over to another edge list of
+    the same graph, e.g. from the S2VGraph edge_mat (every edge once, networkx
+    order) to the sorted PPI edge_index (both directions). An edge (u, v) of
+    the target gets the weight of (u, v) or (v, u); edges without a match get 0.
+    :param edge_index: [2, E] edges the weights belong to
+    :param weights: [P, E] edge weights
+    :param target_edge_index: [2, E'] edges to map onto
+    :return: [P, E'] edge weights
+    """
+    edge_index = np.asarray(edge_index, dtype=np.int64)
+    target_edge_index = np.asarray(target_edge_index, dtype=np.int64)
+    n_nodes = int(max(edge_index.max(), target_edge_index.max())) + 1
+
+    # undirected key of every edge
+    key = lambda e: np.minimum(e[0], e[1]) * n_nodes + np.maximum(e[0], e[1])
+    source = key(edge_index)
+    order = np.argsort(source, kind="stable")
+    target = key(target_edge_index)
+    pos = np.minimum(np.searchsorted(source[order], target), len(order) - 1)
+    found = source[order][pos] == target
 
-class PGExplainer(BaseExplainer):
+    weights = torch.as_tensor(weights)
+    mapped = weights.new_zeros((weights.size(0), target_edge_index.shape[1]))
+    mapped[:, torch.from_numpy(found)] = weights[:, torch.from_numpy(order[pos][found])]
+    return mapped
+
+
+class PGExplainer(object):
     """
-    A class encaptulating the PGExplainer (https://arxiv.org/abs/2011.04573).
-    
+    A class encaptulating the PGExplainer (https://arxiv.org/abs/2011.04573)
+    for the graph classifiers of GNN-SubNet (GraphCheb, GraphCNN).
+
+    An MLP on the node embeddings of the model predicts one weight per edge.
+    It is trained once on a set of patients; explanations for any number of
+    patients then come from batched forwards, without re-optimizing masks.
+    All patients share one topology, so the edges of a batch are the tiled
+    edge_index of the PPI network and the weights of patient p are row p
+    of the returned [P, E] tensor.
+
     :param model_to_explain: graph classification model who's predictions we wish to explain.
-    :param graphs: the collections of edge_indices representing the graphs.
-    :param features: the collcection of features for each node in the graphs.
-    :param task: str "node" or "graph".
+    :param dataset: the patients (PyG Data objects for GraphCheb, S2VGraph objects for GraphCNN).
     :param epochs: amount of epochs to train our explainer.
     :param lr: learning rate used in the training of the explainer.
     :param temp: the temperture parameters dictacting how we sample our random graphs.
     :param reg_coefs: reguaization coefficients used in the loss. The first item in the tuple restricts the size of the explainations, the second rescticts the entropy matrix mask.
     :params sample_bias: the bias we add when sampling random graphs.
-    
+    :params batch_size: patients per training step / explanation forward.
+
     :function _create_explainer_input: utility;
     :function _sample_graph: utility; sample an explanatory subgraph.
     :function _loss: calculate the loss of the explainer during training.
     :function train: train the explainer
-    :function explain: search for the subgraph which contributes most to the clasification decision of the model-to-be-explained.
+    :function explain: edge weights of a batch of patients.
     """
-    def __init__(self, model_to_explain, graphs, features, task,
-                 epochs=30, lr=0.003, temp=(5.0, 2.0), reg_coefs=(0.05, 1.0), sample_bias=0):
-        super().__init__(model_to_explain, graphs, features, task)
+    def __init__(self, model_to_explain, dataset, epochs=30, lr=0.003, temp=(5.0, 2.0),
+                 reg_coefs=(0.05, 1.0), sample_bias=0, batch_size=32):
 
+        self.model_to_explain = model_to_explain
+        self.dataset = dataset
         self.epochs = epochs
         self.lr = lr
         self.temp = temp
         self.reg_coefs = reg_coefs
         self.sample_bias = sample_bias
+        self.batch_size = batch_size
 
-        if self.type == "graph":
-            self.expl_embedding = self.model_to_explain.embedding_size * 2
+        # GraphCNN takes S2VGraph objects, GraphCheb node features and edge_index
+        self.s2v = hasattr(dataset[0], 'node_features')
+        if self.s2v:
+            self.edge_index = dataset[0].edge_mat
+            self.x = torch.stack([graph.node_features for graph in dataset])
         else:
-            self.expl_embedding = self.model_to_explain.embedding_size * 3
+            self.edge_index = dataset[0].edge_index
+            self.x = torch.stack([graph.x for graph in dataset])
+
+        self.n_nodes = self.x.size(1)
+        self.expl_embedding = self.model_to_explain.embedding_size * 2
+        self._structure = {}
+        self.explainer_model = None
 
-    def _create_explainer_input(self, pair, embeds, node_id):
+    def _tiled_edges(self, size):
+        """
+        edge_index and batch vector of size copies of the graph.
+        """
+        if size not in self._structure:
+            n_edges = self.edge_index.size(1)
+            offsets = torch.arange(size).repeat_interleave(n_edges) * self.n_nodes
+            self._structure[size] = (self.edge_index.repeat(1, size) + offsets,
+                                     torch.arange(size).repeat_interleave(self.n_nodes))
+        return self._structure[size]
+
+    def _model(self, x, edge_weights=None, embedding=False):
         """
-        Given the embeddign of the sample by the model that we wish to explain, this method construct the input to the mlp explainer model.
-        Depending on if the task is to explain a graph or a sample, this is done by either concatenating two or three embeddings.
-        :param pair: edge pair
-        :param embeds: embedding of all nodes in the graph
-        :param node_id: id of the node, not used for graph datasets
+        Batched forward of the model for x [B, N, F].
+        """
+        edge_index, batch = self._tiled_edges(x.size(0))
+        if self.s2v:
+            batch_graph = []
+            for h in x:
+                graph = copy(self.dataset[0])
+                graph.node_features = h
+                batch_graph.append(graph)
+            return self.model_to_explain(batch_graph, get_embedding=embedding, edge_weight=edge_weights)
+
+        x = x.reshape(-1, x.size(-1))
+        if embedding:
+            return self.model_to_explain.embedding(x, edge_index)
+        return self.model_to_explain(x, edge_index, batch, edge_weight=edge_weights)
+
+    def _create_explainer_input(self, edge_index, embeds):
+        """
+        Given the embeddign of the samples by the model that we wish to explain, this method construct the input
+        to the mlp explainer model by concatenating the embeddings of the two nodes of every edge.
+        :param edge_index: edges of the batch
+        :param embeds: embedding of all nodes in the batch
         :return: concatenated embedding
         """
-        rows = pair[0]
-        cols = pair[1]
-        row_embeds = embeds[rows]
-        col_embeds = embeds[cols]
-        if self.type == 'node':
-            node_embed = embeds[node_id].repeat(rows.size(0), 1)
-            input_expl = torch.cat([row_embeds, col_embeds, node_embed], 1)
-        else:
-            # Node id is not used in this case
-            input_expl = torch.cat([row_embeds, col_embeds], 1)
-        return input_expl
+        rows = edge_index[0]
+        cols = edge_index[1]
+        return torch.cat([embeds[rows], embeds[cols]], 1)
 
     def _sample_graph(self, sampling_weights, temperature=1.0, bias=0.0, training=True):
         """
@@ -85,21 +148,20 @@ class PGExplainer(BaseExplainer):
             graph = torch.sigmoid(sampling_weights)
         return graph
 
-
     def _loss(self, masked_pred, original_pred, mask, reg_coefs):
         """
         Returns the loss score based on the given mask.
         :param masked_pred: Prediction based on the current explanation
         :param original_pred: Predicion based on the original graph
-        :param edge_mask: Current explanaiton
+        :param mask: Current explanaiton [B, E]
         :param reg_coefs: regularization coefficients
         :return: loss
         """
         size_reg = reg_coefs[0]
         entropy_reg = reg_coefs[1]
 
-        # Regularization losses
-        size_loss = torch.sum(mask) * size_reg
+        # Regularization losses (per graph, as in the single graph formulation)
+        size_loss = torch.sum(mask) / mask.size(0) * size_reg
         mask_ent_reg = -mask * torch.log(mask) - (1 - mask) * torch.log(1 - mask)
         mask_ent_loss = entropy_reg * torch.mean(mask_ent_reg)
 
@@ -108,6 +170,12 @@ class PGExplainer(BaseExplainer):
 
         return cce_loss + size_loss + mask_ent_loss
 
+    def _edge_logits(self, x):
+        embeds = self._model(x, embedding=True).detach()
+        edge_index, _ = self._tiled_edges(x.size(0))
+        input_expl = self._create_explainer_input(edge_index, embeds)
+        return self.explainer_model(input_expl).view(x.size(0), -1)
+
     def prepare(self, indices=None):
         """
         Before we can use the explainer we first need to train it. This is done here.
@@ -122,8 +190,7 @@ class PGExplainer(BaseExplainer):
         )
 
         if indices is None:     # Consider all indices
-            # indices = range(0, self.graphs.size(0)) # --- Original ---------------------------------------------------
-            indices = range(0, len(self.graphs))
+            indices = range(0, len(self.dataset))
 
         self.train(indices=indices)
 
@@ -133,91 +200,58 @@ class PGExplainer(BaseExplainer):
         :param indices: Indices that we want to use for training.
         :return:
         """
+        indices = torch.as_tensor(np.asarray(indices), dtype=torch.long)
+
         # Make sure the explainer model can be trained
+        self.model_to_explain.eval()
         self.explainer_model.train()
 
         # Create optimizer and temperature schedule
         optimizer = Adam(self.explainer_model.parameters(), lr=self.lr)
         temp_schedule = lambda e: self.temp[0]*((self.temp[1]/self.temp[0])**(e/self.epochs))
 
-        # If we are explaining a graph, we can determine the embeddings before we run
-        if self.type == 'node':
-            embeds = self.model_to_explain.embedding(self.features, self.graphs).detach()
+        # The predictions to explain do not change during training
+        with torch.no_grad():
+            original_pred = torch.cat([self._model(self.x[indices[start:start + self.batch_size]]).argmax(-1)
+                                       for start in range(0, len(indices), self.batch_size)])
 
         # Start training loop
         for e in tqdm(range(0, self.epochs)):
-            optimizer.zero_grad()
-            loss = torch.FloatTensor([0]).detach()
             t = temp_schedule(e)
+            perm = torch.randperm(len(indices))
 
-            for n in indices:
-                n = int(n)
-                if self.type == 'node':
-                    # Similar to the original paper we only consider a subgraph for explaining
-                    feats = self.features
-                    graph = ptgeom.utils.k_hop_subgraph(n, 3, self.graphs)[1]
-                else:
-                    # feats = self.features[n].detach()     # --- Original ---------------------------------------------
-                    # graph = self.graphs[n].detach()       # --- Original ---------------------------------------------
-                    feats = self.features[n]
-                    graph = torch.tensor(self.graphs[n])
-                    embeds = self.model_to_explain.embedding(feats, graph).detach()
+            for start in range(0, len(indices), self.batch_size):
+                batch_idx = perm[start:start + self.batch_size]
+                x = self.x[indices[batch_idx]]
 
-                # Sample possible explanation
-                input_expl = self._create_explainer_input(graph, embeds, n).unsqueeze(0)
-                sampling_weights = self.explainer_model(input_expl)
-                mask = self._sample_graph(sampling_weights, t, bias=self.sample_bias).squeeze()
+                optimizer.zero_grad()
 
-                masked_pred = self.model_to_explain(feats, graph, edge_weights=mask)
-                original_pred = self.model_to_explain(feats, graph)
+                # Sample possible explanations for the whole batch
+                sampling_weights = self._edge_logits(x)
+                mask = self._sample_graph(sampling_weights, t, bias=self.sample_bias)
 
-                if self.type == 'node': # we only care for the prediction of the node
-                    masked_pred = masked_pred[n].unsqueeze(dim=0)
-                    original_pred = original_pred[n]
+                masked_pred = self._model(x, edge_weights=mask.view(-1))
+                loss = self._loss(masked_pred, original_pred[batch_idx], mask, self.reg_coefs)
 
-                id_loss = self._loss(masked_pred, torch.argmax(original_pred).unsqueeze(0), mask, self.reg_coefs)
-                loss += id_loss
+                loss.backward()
+                optimizer.step()
 
-            loss.backward()
-            optimizer.step()
-
-    def explain(self, index):
+    def explain(self, indices=None, batch_size=256):
         """
-        Given the index of a node/graph this method returns its explanation.
-        This only gives sensible results if the prepare method has
-        already been called.
-        :param index: index of the node/graph that we wish to explain
-        :return: explanation graph and edge weights
+        Edge weights of the given patients. This only gives sensible results if
+        the prepare method has already been called.
+        :param indices: indices of the patients that we wish to explain (default: all)
+        :return: edge_index of the graph and the [P, E] edge weights
         """
-
-        index = int(index)
-
-        if self.type == 'node':
-            # Similar to the original paper we only consider a subgraph for explaining
-            graph = ptgeom.utils.k_hop_subgraph(index, 3, self.graphs)[1]
-            embeds = self.model_to_explain.embedding(self.features, self.graphs).detach()
-        else:
-
-            x_index = self.features[index]
-            feats = torch.tensor(x_index)
-
-            # feats = self.features[index].clone().detach()
-            # graph = self.graphs[index].clone().detach()   # --- Original ---------------------------------------------
-            graph = self.graphs[index]
-            # graph = np.array(self.graphs[index], copy=True)
-            embeds = self.model_to_explain.embedding(feats, graph).detach()
-
-        # Use explainer mlp to get an explanation
-        input_expl = self._create_explainer_input(graph, embeds, index).unsqueeze(dim=0)
-        sampling_weights = self.explainer_model(input_expl)
-        mask = self._sample_graph(sampling_weights, training=False).squeeze()
-
-        import numpy as np
-        graph = torch.from_numpy(np.asarray(graph))
-        expl_graph_weights = torch.zeros(graph.size(1))     # --- Original --- Combine with original graph -----------
-        for i in range(0, mask.size(0)):
-            pair = graph.T[i]
-            t = index_edge(graph, pair)
-            expl_graph_weights[t] = mask[i]
-
-        return graph, expl_graph_weights
+        if indices is None:
+            indices = range(0, len(self.dataset))
+        indices = torch.as_tensor(np.asarray(indices), dtype=torch.long)
+
+        self.explainer_model.eval()
+        masks = []
+        with torch.no_grad():
+            for start in range(0, len(indices), batch_size):
+                x = self.x[indices[start:start + batch_size]]
+                masks.append(self._sample_graph(self._edge_logits(x), training=False))
+
+        return self.edge_index, torch.cat(masks)
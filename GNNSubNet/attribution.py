@@ -0,0 +1,103 @@
+"""
+Gradient based node attributions for GNN-SubNet models.
+
+Cheaper alternatives to the optimization based GNNExplainer: saliency and
+gradient x input need one batched backward pass per batch of patients,
+SmoothGrad and Integrated Gradients a few (n_samples / n_steps), which are
+evaluated together in one batch. All methods go through BatchedForward, so
+they work for every classifier the explainer supports.
+"""
+
+import torch
+
+from .gnn_explainer import BatchedForward
+
+METHODS = ['saliency', 'gradxinput', 'smoothgrad', 'ig']
+
+
+def _gradients(forward, x, target):
+    """
+    Gradient of the score of the target class w.r.t. the node features x [B, N, F].
+    """
+    x = x.detach().clone().requires_grad_(True)
+    out = forward(x)
+    score = out.gather(1, target.view(-1, 1)).sum()
+    grad, = torch.autograd.grad(score, x)
+    return grad
+
+
+def saliency(forward, x, target):
+    return _gradients(forward, x, target).abs()
+
+
+def gradient_x_input(forward, x, target):
+    return _gradients(forward, x, target) * x
+
+
+def smoothgrad(forward, x, target, n_samples=16, noise=0.15):
+    """
+    Gradients averaged over n_samples noisy copies of x; the noise level is
+    relative to the value range of every patient's features, so it does not
+    depend on the other patients of the batch. All copies go through one forward.
+    """
+    (B, N, F) = x.size()
+    sigma = noise * (x.amax((1, 2)) - x.amin((1, 2))).view(1, B, 1, 1)
+    noisy = x.unsqueeze(0) + sigma * torch.randn(n_samples, B, N, F)
+    grad = _gradients(forward, noisy.view(-1, N, F), target.repeat(n_samples))
+    return grad.view(n_samples, B, N, F).mean(0)
+
+
+def integrated_gradients(forward, x, target, n_steps=16, baseline=None):
+    """
+    Integrated Gradients along the straight path from baseline (default: 0)
+    to x, midpoint Riemann sum with n_steps steps evaluated in one batch.
+    """
+    (B, N, F) = x.size()
+    if baseline is None:
+        baseline = torch.zeros_like(x)
+    alphas = (torch.arange(n_steps, dtype=x.dtype) + 0.5) / n_steps
+    path = baseline.unsqueeze(0) + alphas.view(-1, 1, 1, 1) * (x - baseline).unsqueeze(0)
+    grad = _gradients(forward, path.view(-1, N, F), target.repeat(n_steps))
+    return (x - baseline) * grad.view(n_steps, B, N, F).mean(0)
+
+
+def node_attributions(model, dataset, kind, method='saliency', target=None, batch_size=64, **kwargs):
+    """
+    Attributions of every node of every graph in dataset.
+    :param kind: Input kind of the model, see BatchedForward
+    :param method: saliency, gradxinput, smoothgrad or ig
+    :param target: Class to explain per graph (default: the predicted class)
+    :param kwargs: Passed to the method (n_samples, noise, n_steps, baseline)
+    :return: [P, N] attributions, summed over the node features
+    """
+    assert method in METHODS
+
+    fn = {'saliency': saliency, 'gradxinput': gradient_x_input,
+          'smoothgrad': smoothgrad, 'ig': integrated_gradients}[method]
+
+    model.eval()
+    forward = BatchedForward(model, kind, dataset[0])
+    x = forward.node_features(dataset)
+
+    if target is None:
+        with torch.no_grad():
+            target = torch.cat([forward(x[start:start + batch_size]).argmax(-1)
+                                for start in range(0, len(dataset), batch_size)])
+    target = torch.as_tensor(target).view(-1)
+
+    attributions = []
+    for start in range(0, len(dataset), batch_size):
+        attr = fn(forward, x[start:start + batch_size], target[start:start + batch_size], **kwargs)
+        attributions.append(attr.sum(-1).detach())
+    return torch.cat(attributions)
+
+
+def cohort_node_mask(attributions):
+    """
+    Mean absolute attribution per node over all graphs, min-max normalized
+    to [0, 1] like the sigmoid masks of the explainer.
+    :return: [N, 1] node mask
+    """
+    mask = attributions.abs().mean(0)
+    mask = (mask - mask.min()) / (mask.max() - mask.min()).clamp(min=1e-12)
+    return mask.view(-1, 1)
@@ -1,65 +1,225 @@
+import multiprocessing as mp
+import random
+
 import igraph
 import numpy as np
-from itertools import combinations
-import copy
 
-def find_communities(edge_index_path, edge_masks_path=None, detection_alg='louvain'):
+ALGORITHMS = ['louvain', 'leiden', 'opt_modularity']
+
+def intra_community_sums(edge_index, edge_masks, membership):
     """
-    Creates communities of nodes in a graph based on edge masks and algorithm
-    :param edge_index_path: String which contains path to edge_index file
-    :param edge_masks_path: String which contains path to edge_mask file
-    :param detection_alg: String which decides on algorithm to be used
-    return
-    Average edge masks per community and communities
+    Sum and number of the intra-community edge masks of every community
     """
+    membership = np.asarray(membership)
+    src, dst = edge_index
+    # self loops are no node pairs of a community
+    intra = (membership[src] == membership[dst]) & (src != dst)
+    n_communities = membership.max() + 1 if len(membership) else 0
 
-    assert detection_alg in ['louvain', 'opt_modularity']
+    com = membership[src[intra]]
+    counts = np.bincount(com, minlength=n_communities)
+    sums = np.bincount(com, weights=edge_masks[intra], minlength=n_communities)
+    return sums, counts
 
-    edge_index = np.loadtxt(edge_index_path, dtype=int)
-    if edge_masks_path is not None:
-        edge_masks = abs(np.loadtxt(edge_masks_path, dtype=float))
+def community_scores(edge_index, edge_masks, membership):
+    """
+    Average edge mask of the intra-community edges of every community
+    :param edge_index: [2, E] edge_index array
+    :param edge_masks: [E] edge mask array
+    :param membership: community id of every node
+    return
+    Average edge masks of the communities with at least one intra-community edge
+    """
+    sums, counts = intra_community_sums(edge_index, edge_masks, membership)
+    return list(sums[counts > 0] / counts[counts > 0])
+
+def load_edges(edge_index_path, edge_masks_path=None):
+    """
+    edge_index [2, E] and absolute edge masks [E] from files or arrays
+    """
+    if isinstance(edge_index_path, str):
+        edge_index = np.loadtxt(edge_index_path, dtype=int)
     else:
+        edge_index = np.asarray(edge_index_path, dtype=int)
+    if edge_masks_path is None:
         edge_masks = None
-    s = list(copy.copy(edge_index[0]))
-    t = list(copy.copy(edge_index[1]))
-
-    s.extend(t)
-    nodes = list(set(s))
-
-    edges = np.array(edge_index)
-
-    edges = [(row[0], row[1]) for row in edges.T]
+    elif isinstance(edge_masks_path, str):
+        edge_masks = abs(np.loadtxt(edge_masks_path, dtype=float))
+    else:
+        edge_masks = abs(np.asarray(edge_masks_path, dtype=float).reshape(-1))
+    return edge_index, edge_masks
 
-    g = igraph.Graph()
+def build_graph(edge_index, edge_masks=None):
+    """
+    Weighted igraph graph of the edges, vertex ids are the node ids
+    """
     # use max(nodes)+1 for modified datasets for shorter runtime
-    # all other cases use len(nodes)
-    g.add_vertices(max(nodes)+1)
-    #g.add_vertices(len(nodes))
-    g.add_edges(edges)
+    g = igraph.Graph(n=int(edge_index.max()) + 1, edges=edge_index.T.tolist())
     g.es['weight'] = edge_masks
+    return g
+
+def detect(g, detection_alg='louvain', resolution=1.0, initial_membership=None):
+    """
+    Runs the community detection algorithm on the graph g (see build_graph)
+    :param resolution: resolution of the modularity, higher values give smaller communities
+    :param initial_membership: start partition of leiden, e.g. the result at a nearby resolution
+    return
+    igraph VertexClustering
+    """
+    assert detection_alg in ALGORITHMS
 
+    weights = 'weight' if g.ecount() and g.es['weight'][0] is not None else None
     if detection_alg == 'louvain':
-        partition = g.community_multilevel(weights=edge_masks)
-    elif detection_alg == 'opt_modularity':
-        partition = g.community_optimal_modularity(weights=edge_masks)
-    combs = []
-    for i in range(len(partition)):
-        cs = []
-        for c in combinations(partition[i], r=2):
-            cs.append(c)    
-        combs.append(sorted(list(set(edges) & set(cs))))
+        return g.community_multilevel(weights=weights, resolution=resolution)
+    if detection_alg == 'leiden':
+        return g.community_leiden(objective_function='modularity', weights=weights,
+                                  resolution=resolution, initial_membership=initial_membership)
+    return g.community_optimal_modularity(weights=weights)
+
+def community_sweep(edge_index_path, edge_masks_path=None, resolutions=(0.25, 0.5, 1.0, 2.0, 4.0),
+                    detection_alg='leiden'):
+    """
+    Communities at several resolutions, ordered from coarse to fine, as a hierarchy.
+    The graph is built once; with leiden every resolution starts from the
+    partition of the previous one, so a sweep costs little more than one run.
+    :param resolutions: modularity resolutions
+    return
+    List of levels, one dict per resolution with
+        resolution: the resolution of the level
+        modules:    list of communities (lists of node ids)
+        scores:     average edge mask of every community (nan without intra-community edges)
+        parent:     index of the community of the previous level with the largest overlap (-1 on the first level)
+    """
+    edge_index, edge_masks = load_edges(edge_index_path, edge_masks_path)
+    g = build_graph(edge_index, edge_masks)
+    scored = edge_masks if edge_masks is not None else np.ones(edge_index.shape[1])
+
+    levels = []
+    membership = None
+    for resolution in sorted(resolutions):
+        partition = detect(g, detection_alg, resolution,
+                           initial_membership=None if membership is None else membership.tolist())
+        previous = membership
+        membership = np.asarray(partition.membership)
+
+        sums, counts = intra_community_sums(edge_index, scored, membership)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+        if previous is None:
+            parent = np.full(len(partition), -1)
+        else:
+            # overlap[fine, coarse] = number of shared nodes
+            n_coarse = previous.max() + 1
+            overlap = np.bincount(membership * n_coarse + previous,
+                                  minlength=len(partition) * n_coarse).reshape(len(partition), n_coarse)
+            parent = overlap.argmax(1)
+
+        levels.append(dict(resolution=resolution, modules=[list(c) for c in partition],
+                           scores=scores, parent=parent))
+
+    return levels
+
+def find_communities(edge_index_path, edge_masks_path=None, detection_alg='louvain', resolution=1.0):
+    """
+    Creates communities of nodes in a graph based on edge masks and algorithm
+    :param edge_index_path: String which contains path to edge_index file, or the [2, E] edge_index array
+    :param edge_masks_path: String which contains path to edge_mask file, or the [E] edge mask array
+    :param detection_alg: String which decides on algorithm to be used ('louvain', 'leiden', 'opt_modularity')
+    :param resolution: resolution of the modularity (louvain, leiden), higher values give smaller communities
+    return
+    Average edge masks per community and communities
+    """
+
+    assert detection_alg in ALGORITHMS
+
+    edge_index, edge_masks = load_edges(edge_index_path, edge_masks_path)
+    g = build_graph(edge_index, edge_masks)
+    partition = detect(g, detection_alg, resolution)
 
     avg_edge_masks = []
-    for com in combs:
-        if(len(com) == 0):
-            continue
-        avg_mask = 0
-        if edge_masks is not None:
-            count = 0
-            for edge in com:
-                avg_mask += g.es[g.get_eid(edge[0], edge[1])]['weight']
-                count = count + 1
-            avg_edge_masks.append(avg_mask/count) 
-        
+    if edge_masks is not None:
+        avg_edge_masks = community_scores(edge_index, edge_masks, partition.membership)
+
     return avg_edge_masks, partition
 
+# per-process state of the consensus workers, set by _init_worker
+_WORKER = {}
+
+def _init_worker(edge_index, detection_alg, resolution):
+    _WORKER['edge_index'] = edge_index
+    _WORKER['detection_alg'] = detection_alg
+    _WORKER['resolution'] = resolution
+
+def _run_membership(args):
+    """
+    Community membership of the nodes for the edge mask of one explainer run
+    """
+    idx, edge_masks, seed = args
+    # igraph draws its random numbers from the random module: seed it for this run
+    # and restore the caller's state afterwards (n_jobs=1 runs in the caller's process)
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        g = build_graph(_WORKER['edge_index'], np.abs(edge_masks))
+        partition = detect(g, _WORKER['detection_alg'], _WORKER['resolution'])
+    finally:
+        random.setstate(state)
+    return idx, np.asarray(partition.membership, dtype=np.int32)
+
+def consensus_communities(edge_index_path, run_edge_masks, detection_alg='louvain', resolution=1.0,
+                          threshold=0.5, n_jobs=1, random_seed=None):
+    """
+    Consensus communities of several explainer runs. Communities are detected on
+    the edge mask of every run (in n_jobs processes); for every edge of the graph
+    the fraction of runs that put both of its nodes into one community is counted.
+    Only graph edges are tracked, so memory is O(edges), not O(nodes^2).
+    The consensus modules are the connected components of the edges with a
+    fraction of at least threshold.
+    :param edge_index_path: String which contains path to edge_index file, or the [2, E] edge_index array
+    :param run_edge_masks: [runs, E] edge masks of the single runs
+    :param threshold: minimal co-assignment fraction of an edge within a module
+    return
+    Average edge masks per module, modules, stability per module (mean co-assignment
+    fraction of the edges within the module) and the co-assignment fraction of every edge
+    """
+    edge_index, _ = load_edges(edge_index_path)
+    run_edge_masks = np.asarray(run_edge_masks, dtype=float)
+    n_runs = run_edge_masks.shape[0]
+    run_edge_masks = run_edge_masks.reshape(n_runs, -1)
+    src, dst = edge_index
+
+    seeds = [int(seq.generate_state(1)[0]) for seq in np.random.SeedSequence(random_seed).spawn(n_runs)]
+    tasks = [(idx, run_edge_masks[idx], seeds[idx]) for idx in range(n_runs)]
+
+    together = np.zeros(edge_index.shape[1], dtype=np.int32)
+    if n_jobs > 1:
+        ctx = mp.get_context('spawn')
+        with ctx.Pool(n_jobs, initializer=_init_worker,
+                      initargs=(edge_index, detection_alg, resolution)) as pool:
+            for done, (idx, membership) in enumerate(pool.imap_unordered(_run_membership, tasks), 1):
+                together += membership[src] == membership[dst]
+                print(f'Consensus::run {idx+1} finished ({done} of {n_runs})')
+    else:
+        _init_worker(edge_index, detection_alg, resolution)
+        for task in tasks:
+            _, membership = _run_membership(task)
+            together += membership[src] == membership[dst]
+
+    fraction = together / n_runs
+
+    kept = fraction >= threshold
+    g = igraph.Graph(n=int(edge_index.max()) + 1, edges=edge_index[:, kept].T.tolist())
+    components = g.components()
+    membership = np.asarray(components.membership)
+
+    # components without edges (single nodes) are no modules
+    mask_sums, counts = intra_community_sums(edge_index, np.abs(run_edge_masks.mean(0)), membership)
+    stability_sums, _ = intra_community_sums(edge_index, fraction, membership)
+    keep = counts > 0
+
+    modules = [list(component) for com, component in enumerate(components) if keep[com]]
+    avg_edge_masks = list(mask_sums[keep] / counts[keep])
+    stability = stability_sums[keep] / counts[keep]
+
+    return avg_edge_masks, modules, stability, fraction
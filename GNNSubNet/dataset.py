@@ -18,6 +18,7 @@ from .features_computation import get_genes, get_genes_bernoulli, sigmoid, gen_s
 from .graph_dataset import GraphDataset
 from .s2vgraph import S2VGraph
 from .gnn_training_utils import check_if_graph_is_connected
+from .results_bundle import save_bundle, BUNDLE_NAME
 
 def generate_community(graphs_nr: int, nodes_per_graph_nr: int, sigma, graph, node_indices, no_of_features):
     edges = torch.zeros(size=(2,len(graph.edges())), dtype=torch.long)
@@ -195,16 +196,31 @@ def load_syn_dataset(path: str, indices=None, type_of_feat="int"):
 
 
 def save_results(path: str, confusion_array: list, gnn_edge_masks: list,
-                 log_logits_init: list, log_logits_post: list):
+                 log_logits_init: list, log_logits_post: list, save_format: str = "text",
+                 compress: bool = False):
     """
     Saves results of explanations to path
     :param path: path where to store results
     :param confusion_array: array of values from confusion matrix
     :param: edge_masks: values of edge masks from explainer
+    :param save_format: "text" (csv files) or "bundle" (results/results.gnnsubnet, full precision)
+    :param compress: deflate the bundle members (not memory-mappable then, see save_bundle)
     return 
     """
     Path(f"{path}/results").mkdir(parents=True, exist_ok=True)
 
+    if save_format == "bundle":
+        confusion_array = np.asarray(confusion_array)
+        if confusion_array.dtype == object:
+            confusion_array = confusion_array.astype(str)
+        save_bundle(f'{path}/results/{BUNDLE_NAME}',
+                    dict(confusions=confusion_array,
+                         gnn_edge_masks=np.reshape(gnn_edge_masks, (len(gnn_edge_masks), -1)),
+                         log_logits_init=np.reshape(log_logits_init, (len(log_logits_init), -1)),
+                         log_logits_post=np.reshape(log_logits_post, (len(log_logits_post), -1))),
+                    compress=compress)
+        return
+
     np.savetxt(f'{path}/results/confusions.csv', confusion_array, delimiter=',', fmt="%s")
     gnn_edge_masks = np.reshape(gnn_edge_masks, (len(gnn_edge_masks), -1))
     np.savetxt(f'{path}/results/gnn_edge_masks.csv', gnn_edge_masks, delimiter=',', fmt='%.3f')
@@ -0,0 +1,131 @@
+"""
+Vectorized ensembles of identically shaped models.
+"""
+
+import copy
+import warnings
+
+import torch
+import torch.nn as nn
+from torch.func import stack_module_state, functional_call, vmap
+
+
+def _vmap_unsupported(error):
+    """
+    True for the errors torch.func.vmap raises for operators without batching
+    rules (sparse tensors, custom kernels, data dependent control flow).
+    """
+    message = str(error).lower()
+    return any(text in message for text in ["batching rule", "vmap", "sparse", "functorch", "batchedtensor"])
+
+
+class ModelEnsemble(nn.Module):
+    """
+    Holds the parameters of M models with the same architecture as stacked
+    tensors and evaluates all members on the same input with a single
+    torch.func.vmap call. forward() returns the member-averaged output, so an
+    ensemble can be used wherever a single model is expected (prediction,
+    GNNExplainer).
+    """
+    def __init__(self, models, vectorize=True):
+        """
+        Init
+        :param models: List of models with identical architecture (e.g. GraphCNN or GraphCheb
+                       instances created with different seeds)
+        :param vectorize: evaluate the members with vmap (see check_vmap), otherwise one
+                          after the other
+        """
+        super(ModelEnsemble, self).__init__()
+
+        if len(models) < 1:
+            raise ValueError("an ensemble needs at least one model")
+
+        self.n_models = len(models)
+
+        params, buffers = stack_module_state(models)
+        self.param_names  = list(params.keys())
+        self.buffer_names = list(buffers.keys())
+
+        # [M, ...] stacked parameters and buffers, member i is slice i
+        self.stacked_params = nn.ParameterList([nn.Parameter(params[name].detach().clone())
+                                                for name in self.param_names])
+        for idx, name in enumerate(self.buffer_names):
+            self.register_buffer(f"stacked_buffer_{idx}", buffers[name].detach().clone())
+
+        # Stateless copy of the architecture, only used as a template for functional_call.
+        # Not registered as a submodule so its (meta) parameters stay out of .parameters().
+        object.__setattr__(self, "base_model", copy.deepcopy(models[0]).to("meta"))
+        # GraphCNN: index_add instead of sparse matmuls, so that vmap can batch the members
+        if hasattr(self.base_model, "sparse_propagation"):
+            self.base_model.sparse_propagation = False
+
+        self._vectorized = vectorize
+
+    def _member_state(self, idx=None):
+        """
+        Parameters and buffers of all members (idx=None) or of member idx.
+        """
+        params  = {}
+        buffers = {}
+        for name, param in zip(self.param_names, self.stacked_params):
+            params[name] = param if idx is None else param[idx]
+        for pos, name in enumerate(self.buffer_names):
+            buf = getattr(self, f"stacked_buffer_{pos}")
+            buffers[name] = buf if idx is None else buf[idx]
+        return params, buffers
+
+    def _call_member(self, params, buffers, args, kwargs):
+        return functional_call(self.base_model, (params, buffers), args, kwargs)
+
+    def check_vmap(self, *args, **kwargs):
+        """
+        Evaluate the members once with vmap on an example input and fall back to a loop
+        over the members (with a warning) if the model has operators without batching
+        rules. Other errors are raised.
+        :return: True if the members are vectorized
+        """
+        if not self._vectorized:
+            return False
+
+        params, buffers = self._member_state()
+        try:
+            with torch.no_grad():
+                vmap(lambda p, b: self._call_member(p, b, args, kwargs), randomness="different")(params, buffers)
+        except (RuntimeError, NotImplementedError) as e:
+            if not _vmap_unsupported(e):
+                raise
+            warnings.warn(f"vmap is not supported by {type(self.base_model).__name__} ({e}): the ensemble "
+                          f"is not vectorized, its {self.n_models} members are evaluated one after the other")
+            self._vectorized = False
+        return self._vectorized
+
+    def forward_all(self, *args, **kwargs):
+        """
+        Evaluate every member on the same input.
+        :return: Stacked member outputs of shape [M, ...]
+        """
+        self.base_model.train(self.training)
+
+        if self._vectorized:
+            params, buffers = self._member_state()
+            return vmap(lambda p, b: self._call_member(p, b, args, kwargs), randomness="different")(params, buffers)
+
+        return torch.stack([self._call_member(*self._member_state(idx), args, kwargs) for idx in range(self.n_models)])
+
+    def forward(self, *args, **kwargs):
+        return self.forward_all(*args, **kwargs).mean(0)
+
+    def member(self, idx):
+        """
+        Returns member idx as a standalone model.
+        """
+        device = self.stacked_params[0].device
+        model = copy.deepcopy(self.base_model).to_empty(device=device)
+        params, buffers = self._member_state(idx)
+        state = dict(params)
+        state.update(buffers)
+        model.load_state_dict({name: tensor.detach().clone() for name, tensor in state.items()})
+        if hasattr(model, "sparse_propagation"):
+            model.sparse_propagation = True
+        model.train(self.training)
+        return model
@@ -0,0 +1,136 @@
+"""
+Persistent cache of explanation results.
+
+Entries are keyed by a sha256 fingerprint of the model weights, the test set
+(node features and labels), the explanation method and its hyperparameters.
+Two kinds of entries are stored as .npz files in <location>/.explain_cache:
+
+    <key>_runs.npz          running statistics of the node and edge masks of all
+                            completed explainer runs (and, with keep_runs, their
+                            raw node masks), so a larger n_runs only computes the
+                            missing runs
+    <key>_result<n>.npz     final masks and communities of an explain() call
+                            with n runs
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def fingerprint(model, dataset, method, params):
+    """
+    sha256 of the model's state_dict, the test graphs, the method and its parameters.
+    """
+    h = hashlib.sha256()
+
+    state = model.state_dict()
+    for name in sorted(state):
+        h.update(name.encode())
+        h.update(state[name].detach().cpu().contiguous().numpy().tobytes())
+
+    for graph in dataset:
+        x = graph.node_features if hasattr(graph, 'node_features') else graph.x
+        label = graph.label if hasattr(graph, 'label') else graph.y
+        h.update(x.detach().cpu().contiguous().numpy().tobytes())
+        h.update(str(int(label)).encode())
+
+    h.update(method.encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class ExplanationCache(object):
+    """
+    npz files in <location>/.explain_cache
+    """
+    def __init__(self, location=None):
+        self.path = os.path.join(location or ".", ".explain_cache")
+
+    def _file(self, key, name):
+        return os.path.join(self.path, f"{key}_{name}.npz")
+
+    def _save(self, key, name, **arrays):
+        os.makedirs(self.path, exist_ok=True)
+        target = self._file(key, name)
+        tmp = target + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        # readers never see half written entries
+        os.replace(tmp, target)
+
+    def _load(self, key, name):
+        path = self._file(key, name)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    def load_runs(self, key):
+        """
+        :return: dict with the RunningStats states node_stats and edge_stats, the epochs
+                 used [R] and the raw node masks [N, R] (None unless runs were kept),
+                 or None
+        """
+        runs = self._load(key, "runs")
+        if runs is None:
+            return None
+        stats = {}
+        for kind in ["node", "edge"]:
+            stats[f"{kind}_stats"] = {name: runs[f"{kind}_{name}"] for name in ["n", "mean", "m2", "reservoir"]}
+        return dict(stats, epochs=runs["epochs"], masks=runs["masks"] if runs["masks"].size else None)
+
+    def save_runs(self, key, node_stats, edge_stats, epochs, masks=None):
+        """
+        :param node_stats, edge_stats: RunningStats of the node and edge masks
+        :param masks: raw node masks [N, R] of the runs, only stored if given
+        """
+        arrays = {}
+        for kind, stats in [("node", node_stats), ("edge", edge_stats)]:
+            for name, value in stats.state().items():
+                arrays[f"{kind}_{name}"] = value
+        self._save(key, "runs", epochs=np.asarray(epochs),
+                   masks=np.zeros((0, 0)) if masks is None else np.asarray(masks), **arrays)
+
+    def load_result(self, key, n_runs):
+        """
+        :return: dict with edge_mask, node_mask, node_mask_matrix, the std and quantiles
+                 of the masks and, if communities were detected, modules and
+                 module_importances
+        """
+        result = self._load(key, f"result{n_runs}")
+        if result is None:
+            return None
+
+        # runs were not kept (see GNNSubNet.keep_runs), no quantiles requested
+        for name in ["node_mask_matrix", "node_mask_std", "edge_mask_std", "node_mask_quantiles", "edge_mask_quantiles"]:
+            if name not in result or result[name].size == 0:
+                result[name] = None
+
+        if result.pop("has_modules"):
+            members, offsets = result.pop("module_members"), result.pop("module_offsets")
+            result["modules"] = [list(members[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+        else:
+            result["modules"] = None
+            result.pop("module_importances")
+        return result
+
+    def save_result(self, key, n_runs, edge_mask, node_mask, node_mask_matrix, modules=None, module_importances=None,
+                    **mask_stats):
+        """
+        :param mask_stats: node_mask_std, edge_mask_std, node_mask_quantiles, edge_mask_quantiles
+                           (None if not computed)
+        """
+        mask_stats = {name: np.zeros(0) if value is None else np.asarray(value) for name, value in mask_stats.items()}
+        has_modules = modules is not None
+        modules = modules or []
+        sizes = [len(module) for module in modules]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        members = np.array([node for module in modules for node in module], dtype=np.int64)
+        self._save(key, f"result{n_runs}", edge_mask=np.asarray(edge_mask), node_mask=np.asarray(node_mask),
+                   node_mask_matrix=np.zeros((0, 0)) if node_mask_matrix is None else np.asarray(node_mask_matrix),
+                   has_modules=np.array(has_modules),
+                   module_members=members, module_offsets=offsets,
+                   module_importances=np.asarray(module_importances if has_modules else []), **mask_stats)
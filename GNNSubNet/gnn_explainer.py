@@ -44,8 +44,29 @@ class GNNExplainer(torch.nn.Module):
             (default: :obj:`"log_prob"`)
         log (bool, optional): If set to :obj:`False`, will not log any learning
             progress. (default: :obj:`True`)
+        sample_size (int, optional): The number of patients evaluated per
+            epoch by the modified (cohort) explainers. (default: :obj:`10`)
+        min_epochs (int, optional): If set, the modified explainers stop
+            after at least :obj:`min_epochs` (and at most :obj:`epochs`)
+            epochs once mask and loss converged. (default: :obj:`None`)
+        tol (float, optional): Relative change of the sigmoid node mask and
+            of the loss within one resample window below which a run counts
+            as converged. (default: :obj:`1e-2`)
     """
 
+    # input kind of BatchedForward used by the modified explainers
+    kinds = {
+        'explain_graph_modified_s2v': 's2v',
+        'explain_graph_modified_s2v_API': 's2v',
+        'explain_graph_modified_cheb': 'cheb',
+        'explain_graph_modified_chebnet': 'cheb',
+        'explain_graph_modified_cheb2': 'cheb2',
+        'explain_graph_modified_chebnet2': 'cheb2',
+    }
+
+    # the patient sample of the modified explainers is redrawn every resample_every epochs
+    resample_every = 50
+
     coeffs = {
         'edge_size': 0.005,
         'edge_reduction': 'sum',
@@ -57,7 +78,8 @@ class GNNExplainer(torch.nn.Module):
 
     def __init__(self, model, epochs: int = 100, lr: float = 0.01,
                  num_hops: Optional[int] = None, return_type: str = 'log_prob',
-                 log: bool = True):
+                 log: bool = True, sample_size: int = 10,
+                 min_epochs: Optional[int] = None, tol: float = 1e-2):
         super(GNNExplainer, self).__init__()
         assert return_type in ['log_prob', 'prob', 'raw']
         self.model = model
@@ -66,8 +88,12 @@ class GNNExplainer(torch.nn.Module):
         self.__num_hops__ = num_hops
         self.return_type = return_type
         self.log = log
+        self.sample_size = sample_size
+        self.min_epochs = min_epochs
+        self.tol = tol
+        self.epochs_used = None
 
-    def __set_masks__(self, x, edge_index, init="normal", type=2):
+    def __set_masks__(self, x, edge_index, init="normal", type=2, edge_mask=True, n_masks=1):
         (N, F), E = x.size(), edge_index.size(1)
 
         #print(N)
@@ -81,8 +107,14 @@ class GNNExplainer(torch.nn.Module):
         if type == 2: # mask the nodes
             #self.node_feat_mask = torch.nn.Parameter(torch.randn(N) * 0.1)
             self.node_feat_mask = torch.nn.Parameter(torch.randn(N, 1) * std)
+            if n_masks > 1: # independent restarts, optimized together
+                self.node_feat_mask = torch.nn.Parameter(torch.randn(n_masks, N, 1) * std)
         
 
+        if not edge_mask:
+            # only the node mask is optimized and returned
+            return
+
         std = torch.nn.init.calculate_gain('relu') * sqrt(2.0 / (2 * N))
         self.edge_mask = torch.nn.Parameter(torch.randn(E) * std)
 
@@ -367,8 +399,6 @@ class GNNExplainer(torch.nn.Module):
         self.__clear_masks__()    
 
         PRED = []
-        LOGITS = []
-        LOGITS2 =[]
         # Get the initial prediction.
         with torch.no_grad():
             #for yy in range(len(dataset)):
@@ -377,8 +407,6 @@ class GNNExplainer(torch.nn.Module):
             log_logits = self.__to_log_prob__(out)
             pp = log_logits.argmax(dim=-1)
             PRED.append(pp)
-            LOGITS.append(-log_logits[0, pp])
-            LOGITS2.append(-log_logits[0, :])    
 
         self.__set_masks__(dataset[0].node_features,dataset[0].edge_mat)
         self.to(x.device)
@@ -407,12 +435,9 @@ class GNNExplainer(torch.nn.Module):
             data_copy.node_features = h
             out = self.model([data_copy])
             log_logits = self.__to_log_prob__(out)
-            loss_hit  = self.__loss__(-1, log_logits, PRED[0])
-            loss_fail = self.__loss__(-1, log_logits, abs(PRED[0]-1))
-            loss_xx = loss_hit 
-
-        loss_xx.backward()
-        optimizer.step()
+            loss_xx  = self.__loss__(-1, log_logits, PRED[0])
+            loss_xx.backward()
+            optimizer.step()
          
         return self.node_feat_mask.view(-1,1).detach() #self.edge_mask.detach().sigmoid()
 
@@ -422,8 +447,6 @@ class GNNExplainer(torch.nn.Module):
         self.__clear_masks__()    
 
         PRED = []
-        LOGITS = []
-        LOGITS2 =[]
         # Get the initial prediction.
         with torch.no_grad():
             for yy in range(len(dataset)):
@@ -433,8 +456,6 @@ class GNNExplainer(torch.nn.Module):
                 log_logits = self.__to_log_prob__(out)
                 pp = log_logits.argmax(dim=-1)
                 PRED.append(pp)
-                LOGITS.append(-log_logits[0, pp])
-                LOGITS2.append(-log_logits[0, :])    
 
         self.__set_masks__(dataset[0].x,dataset[0].edge_index)
         self.to(x.device)
@@ -472,383 +493,229 @@ class GNNExplainer(torch.nn.Module):
         return self.edge_mask.detach().sigmoid()
 
 
-    def explain_graph_modified_cheb(self, dataset, param):
-        
+    def initial_prediction(self, dataset, kind, batch_size=128):
+        """
+        Predicted class of every graph in dataset, computed in batches
+        of batch_size graphs.
+        """
         self.model.eval()
-        self.__clear_masks__()    
+        forward = BatchedForward(self.model, kind, dataset[0])
+        x = forward.node_features(dataset)
 
-        PRED = []
-        LOGITS = []
-        LOGITS2 =[]
-        # Get the initial prediction.
+        pred = []
         with torch.no_grad():
-            for yy in range(len(dataset)):
-                #x, edge_index = dataset[yy].node_features, dataset[yy].edge_mat
-                x, edge_index = dataset[yy].x, dataset[yy].edge_index   
-                out = self.model(x=x, edge_index=edge_index).max(0)[0]
-                #print(out)
-                log_logits = self.__to_log_prob__(out)
-                log_logits = torch.reshape(log_logits,(1,2))
-                pp = log_logits.argmax(dim=-1)
-                PRED.append(pp)
-                LOGITS.append(-log_logits[0,pp])
-                LOGITS2.append(-log_logits[0,:])    
+            for start in range(0, len(dataset), batch_size):
+                log_logits = self.__to_log_prob__(forward(x[start:start + batch_size]))
+                pred.append(log_logits.argmax(dim=-1))
+        return torch.cat(pred)
 
-        self.__set_masks__(dataset[0].x,dataset[0].edge_index)
-        self.to(x.device)
+    def explain_graph_modified_cheb(self, dataset, param, n_restarts=1, pred=None):
         
-        n_nodes = dataset[0].x.size()[0]
+        self.model.eval()
+        self.__clear_masks__()    
 
-        optimizer = torch.optim.Adam([self.edge_mask, self.node_feat_mask], lr=self.lr)
-        
-        #optimizer = torch.optim.Adam([self.edge_mask],
-        #                             lr=self.lr)                                  
+        # Get the initial prediction.
+        if pred is None:
+            pred = self.initial_prediction(dataset, "cheb")
 
-        # all nodes belong to same graph
-        batch = torch.zeros(x.shape[0], dtype=int, device=x.device)
-        
-        for epoch in range(1, self.epochs + 1):
-            loss_xx  = 0 
-            sampSize = 10
-            if epoch%50==1: 
-                ids  = np.random.randint(len(dataset), size=sampSize)
-                
-            optimizer.zero_grad()
-            for dd in ids: 
-                data = dataset[dd]
-                data_copy = copy(data)
-                h = data.x * self.node_feat_mask.sigmoid()
-                data_copy.x = h
-                out = self.model(x=data_copy.x, edge_index=data_copy.edge_index).max(0)[0]
-                log_logits = self.__to_log_prob__(out)
-                log_logits = torch.reshape(log_logits,(1,2))
-                loss_hit  = self.__loss__(-1, log_logits, PRED[dd])
-                loss_fail = self.__loss__(-1, log_logits, abs(PRED[dd]-1))
-                #print(LOGITS2[dd])
-                #print(log_logits)
-                #print(out)
-                loss_xx = loss_xx + loss_hit 
-            loss_xx.backward()
-            optimizer.step()
-         
-        return self.node_feat_mask.view(-1,1).detach() #self.edge_mask.detach().sigmoid()
+        self.__set_masks__(dataset[0].x,dataset[0].edge_index, edge_mask=False, n_masks=n_restarts)
+        self.to(dataset[0].x.device)
+
+        return self.__explain_node_mask__(dataset, pred, "cheb")
     
-    def explain_graph_modified_cheb2(self, dataset, param):
+    def explain_graph_modified_cheb2(self, dataset, param, n_restarts=1, pred=None):
         
         self.model.eval()
         self.__clear_masks__()    
-        n_nodes = dataset[0].x.size()[0]
-        PRED = []
-        LOGITS = []
-        LOGITS2 =[]
-        # Get the initial prediction.
-        with torch.no_grad():
-            for yy in range(len(dataset)):
-                #x, edge_index = dataset[yy].node_features, dataset[yy].edge_mat
-                x, edge_index = dataset[yy].x, dataset[yy].edge_index   
-                #tr = DataLoader(dataset[yy], batch_size=None, shuffle=False)
-                #for vv in tr:
-                out = self.model(x, edge_index, batch=torch.LongTensor(np.zeros(n_nodes)))
-                #out = self.model(x=x, edge_index=edge_index)
-                #print(out)
-                log_logits = self.__to_log_prob__(out)
-                log_logits = torch.reshape(log_logits,(1,2))
-                pp = log_logits.argmax(dim=-1)
-                PRED.append(pp)
-                LOGITS.append(-log_logits[0,pp])
-                LOGITS2.append(-log_logits[0,:])    
 
-        self.__set_masks__(dataset[0].x,dataset[0].edge_index)
-        self.to(x.device)
-        
-        n_nodes = dataset[0].x.size()[0]
+        # Get the initial prediction.
+        if pred is None:
+            pred = self.initial_prediction(dataset, "cheb2")
 
-        optimizer = torch.optim.Adam([self.edge_mask, self.node_feat_mask], lr=self.lr)
-        
-        #optimizer = torch.optim.Adam([self.edge_mask],
-        #                             lr=self.lr)                                  
+        self.__set_masks__(dataset[0].x,dataset[0].edge_index, edge_mask=False, n_masks=n_restarts)
+        self.to(dataset[0].x.device)
 
-        # all nodes belong to same graph
-        batch = torch.zeros(x.shape[0], dtype=int, device=x.device)
-        
-        for epoch in range(1, self.epochs + 1):
-            loss_xx  = 0 
-            sampSize = 10
-            if epoch%50==1: 
-                ids  = np.random.randint(len(dataset), size=sampSize)
-                
-            optimizer.zero_grad()
-            for dd in ids: 
-                data = dataset[dd]
-                data_copy = copy(data)
-                h = data.x * self.node_feat_mask.sigmoid()
-                data_copy.x = h
-                #tr = DataLoader(data_copy, batch_size=None, shuffle=False)
-                #for vv in tr:
-                out = self.model(data_copy.x, data_copy.edge_index, batch=torch.LongTensor(np.zeros(n_nodes)))
-                #out = self.model(x=data_copy.x, edge_index=data_copy.edge_index).max(0)[0]
-                log_logits = self.__to_log_prob__(out)
-                log_logits = torch.reshape(log_logits,(1,2))
-                loss_hit  = self.__loss__(-1, log_logits, PRED[dd])
-                loss_fail = self.__loss__(-1, log_logits, abs(PRED[dd]-1))
-                #print(LOGITS2[dd])
-                #print(log_logits)
-                #print(out)
-                loss_xx = loss_xx + loss_hit 
-            loss_xx.backward()
-            optimizer.step()
-         
-        return self.node_feat_mask.view(-1,1).detach() #self.edge_mask.detach().sigmoid()
+        return self.__explain_node_mask__(dataset, pred, "cheb2")
             
-    def explain_graph_modified_chebnet(self, dataset, param):
+    def explain_graph_modified_chebnet(self, dataset, param, n_restarts=1, pred=None):
+        # same batched optimization as for ChebConv
+        return self.explain_graph_modified_cheb(dataset, param, n_restarts, pred)
 
+    def explain_graph_modified_chebnet2(self, dataset, param, n_restarts=1, pred=None):
+        # same batched optimization as for GraphCheb
+        return self.explain_graph_modified_cheb2(dataset, param, n_restarts, pred)
+    
+    def explain_graph_modified_s2v(self, dataset, param, n_restarts=1, pred=None):
         self.model.eval()
         self.__clear_masks__()    
 
-        PRED = []
-        LOGITS = []
-        LOGITS2 =[]
         # Get the initial prediction.
-        with torch.no_grad():
-            for yy in range(len(dataset)):
-                #x, edge_index = dataset[yy].node_features, dataset[yy].edge_mat
-                x, edge_index = dataset[yy].x, dataset[yy].edge_index   
-                out = self.model(x=x, edge_index=edge_index).max(0)[0]
-                #print(out)
-                log_logits = self.__to_log_prob__(out)
-                log_logits = torch.reshape(log_logits,(1,2))
-                pp = log_logits.argmax(dim=-1)
-                PRED.append(pp)
-                LOGITS.append(-log_logits[0,pp])
-                LOGITS2.append(-log_logits[0,:])    
-
-        self.__set_masks__(dataset[0].x,dataset[0].edge_index)
-        self.to(x.device)
-
-        n_nodes = dataset[0].x.size()[0]
-
-        optimizer = torch.optim.Adam([self.edge_mask, self.node_feat_mask], lr=self.lr)
+        if pred is None:
+            pred = self.initial_prediction(dataset, "s2v")
 
-        #optimizer = torch.optim.Adam([self.edge_mask],
-        #                             lr=self.lr)                                  
+        self.__set_masks__(dataset[0].node_features,dataset[0].edge_mat, edge_mask=False, n_masks=n_restarts)
+        self.to(dataset[0].node_features.device)
 
-        # all nodes belong to same graph
-        batch = torch.zeros(x.shape[0], dtype=int, device=x.device)
+        return self.__explain_node_mask__(dataset, pred, "s2v")
 
-        for epoch in range(1, self.epochs + 1):
-            loss_xx  = 0 
-            sampSize = 10
-            if epoch%50==1: 
-                ids  = np.random.randint(len(dataset), size=sampSize)
-
-            optimizer.zero_grad()
-            for dd in ids: 
-                data = dataset[dd]
-                data_copy = copy(data)
-                h = data.x * self.node_feat_mask.sigmoid()
-                data_copy.x = h
-                out = self.model(x=data_copy.x, edge_index=data_copy.edge_index).max(0)[0]
-                log_logits = self.__to_log_prob__(out)
-                log_logits = torch.reshape(log_logits,(1,2))
-                loss_hit  = self.__loss__(-1, log_logits, PRED[dd])
-                loss_fail = self.__loss__(-1, log_logits, abs(PRED[dd]-1))
-                #print(LOGITS2[dd])
-                #print(log_logits)
-                #print(out)
-                loss_xx = loss_xx + loss_hit 
-            loss_xx.backward()
-            optimizer.step()
-
-        return self.node_feat_mask.view(-1,1).detach() #self.edge_mask.detach().sigmoid()
-
-    def explain_graph_modified_chebnet2(self, dataset, param):
+    def explain_graph_modified_s2v_API(self, dataset, param, node_mask=False, pred=None):
 
         self.model.eval()
         self.__clear_masks__()    
-        n_nodes = dataset[0].x.size()[0]
-        PRED = []
-        LOGITS = []
-        LOGITS2 =[]
+
         # Get the initial prediction.
-        with torch.no_grad():
-            for yy in range(len(dataset)):
-                #x, edge_index = dataset[yy].node_features, dataset[yy].edge_mat
-                x, edge_index = dataset[yy].x, dataset[yy].edge_index   
-                #tr = DataLoader(dataset[yy], batch_size=None, shuffle=False)
-                #for vv in tr:
-                out = self.model(x, edge_index, batch=torch.LongTensor(np.zeros(n_nodes)))
-                #out = self.model(x=x, edge_index=edge_index)
-                #print(out)
-                log_logits = self.__to_log_prob__(out)
-                log_logits = torch.reshape(log_logits,(1,2))
-                pp = log_logits.argmax(dim=-1)
-                PRED.append(pp)
-                LOGITS.append(-log_logits[0,pp])
-                LOGITS2.append(-log_logits[0,:])    
+        if pred is None:
+            pred = self.initial_prediction(dataset, "s2v")
 
-        self.__set_masks__(dataset[0].x,dataset[0].edge_index)
-        self.to(x.device)
+        if node_mask is False:
+            self.__set_masks__(dataset[0].node_features, dataset[0].edge_mat, edge_mask=False)
+        else:
+            N = dataset[0].node_features.size(0)
+            std = 0.1
+            # inverse of sigmoid
+            node_mask = np.log(1/(1-node_mask))
+            # transform to tensor 
+            self.node_feat_mask = torch.nn.Parameter(torch.from_numpy(node_mask*std).float().view(N, 1))
 
-        n_nodes = dataset[0].x.size()[0]
+        self.to(dataset[0].node_features.device)
 
-        optimizer = torch.optim.Adam([self.edge_mask, self.node_feat_mask], lr=self.lr)
+        return self.__explain_node_mask__(dataset, pred, "s2v")
 
-        #optimizer = torch.optim.Adam([self.edge_mask],
-        #                             lr=self.lr)                                  
+    def __node_loss__(self, log_logits, pred_label, mask):
+        # per-restart sum of the per-patient losses of the sampled patients (node mask terms only),
+        # log_logits [R, S, C], pred_label [R, S] and mask [R, N] for R restarts with S patients each
+        n = pred_label.size(1)
+        loss = -log_logits.gather(-1, pred_label.unsqueeze(-1)).view(-1, n).sum(1)
 
-        # all nodes belong to same graph
-        batch = torch.zeros(x.shape[0], dtype=int, device=x.device)
+        m = mask.sigmoid()
+        node_feat_reduce = getattr(torch, self.coeffs['node_feat_reduction'])
+        loss = loss + n * self.coeffs['node_feat_size'] * node_feat_reduce(m, dim=1)
+        ent = -m * torch.log(m + EPS) - (1 - m) * torch.log(1 - m + EPS)
+        loss = loss + n * self.coeffs['node_feat_ent'] * ent.mean(1)
+
+        return loss
+
+    def __explain_node_mask__(self, dataset, pred, kind):
+        """
+        Optimizes the node mask shared by all patients. Every 50 epochs
+        sample_size patients are drawn, each epoch evaluates the masked
+        sample with a single batched forward.
+
+        With a [R, N, 1] mask the R restarts are optimized together: each
+        draws its own patients, all R * sample_size patients go through one
+        forward and the summed loss keeps the restarts independent (Adam is
+        elementwise), so the masks are distributed as R sequential runs.
+
+        If min_epochs is set, a restart stops (its mask is frozen and it is
+        left out of the forward) at the end of the first resample window
+        after min_epochs in which the relative change of its sigmoid mask
+        and of its loss are both below tol. The epochs used per restart are
+        stored in self.epochs_used.
+        :return: [N, R] raw (pre-sigmoid) node masks
+        """
+        forward = BatchedForward(self.model, kind, dataset[0])
+        x = forward.node_features(dataset)
+        (P, N, F) = x.size()
+        R = self.node_feat_mask.numel() // N
+        pred_label = torch.as_tensor(pred).view(-1)
+        window = self.resample_every
+
+        optimizer = torch.optim.Adam([self.node_feat_mask], lr=self.lr)
+        masks = self.node_feat_mask.data.view(R, N)
+        active = torch.ones(R, dtype=torch.bool)
+        self.epochs_used = np.full(R, self.epochs)
+        first_loss = torch.zeros(R)
+        last_loss = torch.zeros(R)
 
         for epoch in range(1, self.epochs + 1):
-            loss_xx  = 0 
-            sampSize = 10
-            if epoch%50==1: 
-                ids  = np.random.randint(len(dataset), size=sampSize)
+            if epoch%window==1 or window==1:
+                ids  = torch.from_numpy(np.random.randint(P, size=(R, self.sample_size)))
+                window_mask = masks.sigmoid()
 
+            act = active.nonzero().view(-1)
             optimizer.zero_grad()
-            for dd in ids: 
-                data = dataset[dd]
-                data_copy = copy(data)
-                h = data.x * self.node_feat_mask.sigmoid()
-                data_copy.x = h
-                #tr = DataLoader(data_copy, batch_size=None, shuffle=False)
-                #for vv in tr:
-                out = self.model(data_copy.x, data_copy.edge_index, batch=torch.LongTensor(np.zeros(n_nodes)))
-                #out = self.model(x=data_copy.x, edge_index=data_copy.edge_index).max(0)[0]
-                log_logits = self.__to_log_prob__(out)
-                log_logits = torch.reshape(log_logits,(1,2))
-                loss_hit  = self.__loss__(-1, log_logits, PRED[dd])
-                loss_fail = self.__loss__(-1, log_logits, abs(PRED[dd]-1))
-                #print(LOGITS2[dd])
-                #print(log_logits)
-                #print(out)
-                loss_xx = loss_xx + loss_hit 
-            loss_xx.backward()
+            mask = self.node_feat_mask.view(R, 1, N, 1)[act]
+            h = (x[ids[act]] * mask.sigmoid()).view(-1, N, F)
+            log_logits = self.__to_log_prob__(forward(h)).view(len(act), self.sample_size, -1)
+            loss_xx = self.__node_loss__(log_logits, pred_label[ids[act]], mask.view(len(act), N))
+            loss_xx.sum().backward()
+
+            frozen = masks[~active].clone()
             optimizer.step()
+            # Adam momentum would still move the converged restarts
+            masks[~active] = frozen
 
-        return self.node_feat_mask.view(-1,1).detach() #self.edge_mask.detach().sigmoid()
-    
-    def explain_graph_modified_s2v(self, dataset, param):
-        self.model.eval()
-        self.__clear_masks__()    
+            if epoch%window==1 or window==1:
+                first_loss[act] = loss_xx.detach()
 
-        PRED = []
-        LOGITS = []
-        LOGITS2 =[]
-        # Get the initial prediction.
-        with torch.no_grad():
-            for yy in range(len(dataset)):
-                x, edge_index = dataset[yy].node_features, dataset[yy].edge_mat
-                out = self.model([dataset[yy]])
-                log_logits = self.__to_log_prob__(out)
-                pp = log_logits.argmax(dim=-1)
-                PRED.append(pp)
-                LOGITS.append(-log_logits[0, pp])
-                LOGITS2.append(-log_logits[0, :])    
+            if self.min_epochs is None or epoch%window!=0 or epoch < self.min_epochs:
+                continue
 
-        self.__set_masks__(dataset[0].node_features,dataset[0].edge_mat)
-        self.to(x.device)
-        
-        n_nodes = dataset[0].node_features.size()[0]
+            # convergence within the resample window (same patient sample)
+            last_loss[act] = loss_xx.detach()
+            d_mask = (masks.sigmoid() - window_mask).norm(dim=1) / window_mask.norm(dim=1).clamp(min=EPS)
+            d_loss = (last_loss - first_loss).abs() / first_loss.abs().clamp(min=EPS)
+            converged = active & (d_mask < self.tol) & (d_loss < self.tol)
+            self.epochs_used[converged.numpy()] = epoch
+            active &= ~converged
+            if not active.any():
+                break
 
-        optimizer = torch.optim.Adam([self.edge_mask, self.node_feat_mask], lr=self.lr)
-        
-        #optimizer = torch.optim.Adam([self.edge_mask],
-        #                             lr=self.lr)                                  
-
-        # all nodes belong to same graph
-        batch = torch.zeros(x.shape[0], dtype=int, device=x.device)
-        
-        for epoch in range(1, self.epochs + 1):
-            loss_xx  = 0 
-            sampSize = 10
-            if epoch%50==1: 
-                ids  = np.random.randint(len(dataset), size=sampSize)
-                
-            optimizer.zero_grad()
-            for dd in ids: 
-                data = dataset[dd]
-                data_copy = copy(data)
-                h = data.node_features * self.node_feat_mask.sigmoid()
-                data_copy.node_features = h
-                out = self.model([data_copy])
-                log_logits = self.__to_log_prob__(out)
-                loss_hit  = self.__loss__(-1, log_logits, PRED[dd])
-                loss_fail = self.__loss__(-1, log_logits, abs(PRED[dd]-1))
-                loss_xx = loss_xx + loss_hit 
-            loss_xx.backward()
-            optimizer.step()
-         
-        return self.node_feat_mask.view(-1,1).detach() #self.edge_mask.detach().sigmoid()
-
-    def explain_graph_modified_s2v_API(self, dataset, param, node_mask=False):
+        return self.node_feat_mask.detach().view(R, -1).t() #self.edge_mask.detach().sigmoid()
 
+    def explain_patients(self, dataset, kind, pred=None, batch_size=256):
+        """
+        Vanilla (per-patient) explanations for a whole cohort. Every patient
+        gets its own node mask; the [P, N, 1] masks are optimized jointly,
+        batch_size patients at a time with one batched forward per epoch.
+        The per-patient losses are summed, and since Adam is elementwise each
+        mask follows its own single-patient optimization.
+        :param kind: Input kind of the model, see BatchedForward
+        :return: [P, N] raw (pre-sigmoid) node masks
+        """
         self.model.eval()
-        self.__clear_masks__()    
-
-        PRED = []
-        LOGITS = []
-        LOGITS2 =[]
-        # Get the initial prediction.
-        with torch.no_grad():
-            for yy in range(len(dataset)):
-                x, edge_index = dataset[yy].node_features, dataset[yy].edge_mat
-                out = self.model([dataset[yy]])
-                log_logits = self.__to_log_prob__(out)
-                pp = log_logits.argmax(dim=-1)
-                PRED.append(pp)
-                LOGITS.append(-log_logits[0, pp])
-                LOGITS2.append(-log_logits[0, :])    
+        self.__clear_masks__()
 
-        if node_mask==False:
-            self.__set_masks__(dataset[0].node_features, dataset[0].edge_mat)
-        else:
-            (N, F), E = dataset[0].node_features.size(), dataset[0].edge_mat.size(1)
-            std = 0.1
-            # inverse of sigmoid
-            node_mask = np.log(1/(1-node_mask))
-            # transform to tensor 
-            node_mask_tensor = torch.nn.Parameter(torch.from_numpy(node_mask*std))
-            self.node_feat_mask = torch.reshape(node_mask_tensor, (N, 1))
-            std = torch.nn.init.calculate_gain('relu') * sqrt(2.0 / (2 * N))
-            self.edge_mask = torch.nn.Parameter(torch.randn(E) * std)
+        forward = BatchedForward(self.model, kind, dataset[0])
+        x = forward.node_features(dataset)
+        (P, N, F) = x.size()
 
-        self.to(x.device)
-        
-        n_nodes = dataset[0].node_features.size()[0]
+        # Get the initial prediction.
+        if pred is None:
+            pred = self.initial_prediction(dataset, kind)
+        pred_label = torch.as_tensor(pred).view(-1)
 
-        optimizer = torch.optim.Adam([self.edge_mask, self.node_feat_mask], lr=self.lr)
-        
-        #optimizer = torch.optim.Adam([self.edge_mask],
-        #                             lr=self.lr)                                  
+        masks = torch.zeros(P, N)
 
-        # all nodes belong to same graph
-        batch = torch.zeros(x.shape[0], dtype=int, device=x.device)
-        
-        for epoch in range(1, self.epochs + 1):
-            loss_xx  = 0 
-            sampSize = 10
-            if epoch%50==1: 
-                ids  = np.random.randint(len(dataset), size=sampSize)
-                
-            optimizer.zero_grad()
-            for dd in ids: 
-                data = dataset[dd]
-                data_copy = copy(data)
-                h = data.node_features * self.node_feat_mask.sigmoid()
-                data_copy.node_features = h
-                out = self.model([data_copy])
-                log_logits = self.__to_log_prob__(out)
-                loss_hit  = self.__loss__(-1, log_logits, PRED[dd])
-                loss_fail = self.__loss__(-1, log_logits, abs(PRED[dd]-1))
-                loss_xx = loss_xx + loss_hit 
-            loss_xx.backward()
-            optimizer.step()
-         
-        return self.node_feat_mask.view(-1,1).detach() #self.edge_mask.detach().sigmoid()
+        if self.log:  # pragma: no cover
+            pbar = tqdm(total=P)
+            pbar.set_description('Explain patients')
+
+        for start in range(0, P, batch_size):
+            idx = torch.arange(start, min(start + batch_size, P))
+            # same initialization as __set_masks__, one [N, 1] mask per patient
+            self.node_feat_mask = torch.nn.Parameter(torch.randn(len(idx), N, 1) * 0.1)
+
+            optimizer = torch.optim.Adam([self.node_feat_mask], lr=self.lr)
+            for epoch in range(1, self.epochs + 1):
+                optimizer.zero_grad()
+                h = x[idx] * self.node_feat_mask.sigmoid()
+                log_logits = self.__to_log_prob__(forward(h)).view(len(idx), 1, -1)
+                loss = self.__node_loss__(log_logits, pred_label[idx].view(-1, 1),
+                                          self.node_feat_mask.view(len(idx), N))
+                loss.sum().backward()
+                optimizer.step()
+
+            masks[idx] = self.node_feat_mask.detach().view(len(idx), N)
 
+            if self.log:  # pragma: no cover
+                pbar.update(len(idx))
 
+        if self.log:  # pragma: no cover
+            pbar.close()
 
+        self.__clear_masks__()
+        return masks
 
     def plot_graph(self, node_idx, edge_index, edge_mask, y=None,
                            threshold=None,**kwargs):
@@ -940,4 +807,51 @@ class GNNExplainer(torch.nn.Module):
                        width=3, alpha=0.5, edge_color=color,edge_cmap=plt.cm.Reds)
         nx.draw_networkx_labels(G, pos, **kwargs)
         plt.axis('off')
-        return plt
\ No newline at end of file
+        return plt
+
+
+class BatchedForward(object):
+    """
+    Evaluates a model on a batch of patients that share one graph.
+    The input is a [B, N, F] tensor of (masked) node features, the
+    output are the [B, C] graph level scores.
+
+        kind "s2v":   GraphCNN, a list of S2VGraph objects
+        kind "cheb":  ChebConv/ChebNet, 3-D node features, max over the nodes
+        kind "cheb2": GraphCheb/ChebConvNet, disjoint union with a batch vector
+    """
+    def __init__(self, model, kind, template):
+        assert kind in ['s2v', 'cheb', 'cheb2']
+        self.model = model
+        self.kind = kind
+        self.template = template
+        self._structure = {}
+
+    def node_features(self, dataset):
+        attr = 'node_features' if self.kind == 's2v' else 'x'
+        return torch.stack([getattr(graph, attr) for graph in dataset])
+
+    def structure(self, size):
+        # edge_index and batch vector of size copies of the graph
+        if size not in self._structure:
+            edge_index = self.template.edge_index
+            n_nodes = self.template.x.size(0)
+            offsets = torch.arange(size).repeat_interleave(edge_index.size(1)) * n_nodes
+            self._structure[size] = (edge_index.repeat(1, size) + offsets,
+                                     torch.arange(size).repeat_interleave(n_nodes))
+        return self._structure[size]
+
+    def __call__(self, x):
+        if self.kind == 's2v':
+            batch_graph = []
+            for h in x:
+                graph = copy(self.template)
+                graph.node_features = h
+                batch_graph.append(graph)
+            return self.model(batch_graph)
+
+        if self.kind == 'cheb':
+            return self.model(x=x, edge_index=self.template.edge_index).max(1)[0]
+
+        edge_index, batch = self.structure(x.size(0))
+        return self.model(x.reshape(-1, x.size(-1)), edge_index, batch=batch)
@@ -10,6 +10,7 @@ import networkx as nx
 import copy
 import numpy as np
 import torch
+from torch_geometric.data import Batch
 
 #class gnn_training_utils:
 
@@ -54,4 +55,103 @@ def pass_data_iteratively(model, graphs, minibatch_size = 32):
         if len(sampled_idx) == 0:
             continue
         output.append(model([graphs[j] for j in sampled_idx]).detach())
-    return torch.cat(output, 0)
\ No newline at end of file
+    return torch.cat(output, 0)
+
+def stack_node_features(graphs):
+    """
+    Stacks the node features of graphs that share one topology into a
+    [graphs, nodes, features] tensor.
+    """
+    return torch.stack([graph.x for graph in graphs], 0)
+
+def chebconv_forward(model, x, edge_index):
+    """
+    Batched forward of a single ChebConv layer followed by a max readout.
+    All graphs in x ([graphs, nodes, features]) are propagated through the
+    shared Laplacian at once; the per graph max is a reduction over the node axis.
+    """
+    return model(x=x, edge_index=edge_index).max(1)[0]
+
+def pass_data_chebconv(model, graphs, minibatch_size = 128):
+    model.eval()
+    output = []
+    edge_index = graphs[0].edge_index
+    with torch.no_grad():
+        for i in range(0, len(graphs), minibatch_size):
+            x = stack_node_features(graphs[i:i+minibatch_size])
+            output.append(chebconv_forward(model, x, edge_index))
+    return torch.cat(output, 0)
+
+
+class FixedTopologyLoader(object):
+    """
+    Replacement for torch_geometric.loader.DataLoader for datasets in which every
+    graph has the same edge_index (one PPI network, one feature matrix per patient).
+
+    The tiled edge_index and batch vector of a batch are built once per batch size,
+    node features are gathered by index from one [graphs, nodes, features] tensor,
+    and without shuffling the Batch objects themselves are reused across epochs.
+    Datasets with differing topologies fall back to Batch.from_data_list.
+    """
+    def __init__(self, dataset, batch_size=1, shuffle=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.fixed = self.is_fixed_topology(dataset)
+
+        if self.fixed:
+            self.x = stack_node_features(dataset)
+            self.y = torch.stack([graph.y for graph in dataset]).view(-1)
+            self.edge_index = dataset[0].edge_index
+            self.n_nodes = self.x.size(1)
+
+        self._structure = {}
+        self._batches = None
+
+    @staticmethod
+    def is_fixed_topology(dataset):
+        edge_index = dataset[0].edge_index
+        n_nodes = dataset[0].x.size(0)
+        for graph in dataset:
+            if graph.x.size(0) != n_nodes:
+                return False
+            if graph.edge_index is not edge_index and not torch.equal(graph.edge_index, edge_index):
+                return False
+        return True
+
+    def structure(self, size):
+        """
+        edge_index, batch vector and ptr of a batch of size graphs.
+        """
+        if size not in self._structure:
+            n_edges = self.edge_index.size(1)
+            offsets = torch.arange(size).repeat_interleave(n_edges) * self.n_nodes
+            edge_index = self.edge_index.repeat(1, size) + offsets
+            batch = torch.arange(size).repeat_interleave(self.n_nodes)
+            ptr = torch.arange(size + 1) * self.n_nodes
+            self._structure[size] = (edge_index, batch, ptr)
+        return self._structure[size]
+
+    def collate(self, idx):
+        """
+        Batch of the graphs at positions idx of the dataset.
+        """
+        if not self.fixed:
+            return Batch.from_data_list([self.dataset[i] for i in idx])
+        idx = torch.as_tensor(np.asarray(idx), dtype=torch.long)
+        edge_index, batch, ptr = self.structure(len(idx))
+        x = self.x[idx].reshape(-1, self.x.size(2))
+        return Batch(x=x, edge_index=edge_index, y=self.y[idx], batch=batch, ptr=ptr)
+
+    def __iter__(self):
+        n = len(self.dataset)
+        if not self.shuffle:
+            if self._batches is None:
+                self._batches = [self.collate(range(i, min(i + self.batch_size, n)))
+                                 for i in range(0, n, self.batch_size)]
+            return iter(self._batches)
+        perm = np.random.permutation(n)
+        return (self.collate(perm[i:i + self.batch_size]) for i in range(0, n, self.batch_size))
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
@@ -127,15 +127,10 @@ Path(f"{path}/{sigma}/vanilla_gnn").mkdir(parents=True, exist_ok=True)
 
 #for idx in range(no_of_runs):
 idx=1
-GNN_FEATURE_MASKS = np.zeros((500, nodes_per_graph_nr), dtype=np.float32)
-for idd in range(500):#range(500):
-    print(f'Explainer::Iteration {idd+1} of {500}') 
-    exp = GNNExplainer(model, epochs=300)
-    em = exp.explain_graph_s2v(dataset, lamda, idd)
-    gnn_feature_masks  = np.array(em.sigmoid()) 
-    gnn_feature_masks  = np.reshape(gnn_feature_masks, (-1, len(gnn_feature_masks)))
-    #print(gnn_feature_masks)
-    GNN_FEATURE_MASKS[idd,] = gnn_feature_masks        
+# one node mask per patient, all 500 patients optimized jointly
+exp = GNNExplainer(model, epochs=300)
+em = exp.explain_patients(dataset[:500], "s2v")
+GNN_FEATURE_MASKS = np.array(em.sigmoid(), dtype=np.float32)
     
 MEAN_GNN_FEATURE_MASK = GNN_FEATURE_MASKS.mean(axis=0)
 np.savetxt(f'{path}/{sigma}/vanilla_gnn/gnn_feature_masks{idx}.csv', MEAN_GNN_FEATURE_MASK, delimiter=',', fmt='%.3f')
@@ -11,6 +11,8 @@ from torch_geometric.nn import global_mean_pool
 from torch_geometric.nn import global_max_pool
 from torch_geometric.nn.conv.cheb_conv import ChebConv
 from torch_geometric.loader import DataLoader
+from torch_geometric.utils import get_laplacian, remove_self_loops, add_self_loops
+import numpy as np
 
 def test_model_acc(loader, model):
     """
@@ -47,6 +49,83 @@ def test_model(loader, model, criterion=None):
         true_labels.extend(list(data.y.detach().cpu().numpy()))
     return running_loss / steps, correct / len(loader.dataset), true_labels, predicted_labels  # Derive ratio of correct predictions.
 
+def test_model_basis(basis, labels, model, criterion=None, batch_size=100):
+    """
+    test_model() for precomputed Chebyshev basis signals (see ChebConvNet.forward_basis).
+    Returns test loss, test accuracy, list of true labels, list of predicted labels.
+    """
+    correct = 0
+    running_loss = 0.0
+    steps = 0
+    predicted_labels = []
+    true_labels = []
+    model.eval()
+    with torch.no_grad():
+        for start in range(0, len(labels), batch_size):
+            y = labels[start:start+batch_size]
+            out = model.forward_basis(torch.from_numpy(np.ascontiguousarray(basis[start:start+batch_size])))
+            if criterion:
+                running_loss += criterion(out, y)
+            pred = out.argmax(dim=1)
+            correct += int((pred == y).sum())
+            steps += 1
+            predicted_labels.extend(list(pred.cpu().numpy()))
+            true_labels.extend(list(y.cpu().numpy()))
+    return running_loss / steps, correct / len(labels), true_labels, predicted_labels
+
+def scaled_laplacian(edge_index, num_nodes, lambda_max=2.0):
+    """
+    Scaled, symmetric normalized Laplacian L~ = 2L/lambda_max - I as used by ChebConv,
+    returned as a sparse [num_nodes, num_nodes] matrix acting on node signals.
+    """
+    edge_index, _ = remove_self_loops(edge_index)
+    edge_index, edge_weight = get_laplacian(edge_index, None, normalization='sym', num_nodes=num_nodes)
+    edge_weight = (2.0 * edge_weight) / lambda_max
+    edge_weight.masked_fill_(edge_weight == float('inf'), 0)
+    edge_index, edge_weight = add_self_loops(edge_index, edge_weight, fill_value=-1., num_nodes=num_nodes)
+    # messages flow from edge_index[0] (source) to edge_index[1] (target)
+    return torch.sparse_coo_tensor(torch.stack([edge_index[1], edge_index[0]]), edge_weight,
+                                   (num_nodes, num_nodes)).coalesce()
+
+def chebyshev_basis(x, laplacian, K):
+    """
+    Chebyshev basis signals T_k(L~)x, k = 0..K-1, for graphs sharing one topology.
+    :param x: Node signals [graphs, nodes, features]
+    :param laplacian: Sparse scaled Laplacian (see scaled_laplacian)
+    :param K: Number of Chebyshev polynomials (K of ChebConv)
+    :return: [graphs, nodes, K, features]
+    """
+    B, N, F = x.shape
+    # all graphs become columns of one [nodes, graphs*features] matrix -> one sparse matmul per order
+    Tx_0 = x.permute(1, 0, 2).reshape(N, B * F)
+    basis = [Tx_0]
+    if K > 1:
+        Tx_1 = torch.sparse.mm(laplacian, Tx_0)
+        basis.append(Tx_1)
+        for k in range(2, K):
+            Tx_2 = 2. * torch.sparse.mm(laplacian, Tx_1) - Tx_0
+            basis.append(Tx_2)
+            Tx_0, Tx_1 = Tx_1, Tx_2
+    basis = torch.stack(basis, 0).reshape(K, N, B, F)
+    return basis.permute(2, 1, 0, 3)
+
+def chebyshev_basis_cohort(graphs, K, lambda_max=2.0, out=None, chunk_size=256):
+    """
+    Chebyshev basis signals of a whole cohort, computed in chunks of patients.
+    :param graphs: List of Data objects sharing one edge_index
+    :param out: Optional float32 array [patients, nodes, K, features] to fill, e.g. a np.memmap
+    :return: numpy array [patients, nodes, K, features]
+    """
+    N, F = graphs[0].x.shape
+    if out is None:
+        out = np.empty((len(graphs), N, K, F), dtype=np.float32)
+    laplacian = scaled_laplacian(graphs[0].edge_index, N, lambda_max)
+    with torch.no_grad():
+        for start in range(0, len(graphs), chunk_size):
+            x = torch.stack([graph.x for graph in graphs[start:start+chunk_size]], 0).float()
+            out[start:start+len(x)] = chebyshev_basis(x, laplacian, K).numpy()
+    return out
+
 class ChebConvNet(nn.Module):
     """
     ChebNet with one convolutional layer, ReLU nonlinearity, and fixed number of nodes for every single data point input.
@@ -80,6 +159,24 @@ class ChebConvNet(nn.Module):
         x = self.lin(x)
         return x
 
+    def forward_basis(self, basis):
+        """
+        Forward on precomputed Chebyshev basis signals (see chebyshev_basis_cohort).
+        The graph convolution reduces to one dense product with the ChebConv weights.
+        Only valid for n_layers=1.
+        :param basis: [batch, nodes, K, input_channels]
+        """
+        assert self.n_layers == 1, "precomputed Chebyshev basis requires n_layers=1"
+        conv = self.cheb_graph_convs[0]
+        weight = torch.stack([lin.weight.t() for lin in conv.lins], 0) # [K, input_channels, n_channels]
+        x = torch.einsum('bnki,kio->bno', basis, weight)
+        if conv.bias is not None:
+            x = x + conv.bias
+        x = self.relu(x)
+        x = torch.reshape(x, (x.size(0), self.n_features * self.n_channels))
+        x = self.lin(x)
+        return x
+
 class GraphCheb(torch.nn.Module):
     """
     graphcheb classifier
@@ -106,6 +203,7 @@ class GraphCheb(torch.nn.Module):
         #torch.manual_seed(12345)
 
         self.hidden_channels = hidden_channels
+        self.embedding_size = hidden_channels
         self.layers_nr = layers_nr
 
         self.cheb_layers_list = []      # [1.] All layers in a list ----------------------------------------------------
@@ -123,17 +221,14 @@ class GraphCheb(torch.nn.Module):
         # [4.] Last layer ----------------------------------------------------------------------------------------------
         self.lin = Linear(self.hidden_channels, num_classes)
 
-    def forward(self, x, edge_index, batch, edge_weight=None):
+    def embedding(self, x, edge_index, edge_weight=None):
         """
-        Forward
+        Node embeddings of the last ChebConv layer
         :param x:
         :param edge_index:
-        :param batch:
         :param edge_weight:
-        :return:
+        :return: [num_nodes, hidden_channels]
         """
-
-        # [1.] Obtain node embeddings ----------------------------------------------------------------------------------
         cheb_modules_len = len(self.cheb_modules)
         for cheb_module_idx in range(cheb_modules_len):
 
@@ -146,6 +241,21 @@ class GraphCheb(torch.nn.Module):
             else:
                 x = cheb_module(x, edge_index, edge_weight)
 
+        return x
+
+    def forward(self, x, edge_index, batch, edge_weight=None):
+        """
+        Forward
+        :param x:
+        :param edge_index:
+        :param batch:
+        :param edge_weight:
+        :return:
+        """
+
+        # [1.] Obtain node embeddings ----------------------------------------------------------------------------------
+        x = self.embedding(x, edge_index, edge_weight)
+
         # [2.] Readout layer -------------------------------------------------------------------------------------------
         #x = global_mean_pool(x, batch)  # [batch_size, hidden_channels]
         x = global_max_pool(x, batch)  # [batch_size, hidden_channels]
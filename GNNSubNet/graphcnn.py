@@ -30,6 +30,10 @@ class GraphCNN(nn.Module):
         self.neighbor_pooling_type = neighbor_pooling_type
         self.learn_eps = learn_eps
         self.eps = nn.Parameter(torch.zeros(self.num_layers-1))
+        self.embedding_size = hidden_dim
+        # False: neighbor and graph pooling with index_add instead of sparse matmuls, which
+        # torch.func.vmap can batch (used by ModelEnsemble)
+        self.sparse_propagation = True
 
         ###List of MLPs
         self.mlps = torch.nn.ModuleList()
@@ -83,8 +87,9 @@ class GraphCNN(nn.Module):
         return torch.LongTensor(padded_neighbor_list)
 
 
-    def __preprocess_neighbors_sumavepool(self, batch_graph):
+    def __preprocess_neighbors_sumavepool(self, batch_graph, edge_weight=None):
         ###create block diagonal sparse matrix
+        ###edge_weight: optional weight per edge of the concatenated edge_mat's (e.g. explainer masks)
 
         edge_mat_list = []
         start_idx = [0]
@@ -92,7 +97,7 @@ class GraphCNN(nn.Module):
             start_idx.append(start_idx[i] + len(graph.g))
             edge_mat_list.append(graph.edge_mat + start_idx[i])
         Adj_block_idx = torch.cat(edge_mat_list, 1)
-        Adj_block_elem = torch.ones(Adj_block_idx.shape[1])
+        Adj_block_elem = torch.ones(Adj_block_idx.shape[1]) if edge_weight is None else edge_weight
 
         #Add self-loops in the adjacency matrix if learn_eps is False, i.e., aggregate center nodes and neighbor nodes altogether.
 
@@ -103,7 +108,13 @@ class GraphCNN(nn.Module):
             Adj_block_idx = torch.cat([Adj_block_idx, self_loop_edge], 1)
             Adj_block_elem = torch.cat([Adj_block_elem, elem], 0)
 
-        Adj_block = torch.sparse.FloatTensor(Adj_block_idx, Adj_block_elem, torch.Size([start_idx[-1],start_idx[-1]]))
+        if not self.sparse_propagation:
+            Adj_block = (Adj_block_idx, Adj_block_elem, start_idx[-1])
+        elif edge_weight is None:
+            Adj_block = torch.sparse.FloatTensor(Adj_block_idx, Adj_block_elem, torch.Size([start_idx[-1],start_idx[-1]]))
+        else:
+            # differentiable w.r.t. the edge weights
+            Adj_block = torch.sparse_coo_tensor(Adj_block_idx, Adj_block_elem, (start_idx[-1], start_idx[-1]))
 
         return Adj_block
 
@@ -131,10 +142,20 @@ class GraphCNN(nn.Module):
             idx.extend([[i, j] for j in range(start_idx[i], start_idx[i+1], 1)])
         elem = torch.FloatTensor(elem)
         idx = torch.LongTensor(idx).transpose(0,1)
+        if not self.sparse_propagation:
+            return (idx, elem, len(batch_graph))
         graph_pool = torch.sparse.FloatTensor(idx, elem, torch.Size([len(batch_graph), start_idx[-1]]))
         
         return graph_pool
 
+    def __spmm(self, matrix, h):
+        ###product of a sparse matrix (or its (indices, values, rows) with sparse_propagation=False) and h
+
+        if self.sparse_propagation:
+            return torch.spmm(matrix, h)
+        idx, elem, rows = matrix
+        return torch.zeros(rows, h.shape[1], dtype=h.dtype).index_add(0, idx[0], h[idx[1]] * elem.unsqueeze(1))
+
     def maxpool(self, h, padded_neighbor_list):
         ###Element-wise minimum will never affect max-pooling
 
@@ -152,10 +173,10 @@ class GraphCNN(nn.Module):
             pooled = self.maxpool(h, padded_neighbor_list)
         else:
             #If sum or average pooling
-            pooled = torch.spmm(Adj_block, h)
+            pooled = self.__spmm(Adj_block, h)
             if self.neighbor_pooling_type == "average":
                 #If average pooling
-                degree = torch.spmm(Adj_block, torch.ones((Adj_block.shape[0], 1)))
+                degree = self.__spmm(Adj_block, torch.ones((h.shape[0], 1)))
                 pooled = pooled/degree
 
         #Reweights the center node representation when aggregating it with its neighbors
@@ -176,10 +197,10 @@ class GraphCNN(nn.Module):
             pooled = self.maxpool(h, padded_neighbor_list)
         else:
             #If sum or average pooling
-            pooled = torch.spmm(Adj_block, h)
+            pooled = self.__spmm(Adj_block, h)
             if self.neighbor_pooling_type == "average":
                 #If average pooling
-                degree = torch.spmm(Adj_block, torch.ones((Adj_block.shape[0], 1)))
+                degree = self.__spmm(Adj_block, torch.ones((h.shape[0], 1)))
                 pooled = pooled/degree
 
         #representation of neighboring and center nodes 
@@ -192,14 +213,16 @@ class GraphCNN(nn.Module):
         return h
 
 
-    def forward(self, batch_graph, get_embedding=False):
+    def forward(self, batch_graph, get_embedding=False, edge_weight=None):
         X_concat = torch.cat([graph.node_features for graph in batch_graph], 0)
         graph_pool = self.__preprocess_graphpool(batch_graph)
 
         if self.neighbor_pooling_type == "max":
+            if edge_weight is not None:
+                raise ValueError("edge weights need sum or average neighbor pooling")
             padded_neighbor_list = self.__preprocess_neighbors_maxpool(batch_graph)
         else:
-            Adj_block = self.__preprocess_neighbors_sumavepool(batch_graph)
+            Adj_block = self.__preprocess_neighbors_sumavepool(batch_graph, edge_weight)
 
         #list of hidden representation at each layer (including input)
         hidden_rep = [X_concat]
@@ -224,7 +247,7 @@ class GraphCNN(nn.Module):
     
         #perform pooling over all nodes in each graph in every layer
         for layer, h in enumerate(hidden_rep):
-            pooled_h = torch.spmm(graph_pool, h)
+            pooled_h = self.__spmm(graph_pool, h)
             score_over_layer += F.dropout(self.linears_prediction[layer](pooled_h), self.final_dropout, training = self.training)
 
         return score_over_layer
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+Inference on raw feature matrices.
+
+New patients are mapped onto the gene order (and thus the PPI topology) of
+the training data and scored in batched forwards; no PPI file, no labels and
+no second GNNSubNet object are needed.
+"""
+
+import numpy as np
+import pandas as pd
+import torch
+
+from .gnn_explainer import BatchedForward
+
+
+def feature_tensor(features, gene_names, genes=None, fill=0.0, normalize=True):
+    """
+    [patients, nodes, features] node features in the gene order of the training data.
+    :param features: DataFrame patients x genes, a list of such DataFrames (one per
+                     feature file, in the order used for training), or an array
+                     [patients, genes] / [patients, genes, features]
+    :param gene_names: gene order of the training data
+    :param genes: gene names of the array columns (default: the training gene order)
+    :param fill: value of genes missing in features (and of missing values)
+    :param normalize: per patient min-max scaling of every feature over the genes,
+                      as done by load_OMICS_dataset with normalize=True
+    """
+    gene_names = list(gene_names)
+
+    if isinstance(features, pd.DataFrame):
+        features = [features]
+    if isinstance(features, (list, tuple)):
+        x = np.stack([feat.reindex(columns=gene_names).to_numpy(dtype=np.float64) for feat in features], axis=-1)
+    else:
+        x = np.asarray(features, dtype=np.float64)
+        if x.ndim == 2:
+            x = x[:, :, None]
+        if genes is not None:
+            position = {gene: idx for idx, gene in enumerate(genes)}
+            columns = np.array([position.get(gene, -1) for gene in gene_names])
+            x = np.where(columns[None, :, None] >= 0, x[:, np.maximum(columns, 0)], np.nan)
+        elif x.shape[1] != len(gene_names):
+            raise ValueError(f"features have {x.shape[1]} genes, the model {len(gene_names)}; pass genes=")
+
+    missing = np.isnan(x)
+    if missing.any():
+        print(f"Predict::{int(missing.all(axis=(0, 2)).sum())} of {len(gene_names)} genes missing, filled with {fill}")
+        x = np.where(missing, fill, x)
+
+    if normalize:
+        low = x.min(1, keepdims=True)
+        span = x.max(1, keepdims=True) - low
+        span[span == 0] = 1
+        x = (x - low) / span
+
+    return torch.from_numpy(x).float()
+
+
+def predict_logits(model, kind, template, x, batch_size=256):
+    """
+    [patients, classes] scores of the model for the node features x [patients, nodes, features].
+    :param kind: "s2v", "cheb" or "cheb2" (see gnn_explainer.BatchedForward)
+    :param template: one graph of the training topology (S2VGraph for "s2v", Data otherwise)
+    """
+    model.eval()
+    forward = BatchedForward(model, kind, template)
+    with torch.no_grad():
+        return torch.cat([forward(x[start:start + batch_size]) for start in range(0, len(x), batch_size)])
@@ -0,0 +1,91 @@
+"""
+Running statistics of explainer masks.
+"""
+
+import numpy as np
+
+
+class RunningStats(object):
+    """
+    Running mean and variance (Welford) of equally shaped arrays, e.g. the
+    node or edge mask of every explainer run. Memory does not grow with the
+    number of runs.
+
+    With quantiles, approximate quantiles across the runs are estimated from
+    a uniform reservoir sample of reservoir_size runs (exact as long as no
+    more than reservoir_size runs were added).
+    """
+    def __init__(self, quantiles=None, reservoir_size=64, random_seed=None):
+        self.n = 0
+        self.mean = None
+        self._m2 = None
+        self.quantile_levels = None if quantiles is None else np.asarray(quantiles, dtype=float)
+        self.reservoir_size = reservoir_size
+        self._reservoir = None
+        self._rng = np.random.default_rng(random_seed)
+
+    def update(self, value):
+        value = np.asarray(value, dtype=np.float64)
+        if self.mean is None:
+            self.mean = np.zeros_like(value)
+            self._m2 = np.zeros_like(value)
+            if self.quantile_levels is not None:
+                self._reservoir = np.empty((self.reservoir_size,) + value.shape, dtype=np.float32)
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+
+        if self._reservoir is not None:
+            if self.n <= self.reservoir_size:
+                self._reservoir[self.n - 1] = value
+            else:
+                # keep every run with probability reservoir_size / n
+                slot = self._rng.integers(self.n)
+                if slot < self.reservoir_size:
+                    self._reservoir[slot] = value
+
+    def state(self):
+        """
+        Arrays to continue the statistics later with restore(), e.g. from a cache
+        """
+        empty = np.zeros(0)
+        return dict(n=np.array(self.n), mean=empty if self.mean is None else self.mean,
+                    m2=empty if self._m2 is None else self._m2,
+                    reservoir=empty if self._reservoir is None else self._reservoir[:min(self.n, self.reservoir_size)])
+
+    def restore(self, state):
+        """
+        Continues the statistics of state() (quantiles must be configured as before)
+        """
+        self.n = int(state["n"])
+        if self.n == 0:
+            return
+        self.mean = np.array(state["mean"], dtype=np.float64)
+        self._m2 = np.array(state["m2"], dtype=np.float64)
+        if self.quantile_levels is not None:
+            self._reservoir = np.empty((self.reservoir_size,) + self.mean.shape, dtype=np.float32)
+            kept = np.asarray(state["reservoir"])
+            self._reservoir[:len(kept)] = kept
+
+    @property
+    def var(self):
+        """
+        Sample variance (0 for fewer than two runs)
+        """
+        if self.n < 2:
+            return np.zeros_like(self.mean)
+        return self._m2 / (self.n - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def quantiles(self):
+        """
+        [len(quantiles), ...] approximate quantiles, None without quantiles
+        """
+        if self._reservoir is None:
+            return None
+        return np.quantile(self._reservoir[:min(self.n, self.reservoir_size)], self.quantile_levels, axis=0)
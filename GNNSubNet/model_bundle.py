@@ -0,0 +1,75 @@
+"""
+Self-contained model bundle.
+
+A trained model together with everything needed to score new patients: the
+weights, the architecture (class name and constructor arguments), the graph
+topology as int32 arrays, the gene order and the feature normalization.
+Stored in the results bundle format (see results_bundle), so arrays are
+memory-mapped on load and no PPI or feature files are read.
+"""
+
+import time
+
+import numpy as np
+import torch
+from torch_geometric.nn.conv.cheb_conv import ChebConv
+
+from .ensemble import ModelEnsemble
+from .graphcheb import GraphCheb, ChebConvNet
+from .graphcnn import GraphCNN
+from .results_bundle import ResultsBundle, save_bundle
+
+MODEL_CLASSES = {
+    "GraphCNN":    GraphCNN,
+    "GraphCheb":   GraphCheb,
+    "ChebConvNet": ChebConvNet,
+    "ChebConv":    ChebConv,
+}
+
+
+def build_model(config):
+    """
+    New (untrained) model of the architecture in config.
+    :param config: dict with model (class name), kwargs (constructor arguments),
+                   n_models (> 1 for a ModelEnsemble) and vectorize (see ModelEnsemble)
+    """
+    cls = MODEL_CLASSES[config["model"]]
+    if config.get("n_models", 1) > 1:
+        return ModelEnsemble([cls(**config["kwargs"]) for _ in range(config["n_models"])],
+                             vectorize=config.get("vectorize", True))
+    return cls(**config["kwargs"])
+
+
+def save_model_bundle(path, model, config, edge_index, gene_names, metadata=None):
+    """
+    Writes model and topology to a bundle at path.
+    :param config: architecture of the model (see build_model)
+    :param edge_index: [2, E] edge_index of the graph
+    :param metadata: JSON serializable dict, e.g. classifier, normalization and training results
+    """
+    state = model.state_dict()
+    arrays = {f"weight/{name}": tensor.detach().cpu().numpy() for name, tensor in state.items()}
+    arrays["edge_index"] = np.asarray(edge_index, dtype=np.int32)
+    arrays["gene_names"] = np.array(gene_names, dtype=str)
+
+    metadata = dict(metadata or {})
+    metadata.update(model_config=config, weights=list(state.keys()),
+                    torch_version=torch.__version__, saved=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    save_bundle(path, arrays, metadata=metadata)
+
+
+def load_model_bundle(path):
+    """
+    :return: model (in eval mode), [2, E] int32 edge_index (memory-mapped),
+             gene names and the metadata of the bundle
+    """
+    with ResultsBundle(path) as bundle:
+        metadata = bundle.metadata
+        model = build_model(metadata["model_config"])
+        # copies the weights out of the memory map
+        model.load_state_dict({name: torch.tensor(bundle[f"weight/{name}"]) for name in metadata["weights"]})
+        edge_index = bundle["edge_index"]
+        gene_names = np.array(bundle["gene_names"])
+
+    model.eval()
+    return model, edge_index, gene_names, metadata
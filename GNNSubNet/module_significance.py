@@ -0,0 +1,178 @@
+"""
+Permutation test for the importance of detected modules.
+
+The importance of a module is the mean edge mask of its intra-module edges
+(see community_detection.community_scores). Its null distribution comes from
+either
+    "edges":  edge masks shuffled over all undirected edges of the graph (both
+              directions of an interaction keep one shared value), or
+    "degree": module labels shuffled between nodes of the same degree, so the
+              null modules keep the degree sequence of the real ones.
+Permutations are evaluated in chunks as [permutations, E] arrays with
+bincount/reduceat, chunks can be spread over worker processes.
+"""
+
+import multiprocessing as mp
+
+import numpy as np
+
+NULLS = ["edges", "degree"]
+
+# per-process state, set by _init_worker
+_WORKER = {}
+
+
+def membership_of(modules, n_nodes):
+    """
+    Module id of every node, -1 for nodes in no module.
+    """
+    membership = np.full(n_nodes, -1, dtype=np.int64)
+    for com, module in enumerate(modules):
+        membership[np.asarray(module, dtype=np.int64)] = com
+    return membership
+
+
+def module_means(membership, src, dst, edge_masks, n_modules):
+    """
+    Mean intra-module edge mask of every module for a batch of memberships.
+    :param membership: [P, N] module ids
+    :param edge_masks: [P, E] or [E] edge masks
+    :return: [P, n_modules], nan for modules without intra-module edges
+    """
+    n_perm = membership.shape[0]
+    m_src = membership[:, src]
+    intra = (m_src == membership[:, dst]) & (m_src >= 0) & (src != dst)
+    flat = (np.arange(n_perm)[:, None] * n_modules + m_src)[intra]
+    weights = np.broadcast_to(edge_masks, intra.shape)[intra]
+
+    sums = np.bincount(flat, weights=weights, minlength=n_perm * n_modules).reshape(n_perm, n_modules)
+    counts = np.bincount(flat, minlength=n_perm * n_modules).reshape(n_perm, n_modules)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def fdr_bh(p_values):
+    """
+    Benjamini-Hochberg adjusted p-values, nan entries are ignored.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    q_values = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    if len(valid) == 0:
+        return q_values
+
+    order = valid[np.argsort(p_values[valid])]
+    ranked = p_values[order] * len(valid) / np.arange(1, len(valid) + 1)
+    # enforce monotonicity from the largest p-value down
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+
+def _init_worker(edge_index, edge_masks, membership, observed, null):
+    src, dst = edge_index
+    _WORKER['src'] = src
+    _WORKER['dst'] = dst
+    _WORKER['edge_masks'] = edge_masks
+    _WORKER['membership'] = membership
+    _WORKER['observed'] = observed
+    _WORKER['null'] = null
+
+    n_modules = len(observed)
+    if null == "edges":
+        # both directions of an edge carry the same mask: one value per undirected
+        # edge is shuffled and mirrored back to the directed edges
+        n_nodes = len(membership)
+        _, pair = np.unique(np.minimum(src, dst) * n_nodes + np.maximum(src, dst), return_inverse=True)
+        pair = pair.reshape(-1)
+        _WORKER['pair_masks'] = np.bincount(pair, weights=edge_masks) / np.bincount(pair)
+
+        # the modules do not change: intra-module edges sorted by module, so that
+        # reduceat sums the shuffled masks of every module
+        m_src = membership[src]
+        intra = np.flatnonzero((m_src == membership[dst]) & (m_src >= 0) & (src != dst))
+        intra = intra[np.argsort(m_src[intra], kind="stable")]
+        counts = np.bincount(m_src[intra], minlength=n_modules)
+        _WORKER['intra_pairs'] = pair[intra]
+        _WORKER['scored'] = np.flatnonzero(counts > 0)
+        _WORKER['starts'] = np.concatenate([[0], np.cumsum(counts)[:-1]])[counts > 0]
+        _WORKER['counts'] = counts[counts > 0]
+    else:
+        n_nodes = len(membership)
+        degree = np.bincount(src, minlength=n_nodes) + np.bincount(dst, minlength=n_nodes)
+        _WORKER['degree'] = degree
+        _WORKER['by_degree'] = np.argsort(degree, kind="stable")
+
+
+def _exceedances(args):
+    """
+    Number of permutations of one chunk with a module mean >= the observed one.
+    """
+    n_perm, seed = args
+    rng = np.random.default_rng(seed)
+    observed = _WORKER['observed']
+    edge_masks = _WORKER['edge_masks']
+
+    if _WORKER['null'] == "edges":
+        shuffled = np.tile(_WORKER['pair_masks'], (n_perm, 1))
+        rng.permuted(shuffled, axis=1, out=shuffled)
+        means = np.full((n_perm, len(observed)), np.nan)
+        if len(_WORKER['intra_pairs']):
+            sums = np.add.reduceat(shuffled[:, _WORKER['intra_pairs']], _WORKER['starts'], axis=1)
+            means[:, _WORKER['scored']] = sums / _WORKER['counts']
+    else:
+        membership = _WORKER['membership']
+        degree = _WORKER['degree']
+        by_degree = _WORKER['by_degree']
+        # random order within every degree class: sort by degree + uniform noise
+        shuffled_order = np.argsort(degree[None, :] + rng.random((n_perm, len(degree))), axis=1)
+        perm_membership = np.empty((n_perm, len(degree)), dtype=membership.dtype)
+        perm_membership[:, by_degree] = membership[shuffled_order]
+        means = module_means(perm_membership, _WORKER['src'], _WORKER['dst'], edge_masks, len(observed))
+
+    # nan (no intra-module edges) never exceeds
+    return (means >= observed).sum(0)
+
+
+def module_permutation_test(edge_index, edge_masks, modules, n_permutations=1000, null="edges",
+                            chunk_size=None, n_jobs=1, random_seed=None, max_chunk_bytes=256 * 2**20):
+    """
+    Empirical p-values of the module importances.
+    :param edge_index: [2, E] edge_index array
+    :param edge_masks: [E] edge masks
+    :param modules: list of modules (lists of node ids)
+    :param null: "edges" or "degree" (see module docstring)
+    :param chunk_size: permutations per chunk (default: [chunk, E] arrays of at most max_chunk_bytes)
+    :param n_jobs: worker processes for the chunks
+    :return: observed importance, p-value and BH adjusted p-value of every module
+             (nan for modules without intra-module edges)
+    """
+    assert null in NULLS
+
+    edge_index = np.asarray(edge_index, dtype=np.int64)
+    edge_masks = np.abs(np.asarray(edge_masks, dtype=float).reshape(-1))
+    n_nodes = int(edge_index.max()) + 1
+    membership = membership_of(modules, n_nodes)
+    src, dst = edge_index
+    observed = module_means(membership[None, :], src, dst, edge_masks, len(modules))[0]
+
+    if chunk_size is None:
+        chunk_size = max(1, min(n_permutations, max_chunk_bytes // (8 * max(edge_index.shape[1], n_nodes) * 3)))
+    sizes = [min(chunk_size, n_permutations - start) for start in range(0, n_permutations, chunk_size)]
+    seeds = [int(seq.generate_state(1)[0]) for seq in np.random.SeedSequence(random_seed).spawn(len(sizes))]
+    tasks = list(zip(sizes, seeds))
+
+    exceed = np.zeros(len(modules), dtype=np.int64)
+    initargs = (edge_index, edge_masks, membership, observed, null)
+    if n_jobs > 1:
+        ctx = mp.get_context('spawn')
+        with ctx.Pool(n_jobs, initializer=_init_worker, initargs=initargs) as pool:
+            for counts in pool.imap_unordered(_exceedances, tasks):
+                exceed += counts
+    else:
+        _init_worker(*initargs)
+        for task in tasks:
+            exceed += _exceedances(task)
+
+    p_values = (exceed + 1) / (n_permutations + 1)
+    p_values[np.isnan(observed)] = np.nan
+    return observed, p_values, fdr_bh(p_values)
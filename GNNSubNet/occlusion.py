@@ -0,0 +1,118 @@
+"""
+Occlusion (gene knock-out) importance.
+
+Every gene is knocked out (its features set to a fill value) in all test
+patients and the test set is re-scored. Instead of N x P single forwards the
+masked inputs are built as [chunk, P, N, F] blocks against the shared
+topology and streamed through the model in batches, so memory is bounded by
+the chunk size, which is derived from the available RAM if not given.
+"""
+
+import os
+
+import numpy as np
+import torch
+
+from .gnn_explainer import BatchedForward
+
+# fraction of the available memory one chunk of masked inputs may use
+MEMORY_FRACTION = 0.25
+# masked inputs, activations and outputs per input element (rough upper bound)
+MEMORY_OVERHEAD = 4
+
+
+def available_memory():
+    """
+    Available memory in bytes: MemAvailable of /proc/meminfo (free memory plus
+    reclaimable page cache), psutil if installed, the free physical pages
+    otherwise (1 GB if it cannot be determined).
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return 2**30
+
+
+def auto_chunk_size(n_patients, n_nodes, n_features, n_genes, itemsize=4):
+    """
+    Number of genes knocked out per chunk so that a chunk fits into
+    MEMORY_FRACTION of the available memory.
+    """
+    per_gene = n_patients * n_nodes * n_features * itemsize * MEMORY_OVERHEAD
+    chunk = int(available_memory() * MEMORY_FRACTION // max(per_gene, 1))
+    return int(np.clip(chunk, 1, n_genes))
+
+
+def graph_labels(dataset):
+    return torch.as_tensor([int(graph.label) if hasattr(graph, 'label') else int(graph.y)
+                            for graph in dataset])
+
+
+def _scores(forward, x, batch_size):
+    with torch.no_grad():
+        return torch.cat([forward(x[start:start + batch_size])
+                          for start in range(0, x.size(0), batch_size)])
+
+
+def occlusion_importance(model, dataset, kind, labels=None, genes=None, fill=0.0,
+                         chunk_size=None, batch_size=512, log=True):
+    """
+    Accuracy and logit changes when knocking out single genes.
+    :param kind: Input kind of the model, see BatchedForward
+    :param labels: True classes (default: taken from the graphs)
+    :param genes: Indices of the genes to knock out (default: all nodes)
+    :param fill: Value the features of a knocked out gene are set to
+    :param chunk_size: Genes per chunk (default: derived from the available memory)
+    :param batch_size: Graphs per forward
+    :return: accuracy_delta [G] (baseline - knocked out accuracy) and
+             logit_delta [G] (mean decrease of the logit of the true class)
+    """
+    model.eval()
+    forward = BatchedForward(model, kind, dataset[0])
+    x = forward.node_features(dataset)
+    (P, N, F) = x.size()
+    labels = graph_labels(dataset) if labels is None else torch.as_tensor(labels).view(-1)
+    genes = torch.arange(N) if genes is None else torch.as_tensor(genes).view(-1)
+    G = len(genes)
+
+    if chunk_size is None:
+        chunk_size = auto_chunk_size(P, N, F, G, x.element_size())
+
+    base = _scores(forward, x, batch_size)
+    base_acc = (base.argmax(-1) == labels).float().mean()
+    base_logit = base.gather(1, labels.view(-1, 1)).view(-1)
+
+    accuracy_delta = torch.zeros(G)
+    logit_delta = torch.zeros(G)
+
+    for start in range(0, G, chunk_size):
+        chunk = genes[start:start + chunk_size]
+        c = len(chunk)
+        if log:
+            print(f'Occlusion::genes {start+1}-{start+c} of {G}')
+
+        xs = x.unsqueeze(0).repeat(c, 1, 1, 1)
+        xs[torch.arange(c), :, chunk, :] = fill
+
+        out = _scores(forward, xs.view(-1, N, F), batch_size).view(c, P, -1)
+        acc = (out.argmax(-1) == labels.view(1, -1)).float().mean(1)
+        logit = out.gather(2, labels.view(1, -1, 1).expand(c, P, 1)).view(c, P)
+
+        accuracy_delta[start:start + c] = base_acc - acc
+        logit_delta[start:start + c] = (base_logit.view(1, -1) - logit).mean(1)
+
+    return accuracy_delta.numpy(), logit_delta.numpy()
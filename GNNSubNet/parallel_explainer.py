@@ -0,0 +1,90 @@
+"""
+Explainer runs distributed over worker processes.
+
+Used for explainer runs that are not vectorized across restarts in one
+optimization (e.g. when R stacked restarts do not fit into memory). The
+trained model and the test set are placed in shared memory once, every run
+gets its own RNG stream spawned from one numpy SeedSequence, so the result
+does not depend on the number of workers or on the order in which runs finish.
+"""
+
+import os
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from .gnn_explainer import GNNExplainer
+
+# per-process state, set by _init_worker
+_WORKER = {}
+
+
+def _share_graph(graph):
+    for attr in ('x', 'edge_index', 'y', 'node_features', 'edge_mat'):
+        value = getattr(graph, attr, None)
+        if torch.is_tensor(value):
+            value.share_memory_()
+
+
+def _init_worker(model, dataset, explain_fn, epochs, min_epochs, tol, n_threads, pred):
+    torch.set_num_threads(n_threads)
+    _WORKER['pred'] = pred
+    _WORKER['model'] = model
+    _WORKER['dataset'] = dataset
+    _WORKER['explain_fn'] = explain_fn
+    _WORKER['epochs'] = epochs
+    _WORKER['min_epochs'] = min_epochs
+    _WORKER['tol'] = tol
+
+
+def _explain_run(args):
+    idx, seed = args
+    np_seed, torch_seed = seed.generate_state(2)
+    np.random.seed(np_seed)
+    torch.manual_seed(int(torch_seed))
+
+    exp = GNNExplainer(_WORKER['model'], epochs=_WORKER['epochs'], log=False,
+                       min_epochs=_WORKER['min_epochs'], tol=_WORKER['tol'])
+    mask = getattr(exp, _WORKER['explain_fn'])(_WORKER['dataset'], 0.8, pred=_WORKER['pred'])
+    return idx, mask[:, 0].numpy(), int(exp.epochs_used[0])
+
+
+def run_seeds(n_runs, random_seed=None, start=0):
+    """
+    One independent SeedSequence per run, for runs start .. start+n_runs-1,
+    so that runs added to cached ones get new seeds.
+    """
+    if random_seed is None:
+        # follows np.random.seed() of the caller
+        random_seed = np.random.randint(2**31)
+    return np.random.SeedSequence(random_seed).spawn(start + n_runs)[start:]
+
+
+def iter_node_masks(model, dataset, explain_fn, n_runs, n_jobs, epochs=300, min_epochs=None, tol=1e-2,
+                    random_seed=None, pred=None, start=0):
+    """
+    Runs n_runs explainer runs on n_jobs worker processes and yields them as
+    they complete. Closing the generator terminates the pool.
+    :param start: index of the first run in the seed sequence (e.g. the number of cached runs)
+    :return: generator of (run index, [N] raw node mask, epochs used)
+    """
+    n_jobs = max(1, min(n_jobs, n_runs))
+    n_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+
+    model.eval()
+    if pred is None:
+        pred = GNNExplainer(model).initial_prediction(dataset, GNNExplainer.kinds[explain_fn])
+
+    model.share_memory()
+    pred.share_memory_()
+    for graph in dataset:
+        _share_graph(graph)
+
+    seeds = run_seeds(n_runs, random_seed, start=start)
+
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(n_jobs, initializer=_init_worker,
+                  initargs=(model, dataset, explain_fn, epochs, min_epochs, tol, n_threads, pred)) as pool:
+        for result in pool.imap_unordered(_explain_run, enumerate(seeds)):
+            yield result
@@ -0,0 +1,162 @@
+"""
+Binary results bundle.
+
+A bundle is a zip archive with one .npy member per array and a manifest.json
+(array shapes/dtypes and free metadata). Members are stored uncompressed by
+default, so ResultsBundle can memory-map them directly from the archive;
+with compress=True they are deflated and decompressed on first access.
+Arrays keep their full precision; to_text writes the legacy text files.
+
+Communities (lists of node ids of different length) are stored as
+modules_members/modules_offsets, module i being
+members[offsets[i]:offsets[i+1]].
+"""
+
+import io
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+BUNDLE_NAME = "results.gnnsubnet"
+
+
+def pack_modules(modules):
+    sizes = [len(module) for module in modules]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    members = np.array([node for module in modules for node in module], dtype=np.int64)
+    return members, offsets
+
+
+def unpack_modules(members, offsets):
+    return [members[offsets[i]:offsets[i + 1]].tolist() for i in range(len(offsets) - 1)]
+
+
+def save_bundle(path, arrays, metadata=None, modules=None, compress=False):
+    """
+    Writes the arrays (dict name -> array) to a bundle at path.
+    :param metadata: JSON serializable dict stored in the manifest
+    :param modules: Optional list of communities
+    :param compress: Deflate the members. Off by default: stored members are
+        memory-mapped by ResultsBundle, so reading one array of a large run
+        (e.g. a row of node_mask_matrix) does not load the whole file, while
+        masks of float noise shrink little under deflate.
+    """
+    arrays = {name: np.asarray(value) for name, value in arrays.items() if value is not None}
+    if modules is not None:
+        arrays["modules_members"], arrays["modules_offsets"] = pack_modules(modules)
+
+    manifest = {"format": "gnnsubnet-results", "version": 1, "metadata": metadata or {},
+                "arrays": {name: {"shape": list(a.shape), "dtype": a.dtype.str} for name, a in arrays.items()}}
+
+    tmp = f"{path}.tmp"
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(tmp, "w", compression=compression, allowZip64=True) as zf:
+        zf.writestr(MANIFEST, json.dumps(manifest, indent=1, default=str))
+        for name, value in arrays.items():
+            with zf.open(f"{name}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(value), allow_pickle=False)
+    os.replace(tmp, path)
+
+
+class ResultsBundle(object):
+    """
+    Lazy reader of a results bundle. Arrays are loaded on access; members
+    stored uncompressed are memory-mapped (read only) from the archive.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path, "r")
+        self.manifest = json.loads(self._zip.read(MANIFEST))
+        self.metadata = self.manifest["metadata"]
+        self._arrays = {}
+
+    def keys(self):
+        return list(self.manifest["arrays"].keys())
+
+    def __contains__(self, name):
+        return name in self.manifest["arrays"]
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            info = self._zip.getinfo(f"{name}.npy")
+            if info.compress_type == zipfile.ZIP_STORED:
+                self._arrays[name] = self._memmap(info)
+            else:
+                with self._zip.open(info) as f:
+                    self._arrays[name] = np.lib.format.read_array(io.BytesIO(f.read()), allow_pickle=False)
+        return self._arrays[name]
+
+    def _memmap(self, info):
+        with open(self.path, "rb") as f:
+            # local file header: 30 bytes + file name + extra field
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_len, extra_len = struct.unpack("<HH", header[26:30])
+            start = info.header_offset + 30 + name_len + extra_len
+            f.seek(start)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        if int(np.prod(shape)) == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                         order="F" if fortran_order else "C")
+
+    @property
+    def modules(self):
+        if "modules_members" not in self:
+            return None
+        return unpack_modules(self["modules_members"], self["modules_offsets"])
+
+    def close(self):
+        self._arrays = {}
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_text(out_dir, arrays, modules=None):
+    """
+    Writes the legacy text files (gnn_feature_masks{idx}.csv, gnn_edge_masks{idx}.csv,
+    edge_masks.txt, communities.txt, communities_scores.txt, gene_names.txt)
+    of the given arrays (dict name -> array or a ResultsBundle).
+    """
+    if "run_edge_masks" in arrays:
+        edge_masks = arrays["run_edge_masks"]
+        for idx in range(edge_masks.shape[0]):
+            np.savetxt(f'{out_dir}/gnn_edge_masks{idx}.csv', edge_masks[idx], delimiter=',', fmt='%.3f')
+        if "node_mask_matrix" in arrays:
+            node_masks = arrays["node_mask_matrix"]
+            for idx in range(node_masks.shape[1]):
+                np.savetxt(f'{out_dir}/gnn_feature_masks{idx}.csv', node_masks[:, idx], delimiter=',', fmt='%.3f')
+    if "edge_mask" in arrays:
+        np.savetxt(f'{out_dir}/edge_masks.txt', arrays["edge_mask"], delimiter=',', fmt='%.5f')
+    if modules is not None:
+        np.savetxt(f'{out_dir}/communities_scores.txt', arrays["module_importances"], delimiter=',', fmt='%.3f')
+        with open(f'{out_dir}/communities.txt', "w") as f:
+            for module in modules:
+                f.write(','.join(str(e) for e in module) + '\n')
+        if "gene_names" in arrays:
+            with open(f'{out_dir}/gene_names.txt', "w") as f:
+                for element in arrays["gene_names"]:
+                    f.write(str(element) + "\n")
+
+
+def to_text(bundle_path, out_dir=None):
+    """
+    Converts a GNNSubNet results bundle into the legacy text files (see write_text).
+    """
+    out_dir = out_dir or os.path.dirname(os.path.abspath(bundle_path))
+    with ResultsBundle(bundle_path) as bundle:
+        write_text(out_dir, bundle, bundle.modules)
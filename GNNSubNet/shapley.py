@@ -0,0 +1,164 @@
+"""
+Permutation sampling Shapley values of detected modules.
+
+The players are the communities found by find_communities. The value of a
+coalition is the mean model score (logit of the originally predicted class)
+over the test patients when the genes of all modules outside the coalition
+are knocked out; genes that belong to no module are always kept. Each sampled
+permutation gives one marginal contribution per module, all coalitions of a
+batch of permutations are evaluated with batched masked forwards, optionally
+on several worker processes. Sampling stops once the standard error of every
+estimate is below rel_tol of v(all modules) - v(no module).
+"""
+
+import os
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from .gnn_explainer import BatchedForward
+
+# per-process state, set by _init_worker
+_WORKER = {}
+
+
+def node_modules(modules, n_nodes):
+    """
+    Module index per node, -1 for nodes in no module.
+    """
+    node_module = torch.full((n_nodes,), -1, dtype=torch.long)
+    for idx, module in enumerate(modules):
+        node_module[torch.as_tensor(list(module), dtype=torch.long)] = idx
+    return node_module
+
+
+def coalition_values(forward, x, target, coalitions, node_module, fill=0.0, batch_size=512):
+    """
+    Value of every coalition.
+    :param x: [P, N, F] node features
+    :param target: [P] class whose score is used per patient
+    :param coalitions: [C, M] bool, coalition membership of the M modules
+    :return: [C] mean score over the patients
+    """
+    (P, N, F) = x.size()
+    C = coalitions.size(0)
+
+    present = torch.ones(C, N, dtype=torch.bool)
+    in_module = node_module >= 0
+    present[:, in_module] = coalitions[:, node_module[in_module]]
+
+    step = max(1, batch_size // P)
+    values = torch.zeros(C)
+    with torch.no_grad():
+        for start in range(0, C, step):
+            mask = present[start:start + step].view(-1, 1, N, 1)
+            xs = torch.where(mask, x.unsqueeze(0), torch.full_like(x, fill).unsqueeze(0))
+            out = forward(xs.view(-1, N, F)).view(mask.size(0), P, -1)
+            values[start:start + step] = out.gather(2, target.view(1, -1, 1).expand(mask.size(0), P, 1)).mean((1, 2))
+    return values
+
+
+def permutation_contributions(forward, x, target, node_module, n_modules, n_permutations, rng,
+                              fill=0.0, batch_size=512):
+    """
+    Marginal contributions of n_permutations random permutations.
+    :return: [n_permutations, M] contribution of each module
+    """
+    perms = np.stack([rng.permutation(n_modules) for _ in range(n_permutations)])
+
+    # coalition j of a permutation holds its first j players
+    ranks = np.argsort(perms, axis=1)
+    coalitions = ranks[:, None, :] < np.arange(n_modules + 1)[None, :, None]
+    coalitions = torch.from_numpy(coalitions.reshape(-1, n_modules))
+
+    values = coalition_values(forward, x, target, coalitions, node_module, fill, batch_size)
+    values = values.view(n_permutations, n_modules + 1).numpy()
+
+    contributions = np.zeros((n_permutations, n_modules))
+    np.put_along_axis(contributions, perms, np.diff(values, axis=1), axis=1)
+    return contributions
+
+
+def _init_worker(model, kind, template, x, target, node_module, n_modules, fill, batch_size, n_threads):
+    torch.set_num_threads(n_threads)
+    _WORKER.update(forward=BatchedForward(model, kind, template), x=x, target=target,
+                   node_module=node_module, n_modules=n_modules, fill=fill, batch_size=batch_size)
+
+
+def _worker_batch(args):
+    n_permutations, seed = args
+    w = _WORKER
+    return permutation_contributions(w['forward'], w['x'], w['target'], w['node_module'], w['n_modules'],
+                                     n_permutations, np.random.default_rng(seed), w['fill'], w['batch_size'])
+
+
+def module_shapley(model, dataset, kind, modules, target=None, fill=0.0, max_permutations=1000,
+                   batch_permutations=8, min_permutations=32, rel_tol=0.01, n_jobs=1,
+                   batch_size=512, random_seed=None):
+    """
+    Monte Carlo permutation Shapley values of the modules.
+    :param kind: Input kind of the model, see BatchedForward
+    :param modules: List of node index lists (the communities)
+    :param target: Class whose score is used per patient (default: predicted class)
+    :param fill: Value the features of knocked out genes are set to
+    :return: shapley [M], standard error [M], number of permutations used
+    """
+    model.eval()
+    forward = BatchedForward(model, kind, dataset[0])
+    x = forward.node_features(dataset)
+    M = len(modules)
+    node_module = node_modules(modules, x.size(1))
+
+    if target is None:
+        with torch.no_grad():
+            target = torch.cat([forward(x[start:start + batch_size]).argmax(-1)
+                                for start in range(0, len(dataset), batch_size)])
+    target = torch.as_tensor(target).view(-1)
+
+    ends = coalition_values(forward, x, target, torch.tensor([[False] * M, [True] * M]), node_module, fill, batch_size)
+    scale = abs(float(ends[1] - ends[0])) or 1.0
+
+    # Welford statistics of the marginal contributions
+    count = 0
+    mean = np.zeros(M)
+    m2 = np.zeros(M)
+    se = np.full(M, np.inf)
+
+    # the last batch is clipped to max_permutations
+    sizes = [min(batch_permutations, max_permutations - start) for start in range(0, max_permutations, batch_permutations)]
+    seeds = np.random.SeedSequence(random_seed).spawn(len(sizes))
+    tasks = zip(sizes, seeds)
+
+    if n_jobs > 1:
+        n_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+        ctx = mp.get_context('spawn')
+        pool = ctx.Pool(n_jobs, initializer=_init_worker,
+                        initargs=(model, kind, dataset[0], x, target, node_module, M, fill, batch_size, n_threads))
+        # merged in submission order, so the stopping point does not depend on worker timing
+        batches = pool.imap(_worker_batch, tasks)
+    else:
+        pool = None
+        batches = (permutation_contributions(forward, x, target, node_module, M, n, np.random.default_rng(seed),
+                                             fill, batch_size) for n, seed in tasks)
+
+    try:
+        for contributions in batches:
+            n = len(contributions)
+            batch_mean = contributions.mean(0)
+            delta = batch_mean - mean
+            total = count + n
+            mean = mean + delta * n / total
+            m2 = m2 + ((contributions - batch_mean)**2).sum(0) + delta**2 * count * n / total
+            count = total
+
+            if count > 1:
+                se = np.sqrt(m2 / (count - 1) / count)
+            if count >= min_permutations and se.max() < rel_tol * scale:
+                print(f'Shapley::converged after {count} permutations')
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return mean, se, count
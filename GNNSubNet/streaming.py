@@ -0,0 +1,160 @@
+"""
+Pipelined explainer runs.
+
+A producer thread pulls finished explainer runs (from the batched explainer
+or from the process pool, see parallel_explainer.iter_node_masks) and puts
+them into a bounded queue. The consumer merges every run into running
+statistics of the node and edge masks, and every few runs recomputes the
+communities of the current mean edge mask in a background thread. Once the
+top modules stay the same for a number of recomputations the remaining runs
+can be skipped.
+"""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .community_detection import find_communities, intra_community_sums
+from .mask_stats import RunningStats
+
+_DONE = object()
+
+
+def _produce(runs, items, stop):
+    try:
+        for item in runs:
+            if stop.is_set():
+                break
+            items.put(item)
+    except BaseException as e:
+        items.put(e)
+    finally:
+        close = getattr(runs, "close", None)
+        if close is not None:
+            close()
+        items.put(_DONE)
+
+
+def top_module_genes(membership, edge_index, edge_mask, top_k):
+    """
+    Nodes of the top_k modules with the largest mean edge mask.
+    """
+    membership = np.asarray(membership)
+    sums, counts = intra_community_sums(edge_index, edge_mask, membership)
+    scores = np.where(counts > 0, sums / np.maximum(counts, 1), -np.inf)
+    top = np.argsort(-scores, kind="stable")[:top_k]
+    return set(np.flatnonzero(np.isin(membership, top[np.isfinite(scores[top])])).tolist())
+
+
+def _provisional(edge_index, edge_mask, n_done, detection_alg, resolution, top_k):
+    avg_mask, partition = find_communities(edge_index, edge_mask, detection_alg=detection_alg, resolution=resolution)
+    genes = top_module_genes(partition.membership, edge_index, np.abs(edge_mask), top_k)
+    return dict(n_runs=n_done, modules=[list(c) for c in partition], module_importances=avg_mask, top_genes=genes)
+
+
+def stream_runs(runs, edge_index, n_runs, community_every=5, top_k=5, stop_jaccard=None, patience=3,
+                min_runs=10, detection_alg='louvain', resolution=1.0, queue_size=8, callback=None,
+                quantiles=None, random_seed=None, node_runs=None, edge_runs=None):
+    """
+    Merges explainer runs into running mean/variance of the node and edge masks
+    while they are produced.
+    :param runs: iterator of (run index, [N] raw node mask, epochs used)
+    :param edge_index: [2, E] edge_index array of the graph
+    :param n_runs: number of runs the iterator produces at most
+    :param community_every: provisional communities after every community_every runs
+    :param top_k: number of top modules compared between provisional communities
+    :param stop_jaccard: stop once the genes of the top_k modules of patience successive
+                         provisional communities have a Jaccard index >= stop_jaccard
+                         (None: never stop early)
+    :param min_runs: runs before an early stop is possible
+    :param callback: called with every provisional result (dict with n_runs, modules,
+                     module_importances, top_genes)
+    :param quantiles: quantile levels of the masks across runs (see RunningStats)
+    :param node_runs: optional [N, n_runs] array, column i gets the node mask of the
+                      i-th merged run
+    :param edge_runs: optional [n_runs, E] array, row i gets the edge mask of the
+                      i-th merged run
+    :return: dict with the node and edge mask RunningStats, epochs per run, the last
+             provisional result and whether the runs stopped early
+    """
+    edge_index = np.asarray(edge_index)
+    rows, cols = edge_index
+
+    node_stats = RunningStats(quantiles, random_seed=random_seed)
+    edge_stats = RunningStats(quantiles, random_seed=random_seed)
+    epochs = {}
+
+    items = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    producer = threading.Thread(target=_produce, args=(runs, items, stop), daemon=True)
+    producer.start()
+
+    detection = ThreadPoolExecutor(max_workers=1)
+    pending = None
+    provisional = None
+    stable = 0
+    stopped_early = False
+
+    def collect(future):
+        nonlocal provisional, stable
+        result = future.result()
+        if provisional is not None and stop_jaccard is not None:
+            union = result["top_genes"] | provisional["top_genes"]
+            jaccard = len(result["top_genes"] & provisional["top_genes"]) / max(len(union), 1)
+            stable = stable + 1 if jaccard >= stop_jaccard else 0
+            print(f'Explainer::provisional modules after {result["n_runs"]} runs, top-{top_k} Jaccard {jaccard:.3f}')
+        provisional = result
+        if callback is not None:
+            callback(result)
+
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+
+            idx, mask, n_epochs = item
+            mask = np.asarray(mask, dtype=np.float64).reshape(-1)
+            node_mask = 1 / (1 + np.exp(-mask))
+            # same as the batch path: sigmoid of the mean raw mask of the two nodes
+            edge_mask = 1 / (1 + np.exp(-(mask[rows] + mask[cols]) / 2))
+            if node_runs is not None:
+                node_runs[:, node_stats.n] = node_mask
+            if edge_runs is not None:
+                edge_runs[node_stats.n] = edge_mask
+            node_stats.update(node_mask)
+            edge_stats.update(edge_mask)
+            epochs[idx] = n_epochs
+            print(f'Explainer::run {idx+1} merged ({node_stats.n} of {n_runs})')
+
+            if pending is not None and pending.done():
+                collect(pending)
+                pending = None
+                if stop_jaccard is not None and stable >= patience and node_stats.n >= min_runs:
+                    print(f'Explainer::module ranking stable, stopping after {node_stats.n} runs')
+                    stopped_early = True
+                    stop.set()
+                    break
+
+            if pending is None and node_stats.n % community_every == 0 and node_stats.n < n_runs:
+                pending = detection.submit(_provisional, edge_index, edge_stats.mean.copy(), node_stats.n,
+                                           detection_alg, resolution, top_k)
+    finally:
+        stop.set()
+        # unblock the producer if it waits on a full queue
+        while producer.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        detection.shutdown(wait=True)
+
+    if pending is not None:
+        collect(pending)
+
+    return dict(node_stats=node_stats, edge_stats=edge_stats, epochs=[epochs[idx] for idx in sorted(epochs)],
+                provisional=provisional, stopped_early=stopped_early)
@@ -0,0 +1,256 @@
+"""
+Time-to-accuracy benchmark suite for GNN-SubNet.
+
+Generates synthetic PPI networks / omics cohorts of increasing size and times
+the main stages of the pipeline for every training method:
+
+    load_harmonize       GNNSubNet(...) (reading and harmonizing PPI + features)
+    convert_to_s2vgraph  conversion of the cohort into S2VGraph objects
+    train_step           one optimizer step on a batch of 32 patients
+    train                full training run (--epochs), reported with its accuracy
+    predict              prediction of the whole cohort with the trained model
+    explain              one explainer run (no community detection)
+    find_communities     community detection on the explainer edge masks
+
+Results (all repeats, median, accuracy, environment) are written to JSON so
+that runs can be compared against each other:
+
+    python benchmarks/benchmark_gnnsubnet.py --out bench.json
+    python benchmarks/benchmark_gnnsubnet.py --full --out bench_full.json
+    python benchmarks/benchmark_gnnsubnet.py --baseline bench.json --out bench_new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+from torch_geometric.data import Batch
+from torch_geometric.nn.conv.cheb_conv import ChebConv
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO))
+
+from GNNSubNet import GNNSubNet as gnn
+from GNNSubNet.dataset import convert_to_s2vgraph
+from GNNSubNet.gnn_training_utils import chebconv_forward, stack_node_features
+from GNNSubNet.graphcnn import GraphCNN
+from GNNSubNet.graphcheb import GraphCheb, ChebConvNet
+from GNNSubNet.community_detection import find_communities
+
+METHODS = ["graphcnn", "graphcheb", "chebconv", "chebnet"]
+
+# (nodes, patients)
+QUICK_SIZES = [(30, 100), (30, 1000), (500, 500), (2000, 1000)]
+FULL_SIZES  = [(30, 100), (30, 1000), (30, 10000),
+               (500, 100), (500, 1000), (500, 10000),
+               (2000, 100), (2000, 1000), (2000, 10000),
+               (20000, 100), (20000, 1000), (20000, 10000)]
+
+STAGES = ["load_harmonize", "convert_to_s2vgraph", "train_step", "train", "predict", "explain", "find_communities"]
+
+
+def write_synthetic(location, n_nodes, n_patients, seed=0, sigma=1.0):
+    """
+    Writes NETWORK/FEATURES/TARGET files in the format of datasets/synthetic.
+    The class depends on the signal of two adjacent genes.
+    :return: paths to the ppi, features and target file
+    """
+    rng = np.random.default_rng(seed)
+    graph = nx.generators.random_graphs.barabasi_albert_graph(n_nodes, 1, seed=seed)
+    edges = np.array(graph.edges())
+    genes = np.array([f"N{i+1}" for i in range(n_nodes)])
+
+    ppi_path = f"{location}/NETWORK_synthetic.txt"
+    ppi = pd.DataFrame({"Node1": genes[edges[:, 0]], "Node2": genes[edges[:, 1]], "combined_score": 999})
+    ppi.index = ppi.index + 1
+    with open(ppi_path, "w") as f:
+        f.write('"Node1" "Node2" "combined_score"\n')
+        ppi.to_csv(f, sep=" ", header=False)
+
+    a, b = edges[rng.integers(len(edges))]
+    feats  = rng.normal(0, sigma, size=(n_patients, n_nodes))
+    target = ((feats[:, a] > 0) ^ (feats[:, b] > 0)).astype(int)
+
+    feat_path = f"{location}/FEATURES_synthetic.txt"
+    with open(feat_path, "w") as f:
+        f.write(" ".join(f'"{g}"' for g in genes) + "\n")
+        pd.DataFrame(feats, index=np.arange(1, n_patients + 1)).to_csv(f, sep=" ", header=False, float_format="%.6f")
+
+    target_path = f"{location}/TARGET_synthetic.txt"
+    with open(target_path, "w") as f:
+        f.write(" ".join(f'"V{i+1}"' for i in range(n_patients)) + "\n")
+        f.write('"1" ' + " ".join(str(t) for t in target) + "\n")
+
+    return ppi_path, [feat_path], target_path
+
+
+def train_step(g, method, batch_size=32):
+    """
+    One optimizer step of the training loop of the given method.
+    """
+    graphs = [g.dataset[idx] for idx in np.random.permutation(len(g.dataset))[:batch_size]]
+    labels = torch.LongTensor([graph.y for graph in graphs])
+    input_dim = g.dataset[0].x.shape[1]
+    n_nodes   = g.dataset[0].x.shape[0]
+
+    if method == "graphcnn":
+        batch_graph = convert_to_s2vgraph(graphs)
+        model = GraphCNN(2, 2, input_dim, 32, 2, 0.5, True, 'sum1', 'sum', 0)
+        forward = lambda: model(batch_graph)
+    elif method == "graphcheb":
+        batch = Batch.from_data_list(graphs)
+        model = GraphCheb(num_node_features=input_dim, hidden_channels=7, K=5, layers_nr=2, num_classes=2)
+        forward = lambda: model(batch.x, batch.edge_index, batch.batch)
+    elif method == "chebnet":
+        batch = Batch.from_data_list(graphs)
+        model = ChebConvNet(input_channels=1, n_features=n_nodes, n_channels=2, n_classes=2, K=8, n_layers=1)
+        forward = lambda: model(x=batch.x, edge_index=batch.edge_index, batch=batch.batch)
+    else:
+        x = stack_node_features(graphs)
+        model = ChebConv(input_dim, 2, 10)
+        forward = lambda: chebconv_forward(model, x, graphs[0].edge_index)
+
+    opt = torch.optim.Adam(model.parameters(), lr=0.01)
+    model.train()
+
+    start = time.perf_counter()
+    loss = nn.CrossEntropyLoss()(forward(), labels)
+    opt.zero_grad()
+    loss.backward()
+    opt.step()
+    return time.perf_counter() - start
+
+
+def timed(fn):
+    start = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - start, out
+
+
+def bench_case(n_nodes, n_patients, methods, epochs, repeats, seed):
+    """
+    Runs all stages for one (nodes, patients) size.
+    :return: list of result records
+    """
+    records = []
+
+    def record(stage, method, seconds, **extra):
+        rec = {"nodes": n_nodes, "patients": n_patients, "method": method, "stage": stage,
+               "seconds": seconds, "median": float(np.median(seconds))}
+        rec.update(extra)
+        records.append(rec)
+        print(f"[{n_nodes:>6} nodes, {n_patients:>6} patients] {method or '-':>9} {stage:<20} {rec['median']:.4f}s")
+
+    with tempfile.TemporaryDirectory() as location:
+        ppi, feats, target = write_synthetic(location, n_nodes, n_patients, seed=seed)
+
+        seconds = []
+        for _ in range(repeats):
+            t, g = timed(lambda: gnn.GNNSubNet(location, ppi, feats, target, normalize=False))
+            seconds.append(t)
+        record("load_harmonize", None, seconds)
+
+        seconds = [timed(lambda: convert_to_s2vgraph(g.dataset))[0] for _ in range(repeats)]
+        record("convert_to_s2vgraph", None, seconds)
+
+        for method in methods:
+            torch.manual_seed(seed)
+            np.random.seed(seed)
+
+            seconds = [train_step(g, method) for _ in range(repeats)]
+            record("train_step", method, seconds)
+
+            t, _ = timed(lambda: g.train(epoch_nr=epochs, method=method))
+            # train_graphcnn reports the accuracy in percent
+            accuracy = float(g.accuracy) / 100 if method == "graphcnn" else float(g.accuracy)
+            record("train", method, [t], epochs=epochs, accuracy=accuracy)
+
+            seconds = [timed(lambda: g.predict(g))[0] for _ in range(repeats)]
+            record("predict", method, seconds)
+
+            t, _ = timed(lambda: g.explain(n_runs=1, communities=False))
+            record("explain", method, [t])
+
+            seconds = [timed(lambda: find_communities(g.dataset[0].edge_index, g.edge_mask))[0]
+                       for _ in range(repeats)]
+            record("find_communities", method, seconds)
+
+    return records
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "torch": torch.__version__,
+            "numpy": np.__version__, "platform": platform.platform(), "threads": torch.get_num_threads(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(records, baseline_path, threshold=1.2):
+    """
+    Prints the ratio new/baseline of the median timings and flags regressions.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    key = lambda r: (r["nodes"], r["patients"], r["method"], r["stage"])
+    old = {key(r): r for r in baseline}
+    print("\nComparison against", baseline_path)
+    for rec in records:
+        if key(rec) not in old:
+            continue
+        ratio = rec["median"] / max(old[key(rec)]["median"], 1e-12)
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{key(rec)}: {old[key(rec)]['median']:.4f}s -> {rec['median']:.4f}s (x{ratio:.2f}){flag}")
+
+
+def parse_sizes(text):
+    return [tuple(int(v) for v in item.split("x")) for item in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=None,
+                        help="comma separated NODESxPATIENTS, e.g. 30x100,500x1000")
+    parser.add_argument("--full", action="store_true", help="30 to 20k nodes, 100 to 10k patients")
+    parser.add_argument("--methods", default=",".join(METHODS))
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", default=None, help="earlier JSON result to compare against")
+    args = parser.parse_args()
+
+    sizes = args.sizes or (FULL_SIZES if args.full else QUICK_SIZES)
+    methods = [m for m in args.methods.split(",") if m]
+    for method in methods:
+        if method not in METHODS:
+            parser.error(f"unknown method {method}")
+
+    records = []
+    for n_nodes, n_patients in sizes:
+        records.extend(bench_case(n_nodes, n_patients, methods, args.epochs, args.repeats, args.seed))
+        # write after every size so partial results survive long runs
+        with open(args.out, "w") as f:
+            json.dump({"environment": environment(), "stages": STAGES, "results": records}, f, indent=1)
+
+    print(f"\nResults written to {os.path.abspath(args.out)}")
+
+    if args.baseline:
+        compare(records, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Shared fixtures: a small synthetic cohort in the file format of datasets/synthetic.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def write_synthetic(location, n_nodes=30, n_patients=120, seed=0):
+    """
+    NETWORK/FEATURES/TARGET files, the class depends on two adjacent genes.
+    """
+    np = pytest.importorskip("numpy")
+    pd = pytest.importorskip("pandas")
+    nx = pytest.importorskip("networkx")
+
+    rng = np.random.default_rng(seed)
+    graph = nx.generators.random_graphs.barabasi_albert_graph(n_nodes, 1, seed=seed)
+    edges = np.array(graph.edges())
+    genes = np.array([f"N{i+1}" for i in range(n_nodes)])
+
+    ppi_path = f"{location}/NETWORK_synthetic.txt"
+    ppi = pd.DataFrame({"Node1": genes[edges[:, 0]], "Node2": genes[edges[:, 1]], "combined_score": 999})
+    ppi.index = ppi.index + 1
+    with open(ppi_path, "w") as f:
+        f.write('"Node1" "Node2" "combined_score"\n')
+        ppi.to_csv(f, sep=" ", header=False)
+
+    a, b = edges[0]
+    feats = rng.normal(0, 1, size=(n_patients, n_nodes))
+    target = ((feats[:, a] > 0) ^ (feats[:, b] > 0)).astype(int)
+
+    feat_path = f"{location}/FEATURES_synthetic.txt"
+    with open(feat_path, "w") as f:
+        f.write(" ".join(f'"{g}"' for g in genes) + "\n")
+        pd.DataFrame(feats, index=np.arange(1, n_patients + 1)).to_csv(f, sep=" ", header=False, float_format="%.6f")
+
+    target_path = f"{location}/TARGET_synthetic.txt"
+    with open(target_path, "w") as f:
+        f.write(" ".join(f'"V{i+1}"' for i in range(n_patients)) + "\n")
+        f.write('"1" ' + " ".join(str(t) for t in target) + "\n")
+
+    return ppi_path, [feat_path], target_path
+
+
+@pytest.fixture
+def graphcnn(tmp_path, monkeypatch):
+    """
+    GNNSubNet with a graphcnn model trained for one epoch.
+    """
+    # training writes its checkpoint to the working directory
+    monkeypatch.chdir(tmp_path)
+    for module in ["torch", "torch_geometric", "igraph", "dgl", "tensorflow"]:
+        pytest.importorskip(module)
+    from GNNSubNet import GNNSubNet as gnn
+
+    ppi, feats, target = write_synthetic(tmp_path)
+    g = gnn.GNNSubNet(str(tmp_path), ppi, feats, target, random_seed=0)
+    g.train(epoch_nr=1, method="graphcnn")
+    return g
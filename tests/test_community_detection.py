@@ -0,0 +1,29 @@
+import pytest
+
+igraph = pytest.importorskip("igraph")
+
+from GNNSubNet.community_detection import detect
+
+
+@pytest.mark.parametrize("detection_alg", ["louvain", "leiden"])
+def test_detect_graph_without_edges(detection_alg):
+    partition = detect(igraph.Graph(n=3), detection_alg=detection_alg)
+
+    assert len(partition.membership) == 3
+
+
+def test_consensus_keeps_the_global_random_state():
+    import random
+
+    np = pytest.importorskip("numpy")
+    from GNNSubNet.community_detection import consensus_communities
+
+    edge_index = np.array([[0, 1, 1, 2, 2, 3, 3, 0], [1, 0, 2, 1, 3, 2, 0, 3]])
+    run_edge_masks = np.random.default_rng(0).random((3, edge_index.shape[1]))
+
+    random.seed(123)
+    expected = random.random()
+    random.seed(123)
+    consensus_communities(edge_index, run_edge_masks, random_seed=0)
+
+    assert random.random() == expected
@@ -0,0 +1,47 @@
+import pytest
+
+from conftest import write_synthetic
+
+
+def _ensemble_models():
+    for module in ["torch", "torch_geometric", "igraph", "dgl", "tensorflow"]:
+        pytest.importorskip(module)
+    import torch
+    from torch_geometric.data import Batch, Data
+    from GNNSubNet.dataset import convert_to_s2vgraph
+    from GNNSubNet.ensemble import ModelEnsemble
+    from GNNSubNet.graphcheb import GraphCheb
+    from GNNSubNet.graphcnn import GraphCNN
+
+    torch.manual_seed(0)
+    edge_index = torch.tensor([[0, 1, 1, 2, 2, 3], [1, 0, 2, 1, 3, 2]])
+    graphs = [Data(x=torch.randn(4, 1), edge_index=edge_index, y=torch.tensor(i % 2)) for i in range(6)]
+    batch = Batch.from_data_list(graphs)
+
+    graphcnn = ModelEnsemble([GraphCNN(2, 2, 1, 8, 2, 0.5, True, 'sum1', 'sum', 0) for _ in range(3)])
+    graphcheb = ModelEnsemble([GraphCheb(1, 7, 5, 2, 2) for _ in range(3)])
+    return [(graphcnn, (convert_to_s2vgraph(graphs),)), (graphcheb, (batch.x, batch.edge_index, batch.batch))]
+
+
+def test_members_are_vectorized():
+    import torch
+
+    for ensemble, inputs in _ensemble_models():
+        assert ensemble.check_vmap(*inputs) is True
+
+        ensemble.eval()
+        looped = torch.stack([ensemble.member(idx)(*inputs) for idx in range(ensemble.n_models)])
+        assert torch.allclose(ensemble.forward_all(*inputs), looped, atol=1e-5)
+
+
+def test_graphcnn_ensemble_training(tmp_path):
+    for module in ["torch", "torch_geometric", "igraph", "dgl", "tensorflow"]:
+        pytest.importorskip(module)
+    from GNNSubNet import GNNSubNet as gnn
+
+    ppi, feats, target = write_synthetic(tmp_path)
+    g = gnn.GNNSubNet(str(tmp_path), ppi, feats, target, random_seed=0)
+    g.train_ensemble(n_models=2, method="graphcnn", epoch_nr=1, random_seed=0)
+
+    assert g.model_config["vectorize"] is True
+    assert g.model.forward_all(g.s2v_test_dataset[:3]).shape == (2, 3, 2)
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from GNNSubNet.parallel_explainer import run_seeds
+
+
+def test_run_seeds_continue_the_sequence():
+    all_seeds = [s.generate_state(2).tolist() for s in run_seeds(4, random_seed=0)]
+    added = [s.generate_state(2).tolist() for s in run_seeds(2, random_seed=0, start=2)]
+
+    assert added == all_seeds[2:]
+
+
+def test_cached_runs_are_extended_with_new_runs(graphcnn):
+    graphcnn.keep_runs = True
+    graphcnn.explain(n_runs=2, communities=False, n_jobs=2, max_epochs=5, cache=True)
+    graphcnn.explain(n_runs=4, communities=False, n_jobs=2, max_epochs=5, cache=True)
+
+    runs = np.asarray(graphcnn.node_mask_matrix)
+    assert runs.shape[1] == 4
+    for i in range(4):
+        for j in range(i + 1, 4):
+            assert not np.allclose(runs[:, i], runs[:, j])
+
+
+def test_restored_result_keeps_std_and_quantiles(graphcnn):
+    graphcnn.mask_quantiles = (0.1, 0.9)
+    graphcnn.explain(n_runs=3, communities=False, max_epochs=5, cache=True)
+    node_std, edge_quantiles = graphcnn.node_mask_std, graphcnn.edge_mask_quantiles
+
+    graphcnn.node_mask_std = graphcnn.edge_mask_quantiles = None
+    graphcnn.explain(n_runs=3, communities=False, max_epochs=5, cache=True)
+
+    assert np.allclose(graphcnn.node_mask_std, node_std)
+    assert np.allclose(graphcnn.edge_mask_quantiles, edge_quantiles)
+
+
+def test_consensus_needs_the_runs(graphcnn):
+    graphcnn.explain(n_runs=2, communities=False, max_epochs=5)
+
+    assert graphcnn.run_edge_masks is None
+    with pytest.raises(ValueError):
+        graphcnn.consensus_communities()
+
+
+def test_failed_explanation_is_not_cached(graphcnn):
+    graphcnn.explain(n_runs=1, communities=False, max_epochs=5)
+
+    # PGExplainer does not support chebconv and returns without results
+    graphcnn.classifier = "chebconv"
+    graphcnn.explain(communities=False, method="pgexplainer", cache=True)
+
+    assert not graphcnn._explainer_run
+    assert not list((Path(graphcnn.location) / ".explain_cache").glob("*"))
@@ -0,0 +1,28 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torch_geometric")
+
+from torch_geometric.data import Batch, Data
+
+from GNNSubNet.graphcheb import ChebConvNet, chebyshev_basis_cohort
+
+
+def test_precomputed_basis_matches_chebconv():
+    torch.manual_seed(0)
+    n_nodes, n_features = 8, 2
+    edges = torch.tensor([[0, 1, 1, 2, 3, 4, 5, 6], [1, 2, 3, 4, 5, 6, 7, 0]])
+    edge_index = torch.cat([edges, edges.flip(0)], 1)
+    graphs = [Data(x=torch.randn(n_nodes, n_features), edge_index=edge_index) for _ in range(5)]
+    model = ChebConvNet(input_channels=n_features, n_features=n_nodes, n_channels=3, n_classes=2, K=3, n_layers=1)
+    model.eval()
+
+    # chunk_size=2 covers a cohort split into several chunks
+    basis = chebyshev_basis_cohort(graphs, model.K, chunk_size=2)
+    batch = Batch.from_data_list(graphs)
+    with torch.no_grad():
+        expected = model(batch.x, batch.edge_index, batch.batch)
+        out = model.forward_basis(torch.from_numpy(basis))
+
+    assert basis.shape == (5, n_nodes, model.K, n_features)
+    assert torch.allclose(out, expected, atol=1e-5)
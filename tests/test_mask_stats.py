@@ -0,0 +1,50 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from GNNSubNet.mask_stats import RunningStats
+
+
+def test_restored_stats_continue_the_runs():
+    runs = np.random.default_rng(0).random((6, 4))
+
+    full = RunningStats(quantiles=(0.5,))
+    first = RunningStats(quantiles=(0.5,))
+    for run in runs[:3]:
+        full.update(run)
+        first.update(run)
+
+    continued = RunningStats(quantiles=(0.5,))
+    continued.restore(first.state())
+    for run in runs[3:]:
+        full.update(run)
+        continued.update(run)
+
+    assert continued.n == 6
+    assert np.allclose(continued.mean, runs.mean(0))
+    assert np.allclose(continued.std, full.std)
+    assert np.allclose(continued.quantiles, full.quantiles)
+
+
+def test_running_stats_match_numpy():
+    runs = np.random.default_rng(1).random((40, 5))
+
+    stats = RunningStats(quantiles=(0.05, 0.5, 0.95))
+    for run in runs:
+        stats.update(run)
+
+    assert stats.n == 40
+    assert np.allclose(stats.mean, runs.mean(0))
+    assert np.allclose(stats.std, runs.std(0, ddof=1))
+    # exact while the reservoir holds every run
+    assert np.allclose(stats.quantiles, np.quantile(runs, (0.05, 0.5, 0.95), axis=0), atol=1e-6)
+
+
+def test_reservoir_quantiles_approximate_many_runs():
+    runs = np.random.default_rng(2).random((2000, 3))
+
+    stats = RunningStats(quantiles=(0.5,), reservoir_size=256, random_seed=0)
+    for run in runs:
+        stats.update(run)
+
+    assert np.allclose(stats.quantiles[0], np.median(runs, 0), atol=0.1)
@@ -0,0 +1,20 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+def test_bundle_round_trip(graphcnn, tmp_path):
+    from GNNSubNet import GNNSubNet as gnn
+
+    path = str(tmp_path / "model.zip")
+    graphcnn.save_bundle(path)
+
+    loaded = gnn.GNNSubNet.load_bundle(path)
+
+    features = np.random.default_rng(1).normal(size=(5, len(graphcnn.gene_names)))
+    assert np.allclose(loaded.predict_proba(features), graphcnn.predict_proba(features), atol=1e-6)
+
+    # no test set without data, explanations of given graphs
+    assert loaded.s2v_test_dataset is None and loaded.edge_mask is None
+    masks = loaded.explain_patients(epochs=2, dataset=graphcnn.s2v_test_dataset[:3])
+    assert masks.shape == (3, len(graphcnn.gene_names))
@@ -0,0 +1,58 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from GNNSubNet.module_significance import fdr_bh, module_permutation_test
+
+
+def _undirected_graph(n_nodes=60, n_edges=240, seed=0):
+    rng = np.random.default_rng(seed)
+    pairs = set()
+    while len(pairs) < n_edges:
+        a, b = rng.integers(n_nodes, size=2)
+        if a != b:
+            pairs.add((min(a, b), max(a, b)))
+    pairs = np.array(sorted(pairs)).T
+    # both directions, as in the PPI edge_index
+    return pairs, np.concatenate([pairs, pairs[::-1]], 1)
+
+
+def test_edge_null_p_values_are_uniform():
+    pairs, edge_index = _undirected_graph()
+    modules = [list(range(start, start + 10)) for start in range(0, 60, 10)]
+    rng = np.random.default_rng(1)
+
+    p_values = []
+    for rep in range(150):
+        masks = rng.random(pairs.shape[1])
+        _, p, _ = module_permutation_test(edge_index, np.concatenate([masks, masks]), modules,
+                                          n_permutations=199, random_seed=rep)
+        p_values.append(p[~np.isnan(p)])
+    p_values = np.concatenate(p_values)
+
+    assert 0.02 < (p_values < 0.05).mean() < 0.09
+    assert 0.14 < (p_values < 0.2).mean() < 0.26
+    assert abs(p_values.mean() - 0.5) < 0.05
+
+
+def test_important_module_is_significant():
+    pairs, edge_index = _undirected_graph()
+    modules = [list(range(start, start + 10)) for start in range(0, 60, 10)]
+    masks = np.random.default_rng(2).random(pairs.shape[1]) * 0.5
+    masks[(pairs < 10).all(0)] = 1.0
+
+    importance, p, q = module_permutation_test(edge_index, np.concatenate([masks, masks]), modules,
+                                               n_permutations=199, random_seed=0)
+
+    assert importance[0] == 1.0
+    assert p[0] == 1 / 200
+    assert q[0] < 0.05
+
+
+def test_fdr_bh():
+    p = np.array([0.01, 0.04, 0.03, np.nan, 0.5])
+    q = fdr_bh(p)
+
+    # p * m / rank with m = 4 valid values, monotone in the rank
+    assert np.allclose(q[[0, 2, 1, 4]], [0.04, 0.04 * 4 / 3, 0.04 * 4 / 3, 0.5])
+    assert np.isnan(q[3])
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torch_geometric")
+
+from torch_geometric.data import Data
+
+from GNNSubNet.gnn_explainer import BatchedForward
+from GNNSubNet.graphcheb import GraphCheb
+from GNNSubNet.occlusion import available_memory, occlusion_importance
+
+
+def test_available_memory_counts_reclaimable_memory():
+    try:
+        free = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        pytest.skip("no sysconf")
+    assert available_memory() >= free * 0.9
+
+
+def test_chunks_match_single_knockouts():
+    torch.manual_seed(0)
+    edge_index = torch.tensor([[0, 1, 1, 2, 2, 3], [1, 0, 2, 1, 3, 2]])
+    dataset = [Data(x=torch.randn(4, 1), edge_index=edge_index, y=torch.tensor(i % 2)) for i in range(10)]
+    model = GraphCheb(num_node_features=1, hidden_channels=4, K=2, layers_nr=1, num_classes=2)
+
+    acc, logit = occlusion_importance(model, dataset, "cheb2", chunk_size=3, log=False)
+
+    forward = BatchedForward(model, "cheb2", dataset[0])
+    x = forward.node_features(dataset)
+    labels = torch.tensor([int(graph.y) for graph in dataset])
+    with torch.no_grad():
+        base = forward(x)
+        for gene in range(4):
+            knocked = x.clone()
+            knocked[:, gene] = 0.0
+            out = forward(knocked)
+            expected_acc = (base.argmax(-1) == labels).float().mean() - (out.argmax(-1) == labels).float().mean()
+            expected_logit = (base - out).gather(1, labels.view(-1, 1)).mean()
+            assert np.isclose(acc[gene], float(expected_acc))
+            assert np.isclose(logit[gene], float(expected_logit), atol=1e-6)
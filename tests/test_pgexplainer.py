@@ -0,0 +1,23 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from GNNSubNet.PGExplainer import map_edge_weights
+
+
+def test_map_edge_weights_both_directions():
+    # every edge once, in another order than the target
+    edge_index = torch.tensor([[1, 0], [2, 1]])
+    weights = torch.tensor([[0.2, 0.7]])
+    target = torch.tensor([[0, 1, 1, 2], [1, 0, 2, 1]])
+
+    mapped = map_edge_weights(edge_index, weights, target)
+
+    assert torch.allclose(mapped, torch.tensor([[0.7, 0.7, 0.2, 0.2]]))
+
+
+def test_pgexplainer_edge_mask_matches_edge_index(graphcnn):
+    graphcnn.explain_pgexplainer(epochs=1, communities=True)
+
+    assert len(graphcnn.edge_mask) == graphcnn.dataset[0].edge_index.shape[1]
+    assert graphcnn.patient_edge_masks.shape[1] == graphcnn.dataset[0].edge_index.shape[1]
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from GNNSubNet.results_bundle import ResultsBundle, save_bundle
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(tmp_path, compress):
+    path = tmp_path / "results.gnnsubnet"
+    arrays = dict(node_mask=np.random.rand(7), node_mask_matrix=np.random.rand(7, 3).astype(np.float32),
+                  empty=np.zeros((0, 2)), gene_names=np.array(["a", "bb", "ccc"]))
+    modules = [[0, 1, 2], [5], [3, 4]]
+
+    save_bundle(path, arrays, metadata=dict(n_runs=3), modules=modules, compress=compress)
+
+    with ResultsBundle(path) as bundle:
+        assert bundle.metadata == dict(n_runs=3)
+        assert bundle.modules == modules
+        for name, value in arrays.items():
+            assert bundle[name].dtype == value.dtype
+            np.testing.assert_array_equal(bundle[name], value)
+        assert isinstance(bundle["node_mask_matrix"], np.memmap) != compress
@@ -0,0 +1,47 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torch_geometric")
+
+from torch_geometric.data import Data
+
+from GNNSubNet.gnn_explainer import BatchedForward
+from GNNSubNet.graphcheb import GraphCheb
+from GNNSubNet.shapley import coalition_values, module_shapley, node_modules
+
+
+@pytest.fixture
+def model_and_data():
+    torch.manual_seed(0)
+    edge_index = torch.tensor([[0, 1, 1, 2, 2, 3, 3, 4, 4, 5], [1, 0, 2, 1, 3, 2, 4, 3, 5, 4]])
+    dataset = [Data(x=torch.randn(6, 1), edge_index=edge_index, y=torch.tensor(i % 2)) for i in range(8)]
+    model = GraphCheb(num_node_features=1, hidden_channels=4, K=2, layers_nr=1, num_classes=2)
+    modules = [[0, 1], [2, 3], [4]]
+    return model, dataset, modules
+
+
+def test_shapley_values_add_up(model_and_data):
+    model, dataset, modules = model_and_data
+    shapley, se, n_perm = module_shapley(model, dataset, "cheb2", modules, max_permutations=20,
+                                         batch_permutations=8, rel_tol=0, random_seed=0)
+
+    # efficiency: every permutation's contributions sum to v(all modules) - v(no module)
+    forward = BatchedForward(model, "cheb2", dataset[0])
+    x = forward.node_features(dataset)
+    target = forward(x).argmax(-1)
+    ends = coalition_values(forward, x, target, torch.tensor([[False] * 3, [True] * 3]), node_modules(modules, 6))
+    assert np.isclose(shapley.sum(), float(ends[1] - ends[0]), atol=1e-5)
+    # the last batch is clipped
+    assert n_perm == 20
+
+
+def test_shapley_does_not_depend_on_workers(model_and_data):
+    model, dataset, modules = model_and_data
+    kwargs = dict(max_permutations=24, batch_permutations=4, min_permutations=8, rel_tol=0.05, random_seed=1)
+
+    serial = module_shapley(model, dataset, "cheb2", modules, n_jobs=1, **kwargs)
+    parallel = module_shapley(model, dataset, "cheb2", modules, n_jobs=2, **kwargs)
+
+    assert serial[2] == parallel[2]
+    assert np.allclose(serial[0], parallel[0])
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from GNNSubNet.edge_importance import calc_edge_importance
+from GNNSubNet.streaming import stream_runs
+
+
+def test_streamed_runs_match_the_batch_statistics():
+    rng = np.random.default_rng(0)
+    edge_index = np.array([[0, 1, 1, 2, 2, 3], [1, 0, 2, 1, 3, 2]])
+    raw = rng.normal(size=(12, 4))
+    node_runs = np.zeros((4, 12), dtype=np.float32)
+    edge_runs = np.zeros((12, 6), dtype=np.float32)
+
+    result = stream_runs(((idx, mask, 1) for idx, mask in enumerate(raw)), edge_index, 12,
+                         community_every=100, quantiles=(0.1, 0.5, 0.9),
+                         node_runs=node_runs, edge_runs=edge_runs)
+
+    node_masks = 1 / (1 + np.exp(-raw))
+    edge_masks = np.stack([calc_edge_importance(torch.tensor(mask).reshape(-1, 1), torch.tensor(edge_index))
+                           .sigmoid().numpy().reshape(-1) for mask in raw])
+    node_stats, edge_stats = result["node_stats"], result["edge_stats"]
+    assert np.allclose(node_stats.mean, node_masks.mean(0))
+    assert np.allclose(node_stats.std, node_masks.std(0, ddof=1))
+    assert np.allclose(edge_stats.mean, edge_masks.mean(0))
+    assert np.allclose(node_stats.quantiles, np.quantile(node_masks, (0.1, 0.5, 0.9), axis=0), atol=1e-6)
+    assert np.allclose(node_runs, node_masks.T, atol=1e-6)
+    assert np.allclose(edge_runs, edge_masks, atol=1e-6)
+
+
+def test_explain_streaming_keeps_runs_and_quantiles(graphcnn):
+    graphcnn.keep_runs = True
+    graphcnn.mask_quantiles = (0.5,)
+    graphcnn.explain_streaming(n_runs=4, communities=False, runs_per_batch=2, max_epochs=5)
+
+    runs = np.asarray(graphcnn.node_mask_matrix)
+    assert runs.shape == (len(graphcnn.node_mask), 4)
+    assert np.allclose(graphcnn.node_mask, runs.mean(1), atol=1e-6)
+    assert np.asarray(graphcnn.run_edge_masks).shape == (4, len(graphcnn.edge_mask))
+    assert np.allclose(graphcnn.node_mask_quantiles[0], np.median(runs, 1), atol=1e-6)